@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/atomic_file.py - атомарная запись файлов состояния
+
+import json
+import os
+import tempfile
+
+
+def write_json_atomic(path: str, data, indent: int = 2):
+    """Записывает JSON во временный файл рядом и подменяет им исходный через os.replace.
+
+    Читатель всегда видит либо старую, либо новую версию файла целиком.
+    """
+    directory = os.path.dirname(path) or "."
+    name = os.path.basename(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/bot_api.py - общий HTTP-клиент для вспомогательных вызовов Bot API
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramAPIError, TelegramNotFound, TelegramUnauthorizedError
+from aiogram.utils.token import TokenValidationError
+
+from atomic_file import write_json_atomic
+
+USERNAMES_FILE = "/var/www/imlerih_bot/bot_usernames.json"
+
+# Общая keep-alive сессия: по умолчанию это сессия основного бота,
+# поэтому вызовы getMe для чужих токенов идут через тот же пул TCP/TLS соединений
+_shared_session = None
+_own_session = False
+
+
+def set_shared_session(session: AiohttpSession):
+    """Назначает общую сессию (обычно bot.session основного бота)"""
+    global _shared_session, _own_session
+    _shared_session = session
+    _own_session = False
+
+
+def get_shared_session() -> AiohttpSession:
+    global _shared_session, _own_session
+    if _shared_session is None:
+        _shared_session = AiohttpSession()
+        _own_session = True
+    return _shared_session
+
+
+async def close_shared_session():
+    """Закрывает общую сессию, если она была создана здесь, а не передана извне"""
+    global _shared_session, _own_session
+    if _shared_session is not None and _own_session:
+        await _shared_session.close()
+    _shared_session = None
+    _own_session = False
+
+
+def bot_for_token(token: str) -> Bot:
+    """Лёгкий Bot для произвольного токена поверх общей сессии (закрывать не нужно)"""
+    return Bot(token=token, session=get_shared_session())
+
+
+def bot_id_from_token(token: str) -> str:
+    return token.split(":", 1)[0]
+
+
+class UsernameCache:
+    """Постоянный кэш token -> username, ключ - id бота.
+
+    Успешные ответы хранятся ttl секунд, отказы Telegram (неверный или
+    отозванный токен, бот без username) - negative_ttl секунд.
+    Сетевые ошибки не кэшируются. Файл пишется в потоке не чаще раза в
+    save_delay секунд (все изменения за это время - одной записью) и при flush().
+    """
+
+    def __init__(self, path: str = USERNAMES_FILE, ttl: float = 7 * 24 * 3600, negative_ttl: float = 600,
+                 save_delay: float = 5.0):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.save_delay = save_delay
+        self._entries = None
+        self._dirty = False
+        self._save_task = None
+        # Параллельные запросы одного и того же бота ждут первый
+        self._inflight = {}
+        self.stats = {"hits": 0, "negative_hits": 0, "misses": 0, "api_errors": 0, "saves": 0}
+
+    def _read(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logging.error(f"❌ Ошибка чтения кэша username: {e}")
+            return {}
+
+    async def load(self):
+        """Читает файл кэша в потоке (один раз; lookup и store работают после загрузки)"""
+        if self._entries is not None:
+            return
+        entries = await asyncio.to_thread(self._read)
+        # Пока файл читался, кэш мог загрузить параллельный вызов
+        if self._entries is None:
+            self._entries = entries
+
+    async def flush(self):
+        """Записывает изменения в файл (fsync и rename - в отдельном потоке)"""
+        if not self._dirty:
+            return
+        self._dirty = False
+        # Записи не меняются после создания - достаточно копии словаря
+        entries = dict(self._entries)
+        try:
+            await asyncio.to_thread(write_json_atomic, self.path, entries)
+            self.stats["saves"] += 1
+        except Exception as e:
+            self._dirty = True
+            logging.error(f"❌ Ошибка сохранения кэша username: {e}")
+
+    async def _save_later(self):
+        try:
+            await asyncio.sleep(self.save_delay)
+            await self.flush()
+        finally:
+            self._save_task = None
+
+    async def close(self):
+        """Отменяет отложенную запись и сохраняет всё сразу"""
+        if self._save_task is not None:
+            self._save_task.cancel()
+            await asyncio.gather(self._save_task, return_exceptions=True)
+        await self.flush()
+
+    def lookup(self, bot_id: str):
+        """Возвращает (найдено, username); username None - закэшированный отказ"""
+        entry = self._entries.get(bot_id)
+        if entry is None:
+            return False, None
+        ttl = self.ttl if entry.get("username") else self.negative_ttl
+        if time.time() - entry.get("checked_at", 0) > ttl:
+            return False, None
+        return True, entry.get("username")
+
+    def store(self, bot_id: str, username):
+        self._entries[bot_id] = {"username": username, "checked_at": time.time()}
+        self._dirty = True
+        if self._save_task is None:
+            self._save_task = asyncio.get_running_loop().create_task(self._save_later())
+
+    async def get_username(self, token: str):
+        bot_id = bot_id_from_token(token)
+        await self.load()
+        found, username = self.lookup(bot_id)
+        if found:
+            self.stats["hits" if username else "negative_hits"] += 1
+            return username
+
+        future = self._inflight.get(bot_id)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[bot_id] = future
+        try:
+            username = await self._fetch(token)
+            future.set_result(username)
+            return username
+        finally:
+            if not future.done():
+                future.set_result(None)
+            self._inflight.pop(bot_id, None)
+
+    async def _fetch(self, token: str):
+        bot_id = bot_id_from_token(token)
+        try:
+            me = await bot_for_token(token).get_me(request_timeout=10)
+        except (TelegramUnauthorizedError, TelegramNotFound, TokenValidationError) as e:
+            logging.warning(f"⚠️ Telegram отклонил токен {bot_id}: {e}")
+            self.store(bot_id, None)
+            return None
+        except (TelegramAPIError, asyncio.TimeoutError, OSError) as e:
+            self.stats["api_errors"] += 1
+            logging.error(f"❌ Ошибка запроса getMe для {bot_id}: {e}")
+            return None
+
+        if me.username:
+            logging.info(f"✅ Получен username бота: @{me.username}")
+        else:
+            logging.warning("⚠️ У бота нет username")
+        # Бот без username - тоже отказ, кэшируется на negative_ttl
+        self.store(bot_id, me.username)
+        return me.username
+
+
+username_cache = UsernameCache()
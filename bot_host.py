@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/bot_host.py - хост клонов: много токенов в одном процессе
+#
+# Вместо отдельного процесса clone_runtime.py на каждый клон все клоны работают в одном
+# asyncio-процессе: один Dispatcher с обработчиками из clone_handlers, одна
+# HTTP-сессия и свой цикл getUpdates на каждый токен. Клоны подключаются и
+# отключаются на лету командами через unix-сокет.
+#
+# С --webhook-url клоны получают обновления через один общий сервер вебхуков
+# (webhook_server.py); клон, для которого setWebhook не удался, остаётся на getUpdates.
+#
+# Запуск: python3 bot_host.py [--socket /var/www/imlerih_bot/bot_host.sock] [--name host] [--no-state]
+#                             [--webhook-url https://example.com --webhook-port 8080] [--api-server URL]
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramAPIError, TelegramUnauthorizedError
+from aiogram.utils.token import TokenValidationError
+
+import clone_handlers
+import metrics
+from atomic_file import write_json_atomic
+from fsm_storage import StateStoreStorage
+from log_pipeline import setup_logging
+from send_queue import send_queue
+from state_store import StateStore
+from update_poller import UpdatePoller
+from webhook_server import WebhookServer
+
+BASE_DIR = "/var/www/imlerih_bot"
+HOST_SOCKET = f"{BASE_DIR}/bot_host.sock"
+HOSTED_CLONES_FILE = f"{BASE_DIR}/hosted_clones.json"
+
+
+class BotHost:
+    """Процесс, в котором работает произвольное число клонов"""
+
+    def __init__(self, state_file: str = HOSTED_CLONES_FILE, connection_limit: int = 1000,
+                 name: str = "host", webhook: WebhookServer = None, api_server: str = None):
+        # state_file=None - список клонов хранит кто-то другой (например, shard_supervisor)
+        self.state_file = state_file
+        self.name = name
+        self.webhook = webhook
+        # Каждый клон на polling держит одно long-polling соединение, поэтому лимит пула - с запасом
+        self.session = AiohttpSession(limit=connection_limit)
+        if api_server:
+            self.session.api = TelegramAPIServer.from_base(api_server)
+        # Лимиты отправки у каждого клона свои, очередь - общая на процесс
+        self.session.middleware(send_queue)
+
+        # offset getUpdates каждого клона - в state.db, чтобы после перезапуска продолжить с того же места
+        self.store = StateStore()
+        # Состояния диалогов - там же: клон, переехавший на другой воркер, продолжает с того же места
+        self.storage = StateStoreStorage(self.store)
+        self.dp = Dispatcher(storage=self.storage)
+        self.dp.include_router(clone_handlers.create_router())
+        metrics.instrument_dispatcher(self.dp)
+
+        self.bots = {}
+        self.tokens = {}
+        self._polling_tasks = {}
+        self._pollers = {}
+        self._webhook_clones = set()
+        # attach/detach одного клона идут по очереди: иначе два attach (команда и перебалансировка)
+        # оба пройдут проверку до get_me и запустят два цикла getUpdates на один токен
+        self._clone_locks = {}
+        self._server = None
+        self._probe_task = None
+
+        self.stats = {"attached": 0, "detached": 0, "updates": 0, "update_errors": 0, "polling_errors": 0}
+        # Нагрузка, которую считает _load_probe: обновлений в секунду и задержка event loop
+        self.load = {"updates_per_sec": 0.0, "loop_lag": 0.0, "loop_lag_max": 0.0}
+        metrics.gauge("bot_host_clones", "Клоны, подключённые к хосту", lambda: len(self.bots))
+
+    # ========== ПОДКЛЮЧЕНИЕ / ОТКЛЮЧЕНИЕ КЛОНОВ ==========
+
+    def _clone_lock(self, clone_id: str) -> asyncio.Lock:
+        lock = self._clone_locks.get(clone_id)
+        if lock is None:
+            lock = self._clone_locks[clone_id] = asyncio.Lock()
+        return lock
+
+    async def attach(self, clone_id: str, token: str, persist: bool = True) -> dict:
+        async with self._clone_lock(clone_id):
+            return await self._attach(clone_id, token, persist)
+
+    async def _attach(self, clone_id: str, token: str, persist: bool) -> dict:
+        if clone_id in self.bots:
+            return {"ok": True, "clone_id": clone_id, "already_attached": True}
+
+        started = time.monotonic()
+        try:
+            bot = Bot(token=token, session=self.session)
+            me = await bot.get_me()
+        except (TelegramAPIError, TokenValidationError) as e:
+            logging.error(f"❌ [{clone_id}] Не удалось подключить клона: {e}")
+            return {"ok": False, "clone_id": clone_id, "error": str(e)}
+
+        self.bots[clone_id] = bot
+        self.tokens[clone_id] = token
+        await clone_handlers.register_clone(clone_id, token)
+        mode = "webhook"
+        if self.webhook is None or not await self.webhook.register(
+                bot, lambda update: self._process(clone_id, bot, update),
+                allowed_updates=self.dp.resolve_used_update_types()):
+            mode = "polling"
+            self._polling_tasks[clone_id] = asyncio.create_task(self._poll(clone_id, bot))
+        else:
+            self._webhook_clones.add(clone_id)
+        self.stats["attached"] += 1
+        if persist:
+            self._save_state()
+
+        elapsed = time.monotonic() - started
+        logging.info(f"✅ [{clone_id}] Клон @{me.username} подключён к хосту за {elapsed:.2f} сек, {mode} "
+                     f"(всего клонов: {len(self.bots)})")
+        return {"ok": True, "clone_id": clone_id, "pid": os.getpid(), "username": me.username, "mode": mode}
+
+    async def detach(self, clone_id: str, persist: bool = True, release: bool = True) -> dict:
+        """release=False - при остановке хоста вебхук остаётся у Telegram, обновления дождутся перезапуска"""
+        async with self._clone_lock(clone_id):
+            return await self._detach(clone_id, persist, release)
+
+    async def _detach(self, clone_id: str, persist: bool, release: bool) -> dict:
+        task = self._polling_tasks.pop(clone_id, None)
+        bot = self.bots.pop(clone_id, None)
+        self.tokens.pop(clone_id, None)
+        await clone_handlers.unregister_clone(clone_id)
+        if clone_id in self._webhook_clones:
+            self._webhook_clones.discard(clone_id)
+            # Снимаем вебхук, иначе клон не сможет работать через getUpdates в другом процессе
+            await self.webhook.unregister(bot, delete_webhook=release)
+        elif task is None:
+            return {"ok": False, "clone_id": clone_id, "error": "not attached"}
+        else:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self.stats["detached"] += 1
+        if persist:
+            self._save_state()
+        logging.info(f"⛔ [{clone_id}] Клон отключён от хоста (осталось: {len(self.bots)})")
+        return {"ok": True, "clone_id": clone_id}
+
+    def _save_state(self):
+        if not self.state_file:
+            return
+        try:
+            write_json_atomic(self.state_file, self.tokens)
+            os.chmod(self.state_file, 0o600)
+        except Exception as e:
+            logging.error(f"❌ Ошибка сохранения списка клонов хоста: {e}")
+
+    def _load_state(self) -> dict:
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logging.error(f"❌ Ошибка чтения списка клонов хоста: {e}")
+            return {}
+
+    # ========== ПОЛУЧЕНИЕ ОБНОВЛЕНИЙ ==========
+
+    async def _poll(self, clone_id: str, bot: Bot):
+        poller = UpdatePoller(bot, lambda update: self._process(clone_id, bot, update), store=self.store,
+                              name=clone_id, allowed_updates=self.dp.resolve_used_update_types())
+        self._pollers[clone_id] = poller
+        try:
+            await poller.run()
+        except TelegramUnauthorizedError:
+            # Токен отозван - клон больше не может работать
+            logging.error(f"❌ [{clone_id}] Токен отозван, клон отключается")
+            await clone_handlers.unregister_clone(clone_id)
+            self.bots.pop(clone_id, None)
+            self.tokens.pop(clone_id, None)
+            self._polling_tasks.pop(clone_id, None)
+            self._save_state()
+        finally:
+            self._pollers.pop(clone_id, None)
+            # Счётчики ошибок polling остаются в статистике хоста и после отключения клона
+            self.stats["polling_errors"] += poller.stats["polling_errors"]
+
+    async def _process(self, clone_id: str, bot: Bot, update):
+        self.stats["updates"] += 1
+        try:
+            await self.dp.feed_update(bot, update, clone_id=clone_id)
+        except Exception as e:
+            self.stats["update_errors"] += 1
+            logging.error(f"❌ [{clone_id}] Ошибка обработки обновления {update.update_id}: {e}", exc_info=True)
+
+    # ========== УПРАВЛЕНИЕ ЧЕРЕЗ UNIX-СОКЕТ ==========
+
+    async def handle_command(self, command: dict) -> dict:
+        cmd = command.get("cmd")
+        if cmd == "attach":
+            return await self.attach(command["clone_id"], command["token"])
+        if cmd == "detach":
+            return await self.detach(command["clone_id"])
+        if cmd == "list":
+            return {"ok": True, "clones": sorted(self.bots)}
+        if cmd == "stats":
+            return {"ok": True, "stats": self.get_stats()}
+        return {"ok": False, "error": f"unknown command: {cmd}"}
+
+    async def serve_control(self, socket_path: str = HOST_SOCKET):
+        self._server = await start_control_server(socket_path, self.handle_command)
+        logging.info(f"👂 Управление хостом клонов: {socket_path}")
+
+    # ========== НАГРУЗКА ==========
+
+    async def _load_probe(self, interval: float = 1.0):
+        """Раз в interval секунд замеряет задержку event loop и скорость обработки обновлений"""
+        last_updates = self.stats["updates"]
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            elapsed = time.monotonic() - started
+            lag = max(0.0, elapsed - interval)
+            self.load["loop_lag"] = lag
+            metrics.observe_loop_lag(lag)
+            self.load["loop_lag_max"] = max(self.load["loop_lag_max"], lag)
+            self.load["updates_per_sec"] = (self.stats["updates"] - last_updates) / elapsed
+            last_updates = self.stats["updates"]
+
+    # ========== ЗАПУСК ==========
+
+    async def start(self, socket_path: str = HOST_SOCKET):
+        await clone_handlers.start_resources()
+        if self.webhook is not None:
+            await self.webhook.start()
+        self._probe_task = asyncio.create_task(self._load_probe())
+        saved = self._load_state()
+        results = await asyncio.gather(*[
+            self.attach(clone_id, token, persist=False) for clone_id, token in saved.items()
+        ])
+        logging.info(f"✅ Хост клонов запущен: подключено {sum(r['ok'] for r in results)} из {len(saved)}")
+        if socket_path:
+            await self.serve_control(socket_path)
+
+    async def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for clone_id in list(self.bots):
+            await self.detach(clone_id, persist=False, release=False)
+        if self.webhook is not None:
+            await self.webhook.stop()
+        await clone_handlers.stop_resources()
+        send_queue.close()
+        await self.session.close()
+        await self.storage.close()
+        self.store.close()
+        logging.info(f"⛔ Хост клонов остановлен: {self.get_stats()}")
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["clones"] = len(self.bots)
+        stats["in_flight"] = sum(p.in_flight for p in self._pollers.values())
+        stats["polling_errors"] += sum(p.stats["polling_errors"] for p in self._pollers.values())
+        stats["catching_up"] = sum(p.catching_up for p in self._pollers.values())
+        stats["backlog_updates"] = sum(p.stats["backlog_updates"] for p in self._pollers.values())
+        stats["stale_callbacks"] = sum(p.stats["stale_callbacks"] for p in self._pollers.values())
+        stats["webhook_clones"] = len(self._webhook_clones)
+        if self.webhook is not None:
+            stats["webhook"] = self.webhook.get_stats()
+        stats["send_queue"] = send_queue.get_stats()
+        stats["fsm"] = self.storage.get_stats()
+        stats.update(self.load)
+        stats["rss_bytes"] = read_rss(os.getpid())
+        stats["pid"] = os.getpid()
+        stats["name"] = self.name
+        return stats
+
+
+def read_rss(pid: int) -> int:
+    """RSS процесса в байтах по /proc/<pid>/statm (0, если процесса нет)"""
+    try:
+        with open(f"/proc/{pid}/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+async def start_control_server(socket_path: str, handle_command):
+    """Unix-сокет с протоколом "JSON-строка запрос - JSON-строка ответ" """
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await handle_command(json.loads(line))
+                except Exception as e:
+                    response = {"ok": False, "error": str(e)}
+                writer.write(json.dumps(response, ensure_ascii=False).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(handle_connection, path=socket_path)
+    os.chmod(socket_path, 0o600)
+    return server
+
+
+async def send_command(command: dict, socket_path: str = HOST_SOCKET, timeout: float = 15) -> dict:
+    """Отправляет команду запущенному хосту и возвращает ответ"""
+    reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(socket_path), timeout=timeout)
+    try:
+        writer.write(json.dumps(command, ensure_ascii=False).encode() + b"\n")
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), timeout=timeout)
+        return json.loads(line) if line else {"ok": False, "error": "empty response"}
+    finally:
+        writer.close()
+
+
+async def main(args):
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    webhook = None
+    if args.webhook_url:
+        webhook = WebhookServer(base_url=args.webhook_url, host=args.webhook_host, port=args.webhook_port,
+                                path_prefix=f"/{args.name}")
+
+    # Воркер shard_supervisor не хранит список клонов сам - его назначает супервизор
+    host = BotHost(state_file=None if args.no_state else HOSTED_CLONES_FILE, name=args.name,
+                   webhook=webhook, api_server=args.api_server)
+    await host.start(args.socket)
+    # Задержку event loop для /metrics уже замеряет _load_probe
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = metrics.MetricsServer(port=args.metrics_port)
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logging.error(f"❌ Не удалось запустить сервер метрик: {e}")
+            metrics_server = None
+    try:
+        await stop_event.wait()
+    finally:
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await host.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Хост клонов")
+    parser.add_argument("--socket", default=HOST_SOCKET)
+    parser.add_argument("--name", default="host")
+    parser.add_argument("--no-state", action="store_true")
+    parser.add_argument("--webhook-url", default=None, help="внешний адрес сервера вебхуков; без него - polling")
+    parser.add_argument("--webhook-host", default="127.0.0.1")
+    parser.add_argument("--webhook-port", type=int, default=8081)
+    parser.add_argument("--api-server", default=None, help="свой Bot API, например fake_bot_api.py")
+    parser.add_argument("--metrics-port", type=int, default=None, help="порт /metrics на 127.0.0.1; без него - не запускать")
+    args = parser.parse_args()
+
+    setup_logging(f"{BASE_DIR}/logs/bot_{args.name}.log",
+                  fmt=f'%(asctime)s - {args.name.upper()} - %(levelname)s - %(message)s')
+
+    asyncio.run(main(args))
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/clone_handlers.py - обработчики клона, общие для всех клонов
+#
+# Раньше эти обработчики вставлялись в bot.py каждого клона из шаблона лаунчера.
+# Теперь это один модуль: create_router() отдаёт роутер, а id клона приходит
+# в обработчики через данные диспетчера (clone_id), поэтому один процесс
+# может обслуживать сколько угодно клонов.
+
+import json
+import logging
+import os
+import time
+
+from aiogram import Bot, Router, types
+from aiogram.filters import Command
+
+from db_pool import DBPool
+from screens import (CREATE_CLONE_HINT, Screen, ScreenRouter, back_button, clone_menu, common_screens,
+                     create_bot_menu, main_menu, main_menu_disabled, menu_button)
+from expiry import ExpiryScheduler
+from failover import LeaseElector
+from log_pipeline import sampled
+from spam_guard import SpamGuard, generate_captcha
+from state_store import StateStore
+from status_watcher import StatusWatcher
+from text_cache import TextCache
+
+logger = logging.getLogger("clone")
+
+CONFIG_FILE = "/var/www/imlerih_bot/config.json"
+MAIN_BOT_STATUS_FILE = "/var/www/imlerih_bot/main_bot_status.json"
+TEXTS_SNAPSHOT_FILE = "/var/www/imlerih_bot/texts_snapshot.json"
+
+DB_CONFIG = {
+    "host": "localhost",
+    "database": "karantir_bot",
+    "user": "karantir_user",
+    "password": "karantir_pass",
+    "port": 5432,
+    "pool_min_size": 1,
+    "pool_max_size": 2
+}
+
+# Значения по умолчанию; сами лимиты берутся из секции "security" config.json,
+# как у основного бота: счётчики и капчи у них общие
+CAPTCHA_LIFETIME = 300
+SPAM_TIME_WINDOW = 30
+SPAM_MESSAGE_LIMIT = 3
+
+# Failover: первые FAILOVER_STANDBYS клонов (по порядку создания) - резерв основного бота.
+# Аренду основной бот продлевает раз в FAILOVER_INTERVAL сек, она живёт FAILOVER_LEASE_TTL сек
+FAILOVER_STANDBYS = 2
+FAILOVER_LEASE_TTL = 3.0
+FAILOVER_INTERVAL = 1.0
+FAILOVER_RANK_DELAY = 1.0
+
+# Пул подключений, кэш и защита от спама создаются в start_resources() один раз
+# на процесс, сколько бы клонов в нём ни работало
+db_pool = None
+text_cache = None
+expiry_scheduler = None
+spam_guard = None
+state_store = None
+failover = None
+# Статус основного бота: файл читается при изменении, а не на каждое меню
+status_watcher = StatusWatcher(MAIN_BOT_STATUS_FILE)
+
+# ========= СТАТУС ОСНОВНОГО БОТА ========
+def check_main_bot_status(clone_id: str = None):
+    """Роль основного у другого бота (основного или клона-лидера) - Профиль и Клон бота недоступны.
+
+    Всё из памяти: аренду перечитывает failover, файл статуса - status_watcher.
+    Если аренду никто не держит, решает файл статуса.
+    """
+    if failover is not None:
+        leader = failover.leader
+        if leader is not None:
+            return leader != clone_id
+    return status_watcher.running
+
+# ========= МЕНЮ С УЧЕТОМ СТАТУСА ========
+MENU_TEXT = "📋 <b>Меню</b>"
+MENU_TEXT_MAIN_RUNNING = "📋 <b>Меню</b>\n⚠️ <b>Основной бот работает</b>\nФункции Профиль и Клон бота временно недоступны"
+
+def menu_screen(clone_id: str = None):
+    """Готовые текст и клавиатура меню: пока основной бот работает, Профиль и Клон бота неактивны"""
+    if check_main_bot_status(clone_id):
+        return MENU_TEXT_MAIN_RUNNING, main_menu_disabled
+    return MENU_TEXT, main_menu
+
+# ========= ОБЩИЕ РЕСУРСЫ ПРОЦЕССА ========
+def load_security_config(path: str = CONFIG_FILE) -> dict:
+    """Секция "security" config.json основного бота (пустая, если файла нет)"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("security", {})
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Failed to read {path}: {e}")
+        return {}
+
+async def start_resources(security: dict = None):
+    """Создаёт пул БД, кэш текстов (снимок пишет основной бот, клоны только читают) и защиту от спама.
+
+    security - секция "security" config.json: лимиты должны совпадать с основным ботом.
+    """
+    global db_pool, text_cache, expiry_scheduler, spam_guard, state_store, failover
+    if text_cache is not None:
+        return
+    db_pool = DBPool(DB_CONFIG)
+    text_cache = TextCache(db_pool, snapshot_path=TEXTS_SNAPSHOT_FILE)
+    text_cache.load_snapshot()
+    text_cache.start(write_snapshot=False)
+
+    state_store = StateStore()
+    expiry_scheduler = ExpiryScheduler()
+    security = security if security is not None else load_security_config()
+    spam_guard = SpamGuard(state_store, expiry_scheduler,
+                           limit=security.get("spam_message_limit", SPAM_MESSAGE_LIMIT),
+                           window=security.get("spam_time_window", SPAM_TIME_WINDOW),
+                           captcha_lifetime=security.get("captcha_lifetime", CAPTCHA_LIFETIME),
+                           flush_interval=security.get("shared_state_flush_interval", 0.5))
+    failover = LeaseElector(state_store, ttl=FAILOVER_LEASE_TTL, interval=FAILOVER_INTERVAL,
+                            rank_delay=FAILOVER_RANK_DELAY)
+    expiry_scheduler.start()
+    spam_guard.start()
+    status_watcher.start()
+    failover.start()
+
+async def stop_resources():
+    global db_pool, text_cache, expiry_scheduler, spam_guard, state_store, failover
+    await status_watcher.stop()
+    if failover is not None:
+        logger.info(f"Failover stats: {failover.get_stats()}")
+        await failover.stop()
+    if spam_guard is not None:
+        logger.info(f"Spam guard stats: {spam_guard.get_stats()}")
+        await spam_guard.stop()
+        await expiry_scheduler.stop()
+    if state_store is not None:
+        state_store.close()
+    if text_cache is not None:
+        logger.info(f"Text cache stats: {text_cache.get_stats()}")
+        await text_cache.stop()
+    if db_pool is not None:
+        await db_pool.close()
+    db_pool = None
+    text_cache = None
+    expiry_scheduler = None
+    spam_guard = None
+    state_store = None
+    failover = None
+
+# ========= FAILOVER ========
+async def register_clone(clone_id: str, token: str):
+    """Делает клона резервом основного бота, если он среди первых FAILOVER_STANDBYS созданных"""
+    try:
+        tokens = await state_store.aio.list_backup_tokens()
+    except Exception as e:
+        logger.error(f"[{clone_id}] Failed to read backup tokens: {e}")
+        return None
+    if token not in tokens[:FAILOVER_STANDBYS]:
+        return None
+    rank = tokens.index(token) + 1
+    failover.add_candidate(clone_id, rank)
+    logger.info(f"[{clone_id}] Standby for the main bot, rank {rank}")
+    return rank
+
+async def unregister_clone(clone_id: str):
+    if failover is not None:
+        await failover.remove_candidate(clone_id)
+
+# ========= БАЗОВЫЕ ФУНКЦИИ ========
+async def get_message_by_id(message_id):
+    """Получить текст из БД (через кэш)"""
+    try:
+        if text_cache is not None:
+            text = await text_cache.get(message_id)
+            if text:
+                return text
+    except Exception as e:
+        logger.error(f"DB query error: {e}")
+
+    # Fallback тексты
+    fallback = {
+        "welcome": "🌴 <b>ДОБРО ПОЖАЛОВАТЬ В СЕРВИС ИНСПЕКТОРА СЭМА</b>",
+        "profile": "👤 <b>Профиль</b>",
+        "clone": "🤖 <b>Клон бота - защита</b>",
+        "place_order": "🛒 <b>Оформить заказ</b>",
+        "manager": "👨‍💼 <b>Менеджер</b>",
+        "guide_create_clone": "📝 <b>Создание резервного клона</b>"
+    }
+    return fallback.get(message_id, "Текст не найден")
+
+# ========= ЗАЩИТА ОТ СПАМА ========
+async def spam_guard_middleware(handler, message: types.Message, data: dict):
+    """Капча и лимит сообщений до любых обработчиков - общие с основным ботом и другими клонами"""
+    if spam_guard is None or message.from_user is None:
+        return await handler(message, data)
+    user_id = message.from_user.id
+    if not spam_guard.requires_captcha(user_id):
+        return await handler(message, data)
+
+    captcha = spam_guard.captchas.get(user_id)
+    text = (message.text or "").strip()
+    if captcha is not None and text.isdigit() and int(text) == captcha["answer"]:
+        spam_guard.solve(user_id)
+        await message.answer("✅ Капча пройдена успешно! Теперь вы можете продолжить.")
+        return
+
+    logger.info(f"[{data.get('clone_id')}] Captcha for user {user_id}")
+    question, answer = generate_captcha()
+    spam_guard.captchas[user_id] = {"answer": answer, "timestamp": time.time()}
+    await message.answer(
+        f"🔒 <b>Проверка безопасности</b>\n\n"
+        f"Решите пример, чтобы продолжить:\n"
+        f"<b>{question} = ?</b>\n\n"
+        f"Ответьте числом.",
+        parse_mode="HTML"
+    )
+
+# ========= ОБРАБОТЧИКИ КОМАНД ========
+async def start_handler(message: types.Message, clone_id: str):
+    logger.info(f"[{clone_id}] Start from {message.from_user.id}", extra=sampled("start"))
+    text = await get_message_by_id("welcome")
+    await message.answer(text, reply_markup=menu_button, parse_mode="HTML")
+
+async def menu_command_handler(message: types.Message, clone_id: str):
+    logger.info(f"[{clone_id}] Menu command from {message.from_user.id}", extra=sampled("menu"))
+    text, keyboard = menu_screen(clone_id)
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+async def status_handler(message: types.Message, bot: Bot, clone_id: str):
+    """Команда для проверки статуса (для отладки)"""
+    main_bot_status = check_main_bot_status(clone_id)
+    leader = failover.leader if failover is not None else None
+    if status_watcher.data:
+        file_info = f"\n📄 Файл статуса: {json.dumps(status_watcher.data, ensure_ascii=False, indent=2)}"
+    else:
+        file_info = "\n📄 Файл статуса: не найден"
+
+    status_text = "работает ✅" if main_bot_status else "не работает ❌"
+
+    await message.answer(
+        f"🔍 <b>Статус системы</b>\n"
+        f"🤖 Основной бот: {status_text}\n"
+        f"🆔 Этот клон: {clone_id}\n"
+        f"👑 Основной сейчас: {leader or 'никто'}\n"
+        f"🔑 Токен: {bot.token[:10]}...\n"
+        f"{file_info}",
+        parse_mode="HTML"
+    )
+
+async def clone_info_handler(message: types.Message, bot: Bot, clone_id: str):
+    main_bot_status = "работает ✅" if check_main_bot_status(clone_id) else "не работает ❌"
+    await message.answer(
+        f"📊 <b>Информация о клоне</b>\n"
+        f"🤖 ID: {clone_id}\n"
+        f"🔑 Токен: {bot.token[:10]}...\n"
+        f"⚙️ PID: {os.getpid()}\n"
+        f"📡 Основной бот: {main_bot_status}",
+        parse_mode="HTML"
+    )
+
+# ========= ОБРАБОТЧИКИ КНОПОК ========
+async def render_menu(callback: types.CallbackQuery, clone_id: str = None, **context):
+    return menu_screen(clone_id)
+
+async def feature_disabled(callback: types.CallbackQuery, **context) -> bool:
+    await callback.answer("⚠️ Эта функция недоступна пока основной бот работает", show_alert=True)
+    return False
+
+async def main_bot_stopped(callback: types.CallbackQuery, clone_id: str = None, **context) -> bool:
+    """Профиль и клонирование доступны только клону, который сейчас за основного"""
+    if check_main_bot_status(clone_id):
+        return await feature_disabled(callback)
+    return True
+
+clone_screens = ScreenRouter(get_message_by_id, common_screens())
+clone_screens.add("menu", Screen(render=render_menu, parse_mode="HTML"))
+clone_screens.add("profile_disabled", Screen(guards=[feature_disabled]))
+clone_screens.add("clone_disabled", Screen(guards=[feature_disabled]))
+clone_screens.add("profile", Screen(text_key="profile", keyboard=back_button, guards=[main_bot_stopped]))
+clone_screens.add("clone", Screen(
+    text_key="clone",
+    extra="\n\n🤖 <b>Это резервный клон!</b>\nСоздайте своего клона для дополнительной защиты.",
+    keyboard=clone_menu, parse_mode="HTML", guards=[main_bot_stopped]
+))
+clone_screens.add("create_clone", Screen(
+    text_key="guide_create_clone", extra=CREATE_CLONE_HINT, keyboard=create_bot_menu, parse_mode="HTML",
+    guards=[main_bot_stopped]
+))
+clone_screens.add("back_to_welcome", Screen(text_key="welcome", keyboard=menu_button, parse_mode="HTML"))
+
+async def callback_handler(callback: types.CallbackQuery, clone_id: str):
+    logger.info(f"[{clone_id}] Button pressed: {callback.data} from user {callback.from_user.id}",
+                extra=sampled("button"))
+    await clone_screens.dispatch(callback, clone_id=clone_id)
+
+async def echo_handler(message: types.Message, clone_id: str):
+    # Добавляем команду для отладки
+    if message.text and message.text.lower() == "/debug_status":
+        main_bot_running = check_main_bot_status(clone_id)
+        await message.answer(f"Debug: main_bot_running = {main_bot_running}")
+    else:
+        await message.answer(f"Клон получил: {message.text}")
+
+def create_router() -> Router:
+    """Новый роутер с обработчиками клона (роутер можно подключить только к одному диспетчеру)"""
+    router = Router(name="clone")
+    router.message.outer_middleware(spam_guard_middleware)
+    router.message.register(start_handler, Command("start"))
+    router.message.register(menu_command_handler, Command("menu"))
+    router.message.register(status_handler, Command("status"))
+    router.message.register(clone_info_handler, Command("clone_info"))
+    router.callback_query.register(callback_handler)
+    router.message.register(echo_handler)
+    return router
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/clone_jobs.py - очередь задач на создание клонов
+
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import sys
+import time
+
+import bot_host
+
+LAUNCHER_PATH = "/var/www/imlerih_bot/fixed_launcher.py"
+
+# Этапы, о которых сообщает лаунчер в режиме --json
+STAGE_TEXTS = {
+    "queued": "⏳ Заявка на клона в очереди...",
+    "starting": "🔄 Запускаю лаунчер...",
+    "preparing": "📁 Готовлю файлы клона...",
+    "spawned": "🚀 Процесс клона запущен, проверяю...",
+    "registered": "💾 Сохраняю информацию о клоне...",
+}
+
+SHUTDOWN_ERROR = "Бот перезапускается, попробуйте создать клона ещё раз через минуту"
+
+
+class CloneLaunchResult:
+    """Структурированный результат работы лаунчера"""
+
+    def __init__(self, ok: bool, clone_id: str = None, pid: int = None, clone_dir: str = None,
+                 error: str = None, duration: float = 0.0):
+        self.ok = ok
+        self.clone_id = clone_id
+        self.pid = pid
+        self.clone_dir = clone_dir
+        self.error = error
+        self.duration = duration
+
+    def __repr__(self):
+        if self.ok:
+            return f"CloneLaunchResult(ok, id={self.clone_id}, pid={self.pid}, dir={self.clone_dir})"
+        return f"CloneLaunchResult(error={self.error!r})"
+
+
+class CloneJobQueue:
+    """Очередь создания клонов.
+
+    Каждая заявка запускает лаунчер как асинхронный подпроцесс, поэтому
+    event loop основного бота не ждёт его завершения. Одновременно
+    выполняется не более max_parallel заявок, остальные ждут в очереди.
+
+    Если задан host_socket, вместо запуска процесса токен передаётся
+    работающему хосту клонов (bot_host.py) или супервизору воркеров
+    (shard_supervisor.py) - у них одинаковый протокол.
+
+    Если задан supervisor, процесс клона запускает он, а не лаунчер: так
+    основной бот владеет процессом и перезапускает его при падении.
+    """
+
+    def __init__(self, launcher_path: str = LAUNCHER_PATH, max_parallel: int = 2, timeout: float = 30,
+                 host_socket: str = None, supervisor=None):
+        self.launcher_path = launcher_path
+        self.host_socket = host_socket
+        # clone_supervisor.CloneSupervisor: лаунчер только готовит файлы, процесс запускает супервизор
+        self.supervisor = supervisor
+        self.max_parallel = max_parallel
+        self.timeout = timeout
+        self._queue = asyncio.Queue()
+        self._workers = []
+        self.stats = {"submitted": 0, "succeeded": 0, "failed": 0, "timeouts": 0, "running": 0}
+
+    def start(self):
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_parallel)]
+            logging.info(f"✅ Очередь создания клонов запущена: параллельно {self.max_parallel}")
+
+    async def stop(self):
+        """Останавливает воркеры; все ждущие submit() получают ошибку, а не висят до конца процесса"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        while not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            self._queue.task_done()
+            self.stats["failed"] += 1
+            if not future.done():
+                future.set_result(CloneLaunchResult(False, error=SHUTDOWN_ERROR))
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def submit(self, token: str, on_progress=None) -> CloneLaunchResult:
+        """Ставит заявку в очередь и ждёт результата.
+
+        on_progress - корутина, принимающая текст этапа (например, edit_text сообщения).
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.stats["submitted"] += 1
+        # Сколько заявок окажется впереди, когда все свободные воркеры разберут очередь
+        position = self._queue.qsize() + 1 - (self.max_parallel - self.stats["running"])
+        await self._queue.put((token, on_progress, future))
+        if position > 0:
+            await _report(on_progress, f"{STAGE_TEXTS['queued']}\nПозиция в очереди: {position}")
+        return await future
+
+    async def _worker(self):
+        while True:
+            token, on_progress, future = await self._queue.get()
+            self.stats["running"] += 1
+            try:
+                result = await self._launch(token, on_progress)
+                self.stats["succeeded" if result.ok else "failed"] += 1
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                self.stats["failed"] += 1
+                logging.error(f"❌ Исключение при создании клона: {e}")
+                if not future.done():
+                    future.set_result(CloneLaunchResult(False, error=f"Исключение при создании клона: {e}"))
+            except asyncio.CancelledError:
+                self.stats["failed"] += 1
+                if not future.done():
+                    future.set_result(CloneLaunchResult(False, error=SHUTDOWN_ERROR))
+                raise
+            finally:
+                self.stats["running"] -= 1
+                self._queue.task_done()
+
+    async def _launch(self, token: str, on_progress) -> CloneLaunchResult:
+        if self.host_socket:
+            return await self._attach_to_host(token, on_progress)
+
+        started = time.monotonic()
+        await _report(on_progress, STAGE_TEXTS["starting"])
+        logging.info(f"🚀 Запускаю лаунчер для {token[:10]}...")
+
+        launcher_args = ["--json", "--no-start"] if self.supervisor is not None else ["--json"]
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, self.launcher_path, *launcher_args, token,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        # PID клона из события "spawned": при таймауте его нужно остановить вместе с лаунчером
+        spawned = {}
+
+        async def communicate():
+            # stdout и stderr читаются одновременно, чтобы лаунчер не повис на заполненном канале
+            events, stderr_data = await asyncio.gather(
+                self._read_events(process, on_progress, spawned), process.stderr.read()
+            )
+            await process.wait()
+            return events, stderr_data.decode(errors="replace")
+
+        try:
+            result, stderr = await asyncio.wait_for(communicate(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            if spawned.get("pid"):
+                _kill_clone(spawned["pid"], spawned.get("clone_id"))
+            process.kill()
+            await process.wait()
+            self.stats["timeouts"] += 1
+            logging.error("⏰ Таймаут при запуске клона")
+            return CloneLaunchResult(False, error=f"Таймаут при запуске клона (превышено {self.timeout} секунд)",
+                                     duration=time.monotonic() - started)
+
+        duration = time.monotonic() - started
+        if result is None:
+            error = stderr.strip() or f"лаунчер завершился с кодом {process.returncode} без результата"
+            logging.error(f"❌ Ошибка запуска клона: {error}")
+            return CloneLaunchResult(False, error=error, duration=duration)
+
+        if result.ok and self.supervisor is not None:
+            await _report(on_progress, STAGE_TEXTS["spawned"])
+            try:
+                clone = await self.supervisor.start_clone(result.clone_id, result.clone_dir)
+            except Exception as e:
+                logging.error(f"❌ Ошибка запуска клона {result.clone_id}: {e}")
+                return CloneLaunchResult(False, clone_id=result.clone_id, error=str(e),
+                                         duration=time.monotonic() - started)
+            result.pid = clone.pid
+            duration = time.monotonic() - started
+
+        result.duration = duration
+        logging.info(f"✅ Лаунчер отработал за {duration:.2f} сек: {result}")
+        return result
+
+    async def _attach_to_host(self, token: str, on_progress) -> CloneLaunchResult:
+        started = time.monotonic()
+        clone_id = f"clone_{int(time.time())}_{random.randint(1000, 9999)}"
+        await _report(on_progress, "🔌 Подключаю клона к хосту...")
+        try:
+            response = await bot_host.send_command(
+                {"cmd": "attach", "clone_id": clone_id, "token": token},
+                socket_path=self.host_socket, timeout=self.timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            logging.error(f"❌ Хост клонов недоступен: {e}")
+            return CloneLaunchResult(False, error=f"Хост клонов недоступен: {e}",
+                                     duration=time.monotonic() - started)
+
+        duration = time.monotonic() - started
+        if not response.get("ok"):
+            return CloneLaunchResult(False, error=response.get("error", "неизвестная ошибка"), duration=duration)
+        logging.info(f"✅ Клон {clone_id} подключён к хосту за {duration:.2f} сек")
+        return CloneLaunchResult(True, clone_id=clone_id, pid=response.get("pid"),
+                                 clone_dir=None, duration=duration)
+
+    async def _read_events(self, process, on_progress, spawned: dict):
+        """Читает JSON-события лаунчера построчно, пересылая этапы в on_progress; PID клона - в spawned"""
+        result = None
+        async for raw_line in process.stdout:
+            line = raw_line.decode(errors="replace").strip()
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                logging.info(f"📄 Лаунчер: {line}")
+                continue
+
+            if event.get("event") == "progress":
+                stage = event.get("stage")
+                if stage == "spawned":
+                    spawned.update(pid=event.get("pid"), clone_id=event.get("clone_id"))
+                await _report(on_progress, STAGE_TEXTS.get(stage, f"🔄 {stage}"))
+            elif event.get("event") == "result":
+                result = CloneLaunchResult(
+                    ok=True,
+                    clone_id=event.get("clone_id"),
+                    pid=event.get("pid"),
+                    clone_dir=event.get("clone_dir")
+                )
+            elif event.get("event") == "error":
+                result = CloneLaunchResult(False, error=event.get("error", "неизвестная ошибка"))
+        return result
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["pending"] = self.pending
+        return stats
+
+
+def _kill_clone(pid: int, clone_id: str = None):
+    """Клон запущен в своей сессии (start_new_session): убиваем всю его группу процессов"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+        logging.warning(f"⚠️ Остановлен клон {clone_id} (PID={pid}), не дождавшийся конца запуска")
+    except ProcessLookupError:
+        pass
+    except OSError as e:
+        logging.error(f"❌ Не удалось остановить клона {clone_id} (PID={pid}): {e}")
+
+
+async def _report(on_progress, text: str):
+    if on_progress is None:
+        return
+    try:
+        await on_progress(text)
+    except Exception as e:
+        # Ошибка отображения прогресса не должна ломать создание клона
+        logging.warning(f"⚠️ Не удалось показать прогресс создания клона: {e}")
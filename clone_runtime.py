@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/clone_runtime.py - общий код запуска клона
+#
+# Раньше лаунчер генерировал для каждого клона свой bot.py с вшитым токеном.
+# Теперь все клоны запускаются одним модулем:
+#   python3 clone_runtime.py <clone_id>
+# Токен берётся из переменной окружения CLONE_TOKEN или из state.db (clones.token),
+# поэтому при создании клона не пишется ни одного файла с кодом, байткод
+# модуля компилируется один раз и общий для всех клонов, а обновление кода
+# всех клонов - это их перезапуск.
+#
+# Логи клон пишет сам в <clone_dir>/logs/bot.log через log_pipeline (фоновый
+# поток, ротация); stdout/stderr (трассировки падений) тот, кто запускает клона -
+# лаунчер, супервизор или зигота, - направляет в <clone_dir>/logs/stderr.log.
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+
+from aiogram import Bot, Dispatcher
+
+import clone_handlers
+from fsm_storage import StateStoreStorage
+from log_pipeline import setup_logging
+from send_queue import send_queue
+from state_store import StateStore
+from update_poller import UpdatePoller
+
+CLONE_LOG_FORMAT = '%(asctime)s - CLONE - %(levelname)s - %(message)s'
+
+
+def setup_clone_logging(clone_dir: str):
+    """Логи клона - в <clone_dir>/logs/bot.log через фоновый поток"""
+    return setup_logging(os.path.join(clone_dir, "logs", "bot.log"), fmt=CLONE_LOG_FORMAT)
+
+
+async def run_clone(token: str, clone_id: str, ready_fd: int = None):
+    """Работа клона до SIGTERM/SIGINT; ready_fd - pipe, в который пишется байт готовности"""
+    bot = Bot(token=token)
+    bot.session.middleware(send_queue)
+    store = StateStore()
+    # Состояния диалогов в state.db: после перезапуска или переезда клона они сохраняются
+    storage = StateStoreStorage(store)
+    dp = Dispatcher(storage=storage)
+    dp.include_router(clone_handlers.create_router())
+
+    logging.info(f"Starting clone {clone_id} with full menu")
+    logging.info(f"Initial main bot status check: {clone_handlers.check_main_bot_status()}")
+    await clone_handlers.start_resources()
+    await clone_handlers.register_clone(clone_id, token)
+    # getUpdates продолжает с сохранённого offset: сообщения, пришедшие пока клон не работал, не теряются
+    poller = UpdatePoller(
+        bot, lambda update: dp.feed_update(bot, update, clone_id=clone_id),
+        store=store, name=clone_id, allowed_updates=dp.resolve_used_update_types()
+    )
+    polling = asyncio.create_task(poller.run())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, polling.cancel)
+    if ready_fd is not None:
+        os.write(ready_fd, b"1")
+        os.close(ready_fd)
+    try:
+        await polling
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await clone_handlers.stop_resources()
+        await storage.close()
+        store.close()
+        await bot.session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск клона")
+    parser.add_argument("clone_id", nargs="?", default=os.environ.get("CLONE_ID"))
+    args = parser.parse_args()
+    if not args.clone_id:
+        parser.error("нужен clone_id (аргумент или CLONE_ID)")
+
+    # Лаунчер и супервизор запускают клона в его каталоге
+    setup_clone_logging(os.getcwd())
+
+    token = os.environ.get("CLONE_TOKEN")
+    if not token:
+        store = StateStore()
+        try:
+            token = store.get_clone_token(args.clone_id)
+        finally:
+            store.close()
+    if not token:
+        logging.error(f"❌ Токен клона {args.clone_id} не найден ни в CLONE_TOKEN, ни в state.db")
+        sys.exit(1)
+
+    asyncio.run(run_clone(token, args.clone_id))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/clone_supervisor.py - процессы клонов (clones.mode = "process")
+#
+# Основной бот сам запускает каждого клона (clone_runtime.py <clone_id>) и следит за ним:
+#   - завершившийся клон перезапускается с экспоненциальной задержкой
+#     (1, 2, 4 ... до backoff_max сек; после stable_after сек работы счётчик сбрасывается);
+#   - процесс опознаётся по паре (PID, время старта из /proc/<pid>/stat), поэтому
+#     чужой процесс, получивший тот же PID, не считается клоном;
+#   - раз в check_interval снимаются RSS и загрузка CPU каждого клона; клон сверх
+#     memory_limit_mb перезапускается (SIGTERM, через term_timeout сек - SIGKILL),
+#     сверх cpu_limit_percent - получает nice 19, а после unthrottle_after сек
+#     ниже лимита - прежний приоритет.
+# Клоны запускаются в своей сессии и переживают перезапуск основного бота: после
+# старта он подхватывает их по PID и времени старта из state.db.
+#
+# С zygote_socket клоны не запускаются как новый интерпретатор, а fork-аются из
+# прогретой зиготы (clone_zygote.py); если она недоступна - обычный запуск clone_runtime.py.
+
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+THROTTLED_NICE = 19
+
+# Зигота ждёт готовности клона ZYGOTE_READY_TIMEOUT сек и передаётся ей в запросе;
+# ответ ждём дольше, чтобы получить от неё ошибку, а не оборвать запрос раньше
+ZYGOTE_READY_TIMEOUT = 20
+ZYGOTE_RPC_TIMEOUT = ZYGOTE_READY_TIMEOUT + 10
+
+# Один модуль для всех клонов; рядом с этим файлом, как и остальные модули бота
+CLONE_RUNTIME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "clone_runtime.py")
+
+
+def read_proc_stat(pid: int):
+    """(время старта в тиках, utime + stime в тиках, RSS в байтах) или None, если процесса нет"""
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as f:
+            data = f.read()
+    except OSError:
+        return None
+    # Имя процесса в скобках может содержать пробелы - поля считаем после ")"
+    fields = data[data.rindex(")") + 2:].split()
+    if fields[0] == "Z":
+        return None
+    return int(fields[19]), int(fields[11]) + int(fields[12]), int(fields[21]) * PAGE_SIZE
+
+
+def proc_start_time(pid: int):
+    stat = read_proc_stat(pid)
+    return stat[0] if stat is not None else None
+
+
+def read_uss(pid: int) -> int:
+    """Уникальная память процесса (Private_Clean + Private_Dirty) в байтах: без страниц, общих с зиготой"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", 'r') as f:
+            return sum(int(line.split()[1]) * 1024 for line in f
+                       if line.startswith(("Private_Clean:", "Private_Dirty:")))
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def proc_cmdline(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/cmdline", 'rb') as f:
+            return f.read().replace(b"\0", b" ").decode(errors="replace")
+    except OSError:
+        return ""
+
+
+def clone_command(clone_id: str) -> list:
+    """Командная строка процесса клона"""
+    return [sys.executable, CLONE_RUNTIME, clone_id]
+
+
+def process_alive(pid: int, start_time: int = None) -> bool:
+    """Жив ли именно этот процесс: PID существует и (если известно) время старта совпадает"""
+    if not pid:
+        return False
+    started = proc_start_time(pid)
+    if started is None:
+        return False
+    return start_time is None or started == start_time
+
+
+class SupervisedClone:
+    """Один процесс клона"""
+
+    def __init__(self, clone_id: str, clone_dir: str):
+        self.clone_id = clone_id
+        self.clone_dir = clone_dir
+        self.process = None
+        self.pid = None
+        self.start_time = None
+        self.started_at = 0.0
+        self.state = "stopped"
+        self.failures = 0
+        self.restarts = 0
+        self.rss = 0
+        self.uss = 0
+        self.cpu_percent = 0.0
+        self.startup_seconds = None
+        self.throttled = False
+        self.original_nice = None
+        self._calm_since = None
+        self._cpu_ticks = None
+        self._sampled_at = None
+        self._restart_task = None
+        self._kill_task = None
+
+    def owns_cmdline(self, cmdline: str) -> bool:
+        """Запущен ли процесс с такой командной строкой как этот клон (в том числе старым bot.py)"""
+        args = cmdline.split()
+        return args[-2:] == [CLONE_RUNTIME, self.clone_id] or os.path.join(self.clone_dir, "bot.py") in args
+
+    def alive(self) -> bool:
+        return process_alive(self.pid, self.start_time)
+
+
+class CloneSupervisor:
+    """Владелец процессов клонов основного бота"""
+
+    def __init__(self, store, memory_limit_mb: float = 256, cpu_limit_percent: float = 80,
+                 check_interval: float = 5, backoff_base: float = 1, backoff_max: float = 300,
+                 stable_after: float = 60, start_timeout: float = 2.0, zygote_socket: str = None,
+                 term_timeout: float = 10, unthrottle_after: float = 60):
+        self.store = store
+        self.zygote_socket = zygote_socket
+        self.memory_limit = memory_limit_mb * 1024 * 1024
+        self.cpu_limit_percent = cpu_limit_percent
+        self.check_interval = check_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.start_timeout = start_timeout
+        self.term_timeout = term_timeout
+        self.unthrottle_after = unthrottle_after
+
+        self.clones = {}
+        self._monitor_task = None
+        # Фоновые задачи (_reap, _kill): ссылки держим, пока задача не завершится
+        self._tasks = set()
+        self.stats = {"spawned": 0, "forked": 0, "adopted": 0, "exits": 0, "restarts": 0, "memory_restarts": 0,
+                      "throttled": 0, "unthrottled": 0, "killed": 0, "pid_reused": 0, "zygote_errors": 0}
+
+    # ========== ЗАПУСК ==========
+
+    async def _fork_from_zygote(self, clone: SupervisedClone) -> bool:
+        """Запуск через зиготу; False - зигота недоступна или клон не запустился"""
+        # bot_host тянет aiogram и обработчики клона - лаунчеру, который берёт отсюда /proc-функции, они не нужны
+        from bot_host import send_command
+        try:
+            token = await asyncio.to_thread(self.store.get_clone_token, clone.clone_id)
+            if not token:
+                raise ValueError("токен клона не найден в state.db")
+            response = await send_command(
+                {"cmd": "spawn", "clone_id": clone.clone_id, "token": token, "clone_dir": clone.clone_dir,
+                 "ready_timeout": ZYGOTE_READY_TIMEOUT},
+                socket_path=self.zygote_socket, timeout=ZYGOTE_RPC_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            response = {"ok": False, "error": str(e)}
+        if not response.get("ok"):
+            self.stats["zygote_errors"] += 1
+            logging.warning(f"⚠️ [{clone.clone_id}] Зигота не запустила клона: {response.get('error')}")
+            return False
+
+        # Процесс - потомок зиготы: его завершение замечает монитор по /proc
+        clone.process = None
+        clone.pid = response["pid"]
+        clone.start_time = proc_start_time(clone.pid)
+        clone.startup_seconds = response.get("startup_seconds")
+        self.stats["forked"] += 1
+        logging.info(f"🚀 [{clone.clone_id}] Клон из зиготы готов за {clone.startup_seconds} сек")
+        return True
+
+    async def _spawn(self, clone: SupervisedClone):
+        clone._cpu_ticks = None
+        clone.throttled = False
+        clone.original_nice = None
+        clone._calm_since = None
+        if self.zygote_socket and await self._fork_from_zygote(clone):
+            clone.started_at = time.monotonic()
+            clone.state = "running"
+            await self._save(clone)
+            return
+
+        # Лог открывается только на время запуска: у дочернего процесса своя копия дескриптора
+        os.makedirs(os.path.join(clone.clone_dir, "logs"), exist_ok=True)
+        with open(os.path.join(clone.clone_dir, "logs", "stderr.log"), 'a') as log_file:
+            clone.process = await asyncio.create_subprocess_exec(
+                *clone_command(clone.clone_id),
+                cwd=clone.clone_dir, stdout=log_file, stderr=asyncio.subprocess.STDOUT,
+                start_new_session=True
+            )
+        clone.pid = clone.process.pid
+        clone.start_time = proc_start_time(clone.pid)
+        clone.started_at = time.monotonic()
+        clone.state = "running"
+        self.stats["spawned"] += 1
+        await self._save(clone)
+        self._background(self._reap(clone, clone.process))
+
+    def _background(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def start_clone(self, clone_id: str, clone_dir: str) -> SupervisedClone:
+        """Запускает клона и ждёт start_timeout секунд, не упал ли он сразу"""
+        clone = self.clones.get(clone_id)
+        if clone is None:
+            clone = self.clones[clone_id] = SupervisedClone(clone_id, clone_dir)
+        await self._spawn(clone)
+        process = clone.process
+        if process is None:
+            # Зигота отвечает только после готовности клона - ждать не нужно
+            return clone
+        try:
+            await asyncio.wait_for(asyncio.shield(process.wait()), timeout=self.start_timeout)
+        except asyncio.TimeoutError:
+            logging.info(f"✅ [{clone_id}] Клон запущен: PID={clone.pid}")
+            return clone
+        # Упавший сразу клон не перезапускаем: создание клона завершается ошибкой
+        clone.state = "stopped"
+        if clone._restart_task is not None:
+            clone._restart_task.cancel()
+        self.clones.pop(clone_id, None)
+        await self._save(clone, status="failed")
+        raise RuntimeError(f"клон завершился с кодом {process.returncode}, "
+                           f"см. {clone.clone_dir}/logs/stderr.log")
+
+    async def adopt(self, info: dict):
+        """Подхватывает клона из state.db после перезапуска основного бота"""
+        clone = SupervisedClone(info["clone_id"], info["clone_dir"])
+        clone.pid = info.get("pid")
+        clone.start_time = info.get("pid_start")
+        clone.restarts = info.get("restarts") or 0
+        self.clones[clone.clone_id] = clone
+        if clone.pid and clone.start_time is None and clone.owns_cmdline(proc_cmdline(clone.pid)):
+            # Запись старого формата без времени старта: опознаём по командной строке
+            clone.start_time = proc_start_time(clone.pid)
+        # Без времени старта PID мог достаться чужому процессу - такой не подхватываем
+        if clone.start_time is not None and clone.alive():
+            clone.state = "running"
+            clone.started_at = time.monotonic()
+            self.stats["adopted"] += 1
+            return True
+        if clone.pid and proc_start_time(clone.pid) is not None:
+            # PID занят другим процессом - клон давно завершился
+            self.stats["pid_reused"] += 1
+            logging.warning(f"⚠️ [{clone.clone_id}] PID {clone.pid} принадлежит другому процессу")
+        clone.pid = None
+        await self._schedule_restart(clone, "не работает после перезапуска основного бота")
+        return False
+
+    # ========== ЗАВЕРШЕНИЕ И ПЕРЕЗАПУСК ==========
+
+    async def _reap(self, clone: SupervisedClone, process):
+        code = await process.wait()
+        if clone.process is not process or clone.state == "stopped":
+            return
+        clone.process = None
+        await self._on_exit(clone, f"код {code}")
+
+    async def _on_exit(self, clone: SupervisedClone, reason: str):
+        self.stats["exits"] += 1
+        if time.monotonic() - clone.started_at >= self.stable_after:
+            clone.failures = 0
+        logging.error(f"❌ [{clone.clone_id}] Клон завершился ({reason}), PID={clone.pid}")
+        clone.pid = None
+        clone.start_time = None
+        await self._schedule_restart(clone, reason)
+
+    async def _schedule_restart(self, clone: SupervisedClone, reason: str):
+        delay = min(self.backoff_base * 2 ** clone.failures, self.backoff_max)
+        clone.failures += 1
+        clone.state = "backoff"
+        logging.info(f"🔄 [{clone.clone_id}] Перезапуск через {delay:.0f} сек ({reason})")
+        # Задача создаётся до записи в state.db: stop() во время записи должен её отменить
+        clone._restart_task = asyncio.create_task(self._restart_later(clone, delay))
+        await self._save(clone, status="restarting")
+
+    async def _restart_later(self, clone: SupervisedClone, delay: float):
+        await asyncio.sleep(delay)
+        if clone.state != "backoff":
+            return
+        try:
+            await self._spawn(clone)
+        except Exception as e:
+            logging.error(f"❌ [{clone.clone_id}] Не удалось перезапустить клона: {e}")
+            await self._schedule_restart(clone, str(e))
+            return
+        clone.restarts += 1
+        self.stats["restarts"] += 1
+        await self._save(clone)
+
+    def _terminate(self, clone: SupervisedClone):
+        """SIGTERM процессу клона, через term_timeout - SIGKILL; перезапуск сделает _reap (или монитор)"""
+        if not clone.alive() or (clone._kill_task is not None and not clone._kill_task.done()):
+            return
+        clone._kill_task = self._background(self._kill(clone, clone.pid, clone.start_time, clone.process))
+
+    async def _kill(self, clone: SupervisedClone, pid: int, start_time: int, process):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            return
+        # Ждём именно этот процесс: клон тем временем мог быть перезапущен с другим PID
+        deadline = time.monotonic() + self.term_timeout
+        while time.monotonic() < deadline:
+            if (process is not None and process.returncode is not None) or not process_alive(pid, start_time):
+                return
+            await asyncio.sleep(min(0.5, self.term_timeout))
+        if not process_alive(pid, start_time):
+            return
+        logging.warning(f"⚠️ [{clone.clone_id}] Клон не завершился за {self.term_timeout:.0f} сек после SIGTERM, "
+                        f"SIGKILL")
+        try:
+            os.kill(pid, signal.SIGKILL)
+            self.stats["killed"] += 1
+        except OSError:
+            pass
+
+    # ========== РЕСУРСЫ ==========
+
+    def _sample(self, clone: SupervisedClone):
+        stat = read_proc_stat(clone.pid) if clone.pid else None
+        if stat is None or (clone.start_time is not None and stat[0] != clone.start_time):
+            return False
+        _, cpu_ticks, clone.rss = stat
+        clone.uss = read_uss(clone.pid)
+        now = time.monotonic()
+        if clone._cpu_ticks is not None and now > clone._sampled_at:
+            clone.cpu_percent = (cpu_ticks - clone._cpu_ticks) / CLOCK_TICKS / (now - clone._sampled_at) * 100
+        clone._cpu_ticks = cpu_ticks
+        clone._sampled_at = now
+        return True
+
+    def _enforce(self, clone: SupervisedClone):
+        if self.memory_limit and clone.rss > self.memory_limit:
+            self.stats["memory_restarts"] += 1
+            logging.warning(f"⚠️ [{clone.clone_id}] RSS {clone.rss / 1024 / 1024:.0f} МБ больше лимита "
+                            f"{self.memory_limit / 1024 / 1024:.0f} МБ, перезапускаю")
+            self._terminate(clone)
+            return
+        if not self.cpu_limit_percent:
+            return
+        if clone.cpu_percent > self.cpu_limit_percent:
+            clone._calm_since = None
+            if clone.throttled:
+                return
+            try:
+                clone.original_nice = os.getpriority(os.PRIO_PROCESS, clone.pid)
+                os.setpriority(os.PRIO_PROCESS, clone.pid, THROTTLED_NICE)
+                clone.throttled = True
+                self.stats["throttled"] += 1
+                logging.warning(f"⚠️ [{clone.clone_id}] CPU {clone.cpu_percent:.0f}%, понижаю приоритет")
+            except OSError as e:
+                logging.error(f"❌ [{clone.clone_id}] Не удалось понизить приоритет: {e}")
+        elif clone.throttled:
+            # Приоритет возвращаем, только когда клон продержался ниже лимита unthrottle_after сек
+            now = time.monotonic()
+            if clone._calm_since is None:
+                clone._calm_since = now
+            if now - clone._calm_since < self.unthrottle_after:
+                return
+            clone._calm_since = None
+            try:
+                os.setpriority(os.PRIO_PROCESS, clone.pid, clone.original_nice)
+                clone.throttled = False
+                self.stats["unthrottled"] += 1
+                logging.info(f"✅ [{clone.clone_id}] CPU {clone.cpu_percent:.0f}%, приоритет восстановлен "
+                             f"(nice {clone.original_nice})")
+            except OSError as e:
+                # Повысить приоритет может только root (или при RLIMIT_NICE) - попробуем через unthrottle_after
+                logging.error(f"❌ [{clone.clone_id}] Не удалось восстановить приоритет: {e}")
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            for clone in list(self.clones.values()):
+                if clone.state != "running":
+                    continue
+                if not self._sample(clone):
+                    # Подхваченный клон (не наш дочерний процесс) завершился - узнаём об этом по /proc
+                    if clone.process is None:
+                        await self._on_exit(clone, "процесс не найден")
+                    continue
+                # Только что запущенного клона не ограничиваем: start_clone ещё ждёт, не упал ли он
+                if time.monotonic() - clone.started_at >= self.start_timeout:
+                    self._enforce(clone)
+            try:
+                await asyncio.to_thread(self.store.update_clone_resources, [
+                    (c.clone_id, c.rss, round(c.cpu_percent, 1), c.restarts)
+                    for c in self.clones.values() if c.state == "running"
+                ])
+            except Exception as e:
+                logging.error(f"❌ Ошибка сохранения ресурсов клонов: {e}")
+
+    async def _save(self, clone: SupervisedClone, status: str = "running"):
+        # state.db общая с другими процессами: запись может ждать блокировку до busy_timeout
+        try:
+            await asyncio.to_thread(self.store.upsert_clone, clone.clone_id, pid=clone.pid,
+                                    clone_dir=clone.clone_dir, status=status, pid_start=clone.start_time,
+                                    restarts=clone.restarts, start_time=time.time() if status == "running" else None)
+        except Exception as e:
+            logging.error(f"❌ [{clone.clone_id}] Ошибка сохранения информации о процессе: {e}")
+
+    # ========== ЖИЗНЕННЫЙ ЦИКЛ ==========
+
+    async def start(self):
+        """Подхватывает клонов из state.db и запускает наблюдение"""
+        adopted = 0
+        for info in await asyncio.to_thread(self.store.list_clones):
+            if info.get("clone_dir") and info.get("status") in ("running", "restarting") \
+                    and os.path.isdir(info["clone_dir"]):
+                adopted += await self.adopt(info)
+        logging.info(f"✅ Супервизор клонов запущен: подхвачено {adopted} из {len(self.clones)}")
+        self._monitor_task = asyncio.create_task(self._monitor())
+
+    async def stop(self):
+        """Останавливает наблюдение; сами клоны продолжают работать (нужны для failover)"""
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            self._monitor_task = None
+        for clone in self.clones.values():
+            clone.state = "stopped"
+            if clone._restart_task is not None:
+                clone._restart_task.cancel()
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["clones"] = len(self.clones)
+        stats["running"] = sum(c.state == "running" for c in self.clones.values())
+        stats["rss_mb"] = round(sum(c.rss for c in self.clones.values()) / 1024 / 1024, 1)
+        # Уникальная память клонов: при запуске из зиготы заметно меньше RSS
+        stats["uss_mb"] = round(sum(c.uss for c in self.clones.values()) / 1024 / 1024, 1)
+        startups = [c.startup_seconds for c in self.clones.values() if c.startup_seconds is not None]
+        stats["startup_avg_seconds"] = round(sum(startups) / len(startups), 3) if startups else None
+        return stats
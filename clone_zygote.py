@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/clone_zygote.py - заранее прогретый процесс, из которого fork-ом запускаются клоны
+#
+# Зигота один раз импортирует aiogram, psycopg2 и обработчики клона, а потом по
+# команде через unix-сокет делает fork: клону не нужно запускать новый
+# интерпретатор и заново импортировать зависимости, а страницы с уже
+# загруженным кодом остаются общими с зиготой (copy-on-write). Клон сообщает
+# о готовности через pipe, как только запустил getUpdates, - вместо слепого
+# ожидания зигота отвечает сразу и возвращает время запуска.
+#
+# Зигота однопоточная (fork из многопоточного процесса небезопасен): один
+# цикл select обслуживает все соединения, ожидание готовности клонов и SIGCHLD,
+# поэтому медленный запуск одного клона не задерживает запросы остальных.
+#
+# Протокол - как у bot_host (JSON-строка запрос - JSON-строка ответ):
+#   {"cmd": "spawn", "clone_id": ..., "token": ..., "clone_dir": ..., "ready_timeout": ...}
+#       -> {"ok": true, "pid": ..., "startup_seconds": ...}
+#   ready_timeout (необязательно) - сколько ждать готовности клона; вызывающий
+#   должен ждать ответа дольше, иначе он бросит запрос раньше, чем зигота ответит
+#   Повторный spawn уже запущенного (или запускающегося) clone_id отклоняется
+#   {"cmd": "stats"} -> время запуска и уникальная память (USS) каждого клона
+#
+# Запуск: python3 clone_zygote.py [--socket /var/www/imlerih_bot/clone_zygote.sock]
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import traceback
+
+# Тяжёлые зависимости (aiogram, обработчики клона) импортируются до fork - клоны получают их готовыми
+from clone_runtime import run_clone, setup_clone_logging
+from clone_supervisor import read_proc_stat, read_uss
+from log_pipeline import setup_logging
+
+BASE_DIR = "/var/www/imlerih_bot"
+ZYGOTE_SOCKET = f"{BASE_DIR}/clone_zygote.sock"
+
+
+# ========== КЛОН (в дочернем процессе) ==========
+
+def _child_main(request: dict, ready_fd: int, inherited: list):
+    """Тело дочернего процесса после fork; из функции не возвращается.
+
+    inherited - сокеты и дескрипторы зиготы, которые клону не нужны.
+    """
+    code = 0
+    pipeline = None
+    try:
+        signal.set_wakeup_fd(-1)
+        for resource in inherited:
+            if isinstance(resource, socket.socket):
+                resource.close()
+            else:
+                os.close(resource)
+        os.setsid()
+        for sig in (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, signal.SIG_DFL)
+
+        clone_dir = request["clone_dir"]
+        os.makedirs(f"{clone_dir}/logs", exist_ok=True)
+        log_fd = os.open(f"{clone_dir}/logs/stderr.log", os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null_fd, 0)
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+        os.close(null_fd)
+        os.close(log_fd)
+        os.chdir(clone_dir)
+
+        pipeline = setup_clone_logging(clone_dir)
+        asyncio.run(run_clone(request["token"], request["clone_id"], ready_fd))
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        # os._exit не вызывает atexit - дописываем очередь логов сами
+        if pipeline is not None:
+            pipeline.stop()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+# ========== ЗИГОТА ==========
+
+class Zygote:
+    def __init__(self, socket_path: str = ZYGOTE_SOCKET, ready_timeout: float = 20):
+        self.socket_path = socket_path
+        self.ready_timeout = ready_timeout
+        self.server = None
+        # pid -> {"clone_id", "startup_seconds", "started_at"}
+        self.children = {}
+        # Все ещё не забранные waitpid дети: только их PID точно не занят чужим процессом
+        self._unreaped = set()
+        # read_fd pipe готовности -> запускающийся клон, ответ на spawn ещё не отправлен
+        self._starting = {}
+        # Соединения, из которых читаем команды -> непрочитанный остаток
+        self._connections = {}
+        # SIGCHLD будит select через этот pipe, детей забирает основной цикл
+        self._wakeup_r = self._wakeup_w = None
+        self.stats = {"spawned": 0, "failed": 0, "exited": 0}
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self._unreaped.discard(pid)
+            child = self.children.pop(pid, None)
+            if child is not None:
+                self.stats["exited"] += 1
+                logging.info(f"⛔ [{child['clone_id']}] Клон завершился: PID={pid}, "
+                             f"код {os.waitstatus_to_exitcode(status)}")
+
+    def _kill(self, pid: int):
+        # Не забранный waitpid ребёнок (даже зомби) держит свой PID - чужой процесс не задеть
+        if pid in self._unreaped:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def _running_pid(self, clone_id: str):
+        for pid, child in self.children.items():
+            if child["clone_id"] == clone_id:
+                return pid
+        for spawn in self._starting.values():
+            if spawn["clone_id"] == clone_id:
+                return spawn["pid"]
+        return None
+
+    def _inherited(self) -> list:
+        busy = [spawn["connection"] for spawn in self._starting.values()]
+        return [self.server, self._wakeup_r, self._wakeup_w, *self._connections, *busy, *self._starting]
+
+    def spawn(self, request: dict, connection: socket.socket = None):
+        """Запускает клон; None - ответ отправит _finish_spawn, когда клон будет готов"""
+        for key in ("clone_id", "token", "clone_dir"):
+            if not request.get(key):
+                return {"ok": False, "error": f"missing {key}"}
+        running = self._running_pid(request["clone_id"])
+        if running is not None:
+            return {"ok": False, "error": f"клон уже запущен: PID={running}", "pid": running}
+
+        ready_timeout = float(request.get("ready_timeout") or self.ready_timeout)
+        started = time.monotonic()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            _child_main(request, write_fd, self._inherited())
+        os.close(write_fd)
+        self._unreaped.add(pid)
+        self._starting[read_fd] = {"pid": pid, "clone_id": request["clone_id"], "clone_dir": request["clone_dir"],
+                                   "connection": connection, "started": started,
+                                   "deadline": started + ready_timeout}
+        return None
+
+    def _finish_spawn(self, read_fd: int, ready: bool):
+        """Отвечает на spawn: клон прислал байт готовности, упал (EOF) или не успел"""
+        spawn = self._starting.pop(read_fd)
+        os.close(read_fd)
+        pid = spawn["pid"]
+        startup = time.monotonic() - spawn["started"]
+
+        if not ready:
+            self.stats["failed"] += 1
+            self._kill(pid)
+            response = {"ok": False, "error": f"клон не запустился за {startup:.1f} сек, "
+                                              f"см. {spawn['clone_dir']}/logs/stderr.log"}
+        else:
+            self.stats["spawned"] += 1
+            self.children[pid] = {"clone_id": spawn["clone_id"], "startup_seconds": round(startup, 3),
+                                  "started_at": time.time()}
+            stat = read_proc_stat(pid)
+            logging.info(f"🚀 [{spawn['clone_id']}] Клон готов за {startup:.3f} сек: PID={pid}, "
+                         f"USS {read_uss(pid) / 1024 / 1024:.1f} МБ, "
+                         f"RSS {(stat[2] if stat else 0) / 1024 / 1024:.1f} МБ")
+            response = {"ok": True, "pid": pid, "startup_seconds": round(startup, 3)}
+
+        connection = spawn["connection"]
+        if connection is None:
+            return
+        if not self._reply(connection, response):
+            if ready:
+                # О клоне никто не узнал - вызывающий запустит его заново, второй копии быть не должно
+                logging.warning(f"⚠️ [{spawn['clone_id']}] Некому сообщить о запуске, клон остановлен: PID={pid}")
+                self._kill(pid)
+            return
+        if connection in self._connections:
+            self._process(connection)
+        else:
+            connection.close()
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["uss_mb"] = round(read_uss(os.getpid()) / 1024 / 1024, 1)
+        stats["starting"] = len(self._starting)
+        stats["children"] = {
+            child["clone_id"]: {"pid": pid, "startup_seconds": child["startup_seconds"],
+                                "uss_mb": round(read_uss(pid) / 1024 / 1024, 1)}
+            for pid, child in self.children.items()
+        }
+        return stats
+
+    def handle_command(self, command: dict, connection: socket.socket = None):
+        cmd = command.get("cmd")
+        if cmd == "spawn":
+            return self.spawn(command, connection)
+        if cmd == "stats":
+            return {"ok": True, "stats": self.get_stats()}
+        return {"ok": False, "error": f"unknown command: {cmd}"}
+
+    # ========== СОЕДИНЕНИЯ ==========
+
+    def _close(self, connection: socket.socket):
+        self._connections.pop(connection, None)
+        if not any(spawn["connection"] is connection for spawn in self._starting.values()):
+            connection.close()
+
+    def _reply(self, connection: socket.socket, response: dict) -> bool:
+        try:
+            connection.sendall(json.dumps(response, ensure_ascii=False).encode() + b"\n")
+            return True
+        except OSError as e:
+            # Вызывающий не дождался ответа и закрыл соединение
+            logging.warning(f"⚠️ Не удалось отправить ответ: {e}")
+            self._connections.pop(connection, None)
+            connection.close()
+            return False
+
+    def _read(self, connection: socket.socket):
+        try:
+            data = connection.recv(65536)
+        except OSError:
+            data = b""
+        if not data:
+            # Ответ на идущий spawn всё равно попробуем отправить - соединение закроет _finish_spawn
+            self._close(connection)
+            return
+        self._connections[connection] += data
+        self._process(connection)
+
+    def _process(self, connection: socket.socket):
+        """Выполняет принятые команды по порядку; пока идёт spawn, следующие ждут его ответа"""
+        while connection in self._connections and b"\n" in self._connections[connection]:
+            line, _, self._connections[connection] = self._connections[connection].partition(b"\n")
+            try:
+                response = self.handle_command(json.loads(line), connection)
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            if response is None:
+                return
+            self._reply(connection, response)
+
+    def serve(self):
+        """Блокирующий цикл: fork делается вне event loop, дочерний процесс начинает с чистого состояния"""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        self.server.listen(16)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        signal.set_wakeup_fd(self._wakeup_w)
+        # Обработчик ничего не делает: сигнал только пишет в wakeup-pipe
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        logging.info(f"✅ Зигота клонов готова: {self.socket_path}, USS {read_uss(os.getpid()) / 1024 / 1024:.1f} МБ")
+
+        while True:
+            timeout = None
+            if self._starting:
+                timeout = max(0.0, min(spawn["deadline"] for spawn in self._starting.values()) - time.monotonic())
+            readable, _, _ = select.select([*self._starting, self._wakeup_r, *self._connections, self.server],
+                                           [], [], timeout)
+
+            # Сначала pipe готовности: новые pipe (с теми же номерами) создаются только при чтении команд ниже
+            for read_fd in readable:
+                if read_fd in self._starting:
+                    self._finish_spawn(read_fd, os.read(read_fd, 1) == b"1")
+            if self._wakeup_r in readable:
+                try:
+                    os.read(self._wakeup_r, 4096)
+                except BlockingIOError:
+                    pass
+                self._reap()
+            for connection in readable:
+                if isinstance(connection, socket.socket) and connection in self._connections:
+                    self._read(connection)
+            if self.server in readable:
+                connection, _ = self.server.accept()
+                self._connections[connection] = b""
+
+            now = time.monotonic()
+            for read_fd, spawn in list(self._starting.items()):
+                if spawn["deadline"] <= now:
+                    self._finish_spawn(read_fd, False)
+
+
+def _stop(signum, frame):
+    raise SystemExit(0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Зигота для быстрого запуска клонов")
+    parser.add_argument("--socket", default=ZYGOTE_SOCKET)
+    args = parser.parse_args()
+
+    # Поток-писатель логов в клона после fork не переходит: клон до первой записи
+    # заменяет унаследованный обработчик своим (setup_clone_logging)
+    setup_logging(f"{BASE_DIR}/logs/clone_zygote.log",
+                  fmt='%(asctime)s - ZYGOTE - %(levelname)s - %(message)s')
+    signal.signal(signal.SIGTERM, _stop)
+
+    zygote = Zygote(args.socket)
+    try:
+        zygote.serve()
+    finally:
+        # Клоны в своих сессиях продолжают работать без зиготы
+        logging.info(f"⛔ Зигота остановлена: {zygote.get_stats()}")
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/db_pool.py - пул подключений к PostgreSQL для основного бота и клонов
+
+import asyncio
+import logging
+import time
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import DictCursor
+
+import metrics
+
+# fetch - "one", "all" или "none" (execute)
+DB_QUERY_SECONDS = metrics.histogram("bot_db_query_seconds", "Запрос к PostgreSQL (в потоке)", ("fetch",))
+DB_ERRORS = metrics.counter("bot_db_errors_total", "Ошибки запросов к PostgreSQL", ("fetch",))
+DB_ACQUIRE_SECONDS = metrics.histogram("bot_db_acquire_seconds", "Ожидание подключения из пула")
+
+
+def connect_kwargs(db_config: dict) -> dict:
+    """Параметры psycopg2.connect из секции database конфигурации"""
+    return {
+        "host": db_config.get("host", "localhost"),
+        "database": db_config.get("database", "karantir_bot"),
+        "user": db_config.get("user", "karantir_user"),
+        "password": db_config.get("password", "karantir_pass"),
+        "port": db_config.get("port", 5432),
+        "connect_timeout": db_config.get("connect_timeout", 5),
+    }
+
+
+class PoolTimeoutError(Exception):
+    """Не удалось получить подключение из пула за отведённое время"""
+
+
+class DBPool:
+    """Асинхронный пул подключений.
+
+    Подключения psycopg2 живут в ThreadedConnectionPool, а сами запросы
+    выполняются в потоках через asyncio.to_thread, поэтому event loop
+    не блокируется ни на установке соединения, ни на запросе.
+    """
+
+    def __init__(self, db_config: dict, min_size: int = None, max_size: int = None,
+                 acquire_timeout: float = None, health_check_interval: float = None):
+        self.db_config = db_config
+        self.min_size = min_size or db_config.get("pool_min_size", 1)
+        self.max_size = max_size or db_config.get("pool_max_size", 5)
+        self.acquire_timeout = acquire_timeout or db_config.get("pool_acquire_timeout", 5.0)
+        # Если подключение простаивало дольше этого времени - перед выдачей проверяем его SELECT 1
+        self.health_check_interval = health_check_interval or db_config.get("pool_health_check_interval", 30.0)
+
+        self._pool = None
+        self._closed = False
+        self._open_lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(self.max_size)
+        self._last_used = {}
+
+        self.stats = {
+            "acquired": 0,
+            "in_use": 0,
+            "acquire_timeouts": 0,
+            "acquire_wait_total": 0.0,
+            "acquire_wait_max": 0.0,
+            "health_check_failures": 0,
+            "query_errors": 0,
+        }
+        metrics.gauge("bot_db_pool_in_use", "Занятые подключения пула", lambda: self.stats["in_use"])
+
+    async def open(self):
+        """Создаёт пул (минимальное число подключений открывается сразу)"""
+        async with self._open_lock:
+            if self._pool is not None:
+                return
+            self._closed = False
+            try:
+                self._pool = await asyncio.to_thread(
+                    pg_pool.ThreadedConnectionPool, self.min_size, self.max_size, **connect_kwargs(self.db_config)
+                )
+            except psycopg2.Error as e:
+                logging.error(f"❌ Ошибка создания пула БД: {e}")
+                logging.error(f"📊 Параметры подключения: host={self.db_config.get('host')}, "
+                              f"db={self.db_config.get('database')}, user={self.db_config.get('user')}")
+                raise
+            logging.info(f"✅ Пул БД создан: min={self.min_size}, max={self.max_size}")
+
+    async def close(self):
+        """Закрывает все подключения пула"""
+        self._closed = True
+        if self._pool is None:
+            return
+        pool, self._pool = self._pool, None
+        await asyncio.to_thread(pool.closeall)
+        self._last_used.clear()
+        logging.info("⛔ Пул БД закрыт")
+
+    @property
+    def is_open(self) -> bool:
+        return self._pool is not None
+
+    def _checkout(self):
+        """Берёт подключение из пула и проверяет его, если оно долго простаивало"""
+        conn = self._pool.getconn()
+        idle = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        if conn.closed or idle > self.health_check_interval:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error as e:
+                self.stats["health_check_failures"] += 1
+                logging.warning(f"⚠️ Подключение из пула неисправно, пересоздаю: {e}")
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+        return conn
+
+    def _release(self, conn, broken: bool = False):
+        if self._pool is None:
+            conn.close()
+            return
+        if broken:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn, close=broken)
+
+    def _execute(self, query: str, params: tuple, fetch: str):
+        conn = self._checkout()
+        broken = False
+        try:
+            with conn.cursor(cursor_factory=DictCursor) as cursor:
+                cursor.execute(query, params)
+                if fetch == "one":
+                    result = cursor.fetchone()
+                elif fetch == "all":
+                    result = cursor.fetchall()
+                else:
+                    result = cursor.rowcount
+            conn.commit()
+            return result
+        except psycopg2.Error:
+            broken = conn.closed != 0
+            if not broken:
+                conn.rollback()
+            raise
+        finally:
+            self._release(conn, broken)
+
+    async def _run(self, query: str, params: tuple, fetch: str):
+        if self._pool is None:
+            if self._closed:
+                raise RuntimeError("Пул БД закрыт")
+            # Пул ещё не создан (например, БД была недоступна при старте) - пробуем открыть сейчас
+            await self.open()
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.stats["acquire_timeouts"] += 1
+            logging.error(f"⏰ Таймаут ожидания подключения из пула ({self.acquire_timeout} сек)")
+            raise PoolTimeoutError(f"pool acquire timeout after {self.acquire_timeout}s")
+
+        waited = time.monotonic() - started
+        DB_ACQUIRE_SECONDS.observe(waited)
+        self.stats["acquired"] += 1
+        self.stats["acquire_wait_total"] += waited
+        self.stats["acquire_wait_max"] = max(self.stats["acquire_wait_max"], waited)
+        self.stats["in_use"] += 1
+        started = time.perf_counter()
+
+        def done(future):
+            # Подключение занято, пока работает поток, даже если вызывающий уже отменён
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, fetch)
+            self.stats["in_use"] -= 1
+            self._semaphore.release()
+            if not future.cancelled() and isinstance(future.exception(), psycopg2.Error):
+                self.stats["query_errors"] += 1
+                DB_ERRORS.inc(fetch)
+
+        future = asyncio.ensure_future(asyncio.to_thread(self._execute, query, params, fetch))
+        future.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    async def fetchone(self, query: str, params: tuple = ()):
+        return await self._run(query, params, "one")
+
+    async def fetchall(self, query: str, params: tuple = ()):
+        return await self._run(query, params, "all")
+
+    async def execute(self, query: str, params: tuple = ()) -> int:
+        return await self._run(query, params, "none")
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        acquired = stats["acquired"]
+        stats["acquire_wait_avg"] = stats["acquire_wait_total"] / acquired if acquired else 0.0
+        stats["max_size"] = self.max_size
+        return stats
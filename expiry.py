@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/expiry.py - фоновое удаление устаревших записей
+#
+# Вместо полного обхода словарей (cleanup_old_*) каждая запись при вставке
+# кладётся в ячейку колеса таймеров по своему сроку. Фоновая задача раз в тик
+# разбирает только наступившие ячейки, поэтому удаление стоит O(1) на запись
+# независимо от того, сколько всего записей живо.
+
+import asyncio
+import logging
+import math
+import time
+
+
+class TimingWheel:
+    """Хешированное колесо таймеров: slots ячеек по tick секунд"""
+
+    def __init__(self, tick: float = 1.0, slots: int = 512):
+        self.tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._current = int(time.time() // tick)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def schedule(self, deadline: float, callback, *args):
+        """Вызвать callback(*args) не раньше deadline (время time.time())"""
+        tick_no = max(math.ceil(deadline / self.tick), self._current + 1)
+        self._slots[tick_no % len(self._slots)].append((tick_no, callback, args))
+        self._size += 1
+
+    def advance(self, now: float) -> int:
+        """Срабатывает все таймеры до now включительно, возвращает их число"""
+        target = int(now // self.tick)
+        # Если цикл простоял дольше оборота колеса, достаточно обойти каждую ячейку один раз
+        steps = min(target - self._current, len(self._slots))
+        fired = 0
+        for tick_no in range(target - steps + 1, target + 1):
+            slot = self._slots[tick_no % len(self._slots)]
+            if not slot:
+                continue
+            # Записи на следующие обороты колеса остаются в ячейке
+            due = [entry for entry in slot if entry[0] <= target]
+            if len(due) == len(slot):
+                slot.clear()
+            else:
+                slot[:] = [entry for entry in slot if entry[0] > target]
+            for _, callback, args in due:
+                try:
+                    callback(*args)
+                except Exception as e:
+                    logging.error(f"❌ Ошибка таймера {callback}: {e}", exc_info=True)
+            fired += len(due)
+        self._current = max(self._current, target)
+        self._size -= fired
+        return fired
+
+
+class ExpiringDict(dict):
+    """Словарь, записи которого удаляются через ttl секунд после последней вставки"""
+
+    def __init__(self, wheel: TimingWheel, ttl: float):
+        super().__init__()
+        self.wheel = wheel
+        self.ttl = ttl
+        self.evicted = 0
+        self._deadlines = {}
+
+    def __setitem__(self, key, value):
+        self.set_until(key, value, time.time() + self.ttl)
+
+    def set_until(self, key, value, deadline: float):
+        """Вставка со своим сроком (например, для записи, созданной раньше в другом процессе)"""
+        dict.__setitem__(self, key, value)
+        self._deadlines[key] = deadline
+        self.wheel.schedule(deadline, self._expire, key, deadline)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._deadlines.pop(key, None)
+
+    def pop(self, key, *default):
+        self._deadlines.pop(key, None)
+        return super().pop(key, *default)
+
+    def clear(self):
+        super().clear()
+        self._deadlines.clear()
+
+    def _expire(self, key, deadline: float):
+        # Запись могли перезаписать (новый срок) или удалить - тогда таймер устарел
+        if self._deadlines.get(key) == deadline:
+            del self[key]
+            self.evicted += 1
+
+
+class ExpiryScheduler:
+    """Фоновая задача, которая чистит зарегистрированные таблицы.
+
+    Таблицы с фиксированным ttl создаются через expiring_dict() и
+    обслуживаются колесом таймеров. Структуры со своим порядком устаревания
+    (например, SlidingWindowLimiter) подключаются через add_sweeper().
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512, stats_interval: float = 60):
+        self.wheel = TimingWheel(tick, slots)
+        self.stats_interval = stats_interval
+        self._tables = {}
+        self._sweepers = {}
+        self._task = None
+        self.evicted = {}
+        self.evictions_per_sec = {}
+
+    def expiring_dict(self, name: str, ttl: float) -> ExpiringDict:
+        return self.add_table(name, ExpiringDict(self.wheel, ttl))
+
+    def add_table(self, name: str, table: ExpiringDict) -> ExpiringDict:
+        self._tables[name] = table
+        self.evicted[name] = 0
+        return table
+
+    def add_sweeper(self, name: str, sweep, size):
+        """sweep(now) удаляет устаревшие записи и возвращает их число, size() - сколько живо"""
+        self._sweepers[name] = (sweep, size)
+        self.evicted[name] = 0
+
+    def run_once(self, now: float = None) -> int:
+        if now is None:
+            now = time.time()
+        self.wheel.advance(now)
+        for name, table in self._tables.items():
+            self.evicted[name] = table.evicted
+        total = 0
+        for name, (sweep, _) in self._sweepers.items():
+            expired = sweep(now)
+            self.evicted[name] += expired
+            total += expired
+        return total
+
+    async def _run(self):
+        last_evicted = dict(self.evicted)
+        last_stats = time.monotonic()
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"❌ Ошибка фоновой очистки: {e}", exc_info=True)
+
+            elapsed = time.monotonic() - last_stats
+            if elapsed >= self.stats_interval:
+                self.evictions_per_sec = {
+                    name: (count - last_evicted.get(name, 0)) / elapsed for name, count in self.evicted.items()
+                }
+                last_evicted = dict(self.evicted)
+                last_stats = time.monotonic()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_stats(self) -> dict:
+        live = {name: len(table) for name, table in self._tables.items()}
+        live.update({name: size() for name, (_, size) in self._sweepers.items()})
+        return {
+            "live": live,
+            "evicted": dict(self.evicted),
+            "evictions_per_sec": {name: round(rate, 3) for name, rate in self.evictions_per_sec.items()},
+            "timers": len(self.wheel),
+        }
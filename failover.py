@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/failover.py - выбор основного бота по аренде в state.db
+#
+# Основной бот держит аренду "primary" с рангом 0 и продлевает её каждые
+# interval секунд - это и есть его heartbeat. Резервные клоны (ранг 1, 2, ...
+# по порядку создания) пробуют взять аренду, когда она истекла: клон с рангом
+# r ждёт ещё (r - 1) * rank_delay секунд, поэтому при живом первом резерве
+# остальные не мешают. Клон, держащий аренду, показывает полное меню.
+# Вернувшийся основной бот забирает аренду сразу (меньший ранг главнее),
+# клон узнаёт об этом на следующей проверке и возвращается в резерв.
+#
+# Аренда - строка в state.db (SQLite, BEGIN IMMEDIATE): все процессы бота
+# работают на одной машине и уже делят эту базу.
+
+import asyncio
+import logging
+import time
+
+LEASE_NAME = "primary"
+MAIN_HOLDER = "main"
+MAIN_RANK = 0
+
+
+class LeaseElector:
+    """Аренда роли основного бота для кандидатов одного процесса"""
+
+    def __init__(self, store, ttl: float = 3.0, interval: float = 1.0, rank_delay: float = 1.0,
+                 name: str = LEASE_NAME):
+        self.store = store
+        self.ttl = ttl
+        self.interval = interval
+        self.rank_delay = rank_delay
+        self.name = name
+        # holder -> rank; None - только следит за арендой, не претендует на неё
+        self.candidates = {}
+        self.lease = None
+        self._task = None
+        # Проверка, идущая сейчас в потоке: отмена цикла её не останавливает
+        self._tick = None
+        self.stats = {"acquired": 0, "lost": 0, "failovers": 0, "errors": 0,
+                      "last_failover_seconds": None, "max_failover_seconds": 0.0}
+
+    # ========== КАНДИДАТЫ ==========
+
+    def add_candidate(self, holder: str, rank):
+        self.candidates[holder] = rank
+
+    async def remove_candidate(self, holder: str):
+        self.candidates.pop(holder, None)
+        # Идущая проверка ещё знает этого кандидата и может успеть продлить его аренду
+        await self._finish_tick()
+        if self.is_leader(holder):
+            await asyncio.to_thread(self.store.release_lease, self.name, holder)
+            self.lease = None
+
+    # ========== СОСТОЯНИЕ (из памяти) ==========
+
+    @property
+    def leader(self):
+        """Текущий держатель аренды или None, если она истекла"""
+        if self.lease is None or self.lease["expires_at"] <= time.time():
+            return None
+        return self.lease["holder"]
+
+    def is_leader(self, holder: str) -> bool:
+        return holder is not None and self.leader == holder
+
+    # ========== ЦИКЛ ==========
+
+    def _grace(self, rank: int) -> float:
+        return max(0, rank - 1) * self.rank_delay
+
+    def _can_try(self, holder: str, rank: int, now: float) -> bool:
+        lease = self.lease
+        return (lease is None or lease["holder"] == holder or rank < lease["rank"]
+                or lease["expires_at"] + self._grace(rank) <= now)
+
+    def tick(self, candidates: dict):
+        """Одна проверка: продлить/взять аренду и перечитать её (синхронно, вызывается в потоке).
+
+        candidates - копия self.candidates: event loop меняет словарь, пока идёт проверка.
+        """
+        old_leader = self.leader
+        self.lease = self.store.get_lease(self.name)
+        now = time.time()
+        for rank, holder in sorted((r, h) for h, r in candidates.items() if r is not None):
+            if not self._can_try(holder, rank, now):
+                continue
+            acquired, previous = self.store.acquire_lease(self.name, holder, rank, self.ttl, self._grace(rank))
+            if acquired:
+                self.lease = self.store.get_lease(self.name)
+                if previous is None or previous["holder"] != holder:
+                    self._on_acquired(holder, previous)
+                break
+            self.lease = previous
+
+        new_leader = self.leader
+        if old_leader is not None and old_leader != new_leader and old_leader in candidates:
+            self.stats["lost"] += 1
+            logging.warning(f"⚠️ {old_leader} больше не основной: аренду держит {new_leader or 'никто'}")
+
+    def _on_acquired(self, holder: str, previous):
+        self.stats["acquired"] += 1
+        if previous is None:
+            logging.info(f"👑 {holder} стал основным")
+            return
+        # Время от последнего heartbeat прежнего держателя до перехвата
+        failover = self.lease["acquired_at"] - previous["renewed_at"]
+        if previous["expires_at"] <= self.lease["acquired_at"]:
+            self.stats["failovers"] += 1
+            self.stats["last_failover_seconds"] = round(failover, 3)
+            self.stats["max_failover_seconds"] = max(self.stats["max_failover_seconds"], round(failover, 3))
+            logging.warning(f"📊 Failover: {holder} стал основным вместо {previous['holder']} "
+                            f"через {failover:.2f} сек после последнего heartbeat")
+        else:
+            logging.info(f"👑 {holder} забрал роль основного у {previous['holder']}")
+
+    async def _finish_tick(self):
+        if self._tick is not None:
+            await asyncio.gather(self._tick, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            self._tick = asyncio.ensure_future(asyncio.to_thread(self.tick, dict(self.candidates)))
+            try:
+                await asyncio.shield(self._tick)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logging.error(f"❌ Ошибка аренды {self.name}: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает цикл и сразу отдаёт аренду, чтобы резерв не ждал её истечения"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for holder in list(self.candidates):
+            await self.remove_candidate(holder)
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["leader"] = self.leader
+        stats["candidates"] = len(self.candidates)
+        return stats
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/fake_bot_api.py - локальная заглушка Bot API для проверки вебхуков и polling
+#
+# Отвечает на getMe, setWebhook, deleteWebhook, getUpdates и методы отправки,
+# а сообщения "от пользователя" принимает через служебные адреса:
+#   POST /_push/<token>   {"chat_id": 1, "text": "/start"} или {"update": {...}}
+#   GET  /_sent/<token>   что бот отправил в ответ
+#   POST /_revoke/<token> getMe и остальные методы отвечают 401, как для отозванного токена
+#   POST /_fail/<token>/<method>  метод отвечает 400 (например, setWebhook с недоступным адресом)
+# Если у бота включён вебхук, обновление доставляется на него (с секретом
+# в заголовке); не принятое вебхуком (не 200) остаётся в очереди. Как и у
+# Telegram, getUpdates отдаёт обновления, пока их не подтвердят вызовом с
+# offset больше их update_id.
+#
+# В тестах: api = FakeBotAPI(); base_url = await api.start(); ...; await api.stop()
+#
+# Запуск: python3 fake_bot_api.py [--port 8090]
+# В config.json основного бота: "bot": {"api_server": "http://127.0.0.1:8090"},
+# для хоста клонов: python3 bot_host.py --api-server http://127.0.0.1:8090
+
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.webhooks = {}
+        # token -> неподтверждённые обновления по возрастанию update_id
+        self.pending = {}
+        self.sent = {}
+        self.revoked = set()
+        self.failing = {}
+        self.calls = {}
+        self._arrived = {}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._session = None
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle_method)
+        self.app.router.add_post("/_push/{token}", self.handle_push)
+        self.app.router.add_get("/_sent/{token}", self.handle_sent)
+        self.app.router.add_post("/_revoke/{token}", self.handle_revoke)
+        self.app.router.add_post("/_fail/{token}/{method}", self.handle_fail)
+        self.app.on_cleanup.append(self._close_session)
+
+    async def _close_session(self, app):
+        if self._session is not None:
+            await self._session.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер (port=0 - любой свободный) и возвращает его адрес"""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        # Будим висящие long polling getUpdates, иначе остановка ждёт их таймаута
+        for event in self._arrived.values():
+            event.set()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _event(self, token: str) -> asyncio.Event:
+        return self._arrived.setdefault(token, asyncio.Event())
+
+    def _enqueue(self, token: str, update: dict):
+        self.pending.setdefault(token, []).append(update)
+        self._event(token).set()
+
+    def _message(self, chat_id, text) -> dict:
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"}, "text": text}
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        token = request.match_info["token"]
+        method = request.match_info["method"].lower()
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        self.calls.setdefault(token, []).append({"method": method, **params})
+        if token in self.revoked:
+            return web.json_response({"ok": False, "error_code": 401, "description": "Unauthorized"}, status=401)
+        if method in self.failing.get(token, ()):
+            return web.json_response({"ok": False, "error_code": 400,
+                                      "description": f"Bad Request: {method} failed"}, status=400)
+        if method == "getme":
+            bot_id = int(token.split(":", 1)[0])
+            result = {"id": bot_id, "is_bot": True, "first_name": f"Fake {bot_id}", "username": f"fake_{bot_id}_bot"}
+        elif method == "setwebhook":
+            self.webhooks[token] = {"url": params["url"], "secret_token": params.get("secret_token")}
+            result = True
+        elif method == "deletewebhook":
+            self.webhooks.pop(token, None)
+            result = True
+        elif method == "getwebhookinfo":
+            webhook = self.webhooks.get(token, {})
+            result = {"url": webhook.get("url", ""), "has_custom_certificate": False,
+                      "pending_update_count": len(self.pending.get(token, []))}
+        elif method == "getupdates":
+            if token in self.webhooks:
+                return web.json_response({"ok": False, "error_code": 409,
+                                          "description": "Conflict: can't use getUpdates method while webhook is active"},
+                                         status=409)
+            result = await self._get_updates(token, params)
+        elif method in ("sendmessage", "editmessagetext"):
+            self.sent.setdefault(token, []).append({"method": method, **params})
+            result = self._message(params.get("chat_id", 0), params.get("text"))
+        else:
+            self.sent.setdefault(token, []).append({"method": method, **params})
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, token: str, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        pending = self.pending.setdefault(token, [])
+        # offset подтверждает всё, что меньше него; остальное отдаётся повторно
+        if offset > 0:
+            pending[:] = [update for update in pending if update["update_id"] >= offset]
+        if not pending and timeout:
+            event = self._event(token)
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return pending[:limit]
+
+    async def handle_push(self, request: web.Request) -> web.Response:
+        token = request.match_info["token"]
+        body = await request.json()
+        update = body.get("update") or {
+            "message": {**self._message(body.get("chat_id", 1), body.get("text", "")),
+                        "from": {"id": int(body.get("chat_id", 1)), "is_bot": False, "first_name": "Tester"}}
+        }
+        update["update_id"] = next(self._update_ids)
+
+        webhook = self.webhooks.get(token)
+        if webhook is None:
+            self._enqueue(token, update)
+            return web.json_response({"ok": True, "delivered": "queue", "update_id": update["update_id"]})
+
+        if self._session is None:
+            self._session = ClientSession()
+        headers = {SECRET_HEADER: webhook["secret_token"]} if webhook.get("secret_token") else {}
+        try:
+            async with self._session.post(webhook["url"], json=update, headers=headers,
+                                          timeout=ClientTimeout(total=10)) as response:
+                status = response.status
+        except (ClientError, asyncio.TimeoutError):
+            status = None
+        if status != 200:
+            # Не доставлено - ждёт, пока вебхук снимут и бот заберёт его через getUpdates
+            self._enqueue(token, update)
+        return web.json_response({"ok": status == 200, "delivered": "webhook", "status": status,
+                                  "update_id": update["update_id"]})
+
+    async def handle_revoke(self, request: web.Request) -> web.Response:
+        self.revoked.add(request.match_info["token"])
+        return web.json_response({"ok": True})
+
+    async def handle_fail(self, request: web.Request) -> web.Response:
+        self.failing.setdefault(request.match_info["token"], set()).add(request.match_info["method"].lower())
+        return web.json_response({"ok": True})
+
+    async def handle_sent(self, request: web.Request) -> web.Response:
+        return web.json_response(self.sent.get(request.match_info["token"], []))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заглушка Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - FAKE_API - %(levelname)s - %(message)s')
+    web.run_app(FakeBotAPI().app, host=args.host, port=args.port)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/fsm_storage.py - хранилище FSM aiogram поверх state.db
+#
+# Замена MemoryStorage: состояния диалогов (например, "жду токен клона")
+# переживают перезапуск, failover и переезд клона между воркерами.
+# Чтение и запись идут в кэш в памяти; изменённые ключи раз в flush_interval
+# секунд пишутся в state.db одной транзакцией (write-back). С диска ключ
+# читается один раз, дальше - из кэша; записи, к которым не обращались cache_ttl
+# секунд, вытесняются, поэтому процесс, к которому переехал бот, увидит свежее состояние.
+# Состояние живёт state_ttl секунд с последнего изменения.
+# data должна сериализоваться в JSON.
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+
+import metrics
+
+FLUSH_SECONDS = metrics.histogram("bot_fsm_flush_seconds", "Запись изменённых состояний FSM в state.db")
+
+
+class _Entry:
+    __slots__ = ("state", "data", "expires_at", "cached_at")
+
+    def __init__(self, state=None, data: dict = None, expires_at: float = 0.0):
+        self.state = state
+        self.data = data or {}
+        self.expires_at = expires_at
+        self.cached_at = time.monotonic()
+
+
+class StateStoreStorage(BaseStorage):
+    """FSM-хранилище aiogram: кэш в памяти + отложенная запись в StateStore"""
+
+    def __init__(self, store, state_ttl: float = 24 * 3600, flush_interval: float = 1.0,
+                 cache_ttl: float = 60, prune_interval: float = 3600):
+        self.store = store
+        self.state_ttl = state_ttl
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.prune_interval = prune_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+
+        # Порядок - по последнему обращению: самые старые записи в начале
+        self._cache = OrderedDict()
+        self._dirty = set()
+        self._task = None
+        # Запись/очистка state.db, идущая в потоке: отмена _task её не останавливает
+        self._write = None
+        self._last_prune = time.monotonic()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "flushes": 0, "flushed": 0,
+                      "flush_errors": 0, "load_errors": 0, "expired": 0, "evicted": 0}
+        metrics.gauge("bot_fsm_keys", "Состояния FSM в памяти", lambda: {
+            ("cached",): len(self._cache), ("dirty",): len(self._dirty)}, ("kind",))
+
+    # ========== КЭШ ==========
+
+    async def _entry(self, key: StorageKey) -> _Entry:
+        name = self.key_builder.build(key)
+        entry = self._cache.get(name)
+        if entry is not None:
+            if entry.expires_at and entry.expires_at <= time.time():
+                # Истекшее состояние удаляется и из state.db при следующей записи
+                self.stats["expired"] += 1
+                entry = self._cache[name] = _Entry()
+                self._dirty.add(name)
+            entry.cached_at = time.monotonic()
+            self._cache.move_to_end(name)
+            self.stats["hits"] += 1
+            return entry
+
+        self.stats["misses"] += 1
+        try:
+            row = await asyncio.to_thread(self.store.load_fsm, name)
+        except Exception as e:
+            # Без state.db работаем как MemoryStorage
+            self.stats["load_errors"] += 1
+            logging.error(f"❌ Ошибка чтения состояния FSM {name}: {e}")
+            row = None
+        # Пока ключ читали, его могли записать - запись главнее
+        entry = self._cache.get(name)
+        if entry is None:
+            entry = self._cache[name] = _Entry(*row) if row else _Entry()
+        return entry
+
+    def _changed(self, key: StorageKey, entry: _Entry):
+        entry.expires_at = time.time() + self.state_ttl
+        self._dirty.add(self.key_builder.build(key))
+        self.stats["writes"] += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # ========== BaseStorage ==========
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._changed(key, entry)
+
+    async def get_state(self, key: StorageKey):
+        return (await self._entry(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        entry = await self._entry(key)
+        entry.data = dict(data)
+        self._changed(key, entry)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return dict((await self._entry(key)).data)
+
+    # ========== ЗАПИСЬ В state.db ==========
+
+    async def flush(self):
+        """Пишет изменённые ключи одной транзакцией; при ошибке они останутся на следующий раз"""
+        if not self._dirty:
+            return
+        names, self._dirty = self._dirty, set()
+        rows = []
+        for name in names:
+            entry = self._cache.get(name)
+            if entry is not None:
+                rows.append((name, entry.state, entry.data, entry.expires_at))
+        try:
+            with FLUSH_SECONDS.time():
+                await self._in_thread(self.store.save_fsm, rows)
+        except asyncio.CancelledError:
+            # Поток может и не успеть записать - ключи запишет финальный flush() в close()
+            self._dirty |= names
+            raise
+        except Exception as e:
+            self.stats["flush_errors"] += 1
+            self._dirty |= names
+            logging.error(f"❌ Ошибка записи состояний FSM ({len(rows)}): {e}")
+            return
+        self.stats["flushes"] += 1
+        self.stats["flushed"] += len(rows)
+
+    async def _in_thread(self, func, *args):
+        self._write = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        return await asyncio.shield(self._write)
+
+    def _evict(self):
+        """Убирает из памяти записанные ключи, к которым не обращались cache_ttl секунд"""
+        now = time.monotonic()
+        deadline = now - self.cache_ttl
+        # Просматриваются только устаревшие записи в начале словаря
+        while self._cache:
+            name, entry = next(iter(self._cache.items()))
+            if entry.cached_at >= deadline:
+                break
+            if name in self._dirty:
+                # Ещё не записан в state.db - вытесним позже
+                entry.cached_at = now
+                self._cache.move_to_end(name)
+                continue
+            del self._cache[name]
+            self.stats["evicted"] += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            self._evict()
+            if time.monotonic() - self._last_prune >= self.prune_interval:
+                self._last_prune = time.monotonic()
+                try:
+                    await self._in_thread(self.store.prune_fsm)
+                except Exception as e:
+                    logging.error(f"❌ Ошибка очистки состояний FSM: {e}")
+
+    async def close(self) -> None:
+        """Останавливает фоновую запись и сбрасывает всё несохранённое"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Дожидаемся прерванной записи: после close() вызывающий закрывает state.db
+        if self._write is not None:
+            await asyncio.gather(self._write, return_exceptions=True)
+            self._write = None
+        await self.flush()
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["cached"] = len(self._cache)
+        stats["dirty"] = len(self._dirty)
+        return stats
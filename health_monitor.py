@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/health_monitor.py - проверка основного бота и всех клонов через getMe
+#
+# Заменяет check_main_bot.sh. Токены основного бота и всех клонов (backup_tokens
+# в state.db) проверяются одновременно через одну keep-alive сессию. Здоровый
+# бот проверяется раз в healthy_interval, бот с ошибками - чаще (failing_interval,
+# с удвоением до healthy_interval); к интервалам добавляется случайный разброс,
+# чтобы проверки не шли одной пачкой. Результаты раунда пишутся в state.db
+# одной транзакцией (bot_health + история), статус основного бота - ещё и
+# атомарно в main_bot_status.json, за которым следят клоны.
+#
+# Запуск: python3 health_monitor.py [--api-server URL] [--once]
+
+import argparse
+import asyncio
+import logging
+import random
+import signal
+import time
+from collections import deque
+from datetime import datetime
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramAPIError, TelegramNotFound, TelegramUnauthorizedError
+from aiogram.utils.token import TokenValidationError
+
+from atomic_file import write_json_atomic
+from bot_api import bot_for_token, bot_id_from_token, close_shared_session, set_shared_session
+from log_pipeline import setup_logging
+from state_store import StateStore
+
+BASE_DIR = "/var/www/imlerih_bot"
+TOKEN_FILE = f"{BASE_DIR}/txt/token.txt"
+MAIN_BOT_STATUS_FILE = f"{BASE_DIR}/main_bot_status.json"
+
+# Те же значения, что писал check_main_bot.sh
+STATUS_ONLINE = "online"
+STATUS_OFFLINE = "offline"
+STATUS_BLOCKED = "blocked"
+
+# История проверок в state.db хранится неделю
+HISTORY_RETENTION = 7 * 24 * 3600
+
+
+class BotHealth:
+    """Состояние проверок одного токена"""
+
+    __slots__ = ("token", "bot_id", "name", "status", "username", "latency", "error", "failures",
+                 "checked_at", "last_ok_at", "next_check", "history")
+
+    def __init__(self, token: str, name: str, history_size: int):
+        self.token = token
+        self.bot_id = bot_id_from_token(token)
+        self.name = name
+        self.status = "unknown"
+        self.username = None
+        self.latency = None
+        self.error = None
+        self.failures = 0
+        self.checked_at = None
+        self.last_ok_at = None
+        self.next_check = 0.0
+        # (время проверки, успех, задержка)
+        self.history = deque(maxlen=history_size)
+
+    @property
+    def availability(self):
+        if not self.history:
+            return None
+        return sum(ok for _, ok, _ in self.history) / len(self.history)
+
+    def record(self, status: str, latency: float, username: str = None, error: str = None):
+        self.checked_at = time.time()
+        self.status = status
+        self.latency = latency
+        self.error = error
+        ok = status == STATUS_ONLINE
+        if ok:
+            self.failures = 0
+            self.last_ok_at = self.checked_at
+            self.username = username or self.username
+        else:
+            self.failures += 1
+        self.history.append((self.checked_at, ok, latency))
+
+    def as_row(self) -> dict:
+        return {"bot_id": self.bot_id, "name": self.name, "status": self.status, "username": self.username,
+                "latency": self.latency, "availability": self.availability,
+                "consecutive_failures": self.failures, "error": self.error,
+                "checked_at": self.checked_at, "last_ok_at": self.last_ok_at}
+
+
+class HealthMonitor:
+    """Периодические getMe для основного бота и всех клонов"""
+
+    def __init__(self, store: StateStore, main_token: str = None, status_file: str = MAIN_BOT_STATUS_FILE,
+                 healthy_interval: float = 300, failing_interval: float = 15, jitter: float = 0.2,
+                 timeout: float = 10, max_parallel: int = 50, history_size: int = 288,
+                 fleet_refresh_interval: float = 60):
+        self.store = store
+        self.main_token = main_token
+        self.status_file = status_file
+        self.healthy_interval = healthy_interval
+        self.failing_interval = failing_interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.history_size = history_size
+        self.fleet_refresh_interval = fleet_refresh_interval
+        self._semaphore = asyncio.Semaphore(max_parallel)
+        self._last_fleet_refresh = 0.0
+        # None - история ещё не чистилась: первый раунд чистит её сразу
+        self._last_prune = None
+
+        # bot_id -> BotHealth
+        self.bots = {}
+        self.stats = {"rounds": 0, "probes": 0, "failures": 0, "store_errors": 0}
+
+    # ========== СПИСОК БОТОВ ==========
+
+    def _add(self, token: str, name: str):
+        bot_id = bot_id_from_token(token)
+        if bot_id not in self.bots:
+            self.bots[bot_id] = BotHealth(token, name, self.history_size)
+            logging.info(f"➕ Проверка бота {name} ({bot_id}) добавлена")
+
+    def refresh_fleet(self):
+        """Добавляет новые клоны и убирает удалённые; основной бот остаётся всегда"""
+        self._last_fleet_refresh = time.monotonic()
+        try:
+            tokens = self.store.list_backup_tokens()
+        except Exception as e:
+            self.stats["store_errors"] += 1
+            logging.error(f"❌ Ошибка чтения токенов клонов: {e}")
+            return
+        if self.main_token:
+            self._add(self.main_token, "main")
+        known = {bot_id_from_token(self.main_token)} if self.main_token else set()
+        for token in tokens:
+            bot_id = bot_id_from_token(token)
+            known.add(bot_id)
+            self._add(token, f"clone_{bot_id}")
+        for bot_id in [b for b in self.bots if b not in known]:
+            logging.info(f"➖ Бот {self.bots.pop(bot_id).name} больше не проверяется")
+
+    # ========== ПРОВЕРКА ==========
+
+    def _interval(self, health: BotHealth) -> float:
+        if health.failures:
+            base = min(self.failing_interval * 2 ** (health.failures - 1), self.healthy_interval)
+        else:
+            base = self.healthy_interval
+        return base * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def probe(self, health: BotHealth):
+        async with self._semaphore:
+            started = time.monotonic()
+            try:
+                me = await bot_for_token(health.token).get_me(request_timeout=self.timeout)
+            except (TelegramUnauthorizedError, TelegramNotFound, TokenValidationError) as e:
+                # Токен отозван или бот удалён - как "ok": false у check_main_bot.sh
+                health.record(STATUS_BLOCKED, time.monotonic() - started, error=str(e))
+            except (TelegramAPIError, asyncio.TimeoutError, OSError) as e:
+                health.record(STATUS_OFFLINE, time.monotonic() - started, error=str(e) or type(e).__name__)
+            else:
+                health.record(STATUS_ONLINE, time.monotonic() - started, username=me.username)
+
+        self.stats["probes"] += 1
+        if health.status != STATUS_ONLINE:
+            self.stats["failures"] += 1
+            logging.warning(f"⚠️ {health.name}: {health.status} ({health.error}), "
+                            f"ошибок подряд: {health.failures}")
+        health.next_check = time.monotonic() + self._interval(health)
+
+    def _write_main_status(self, health: BotHealth):
+        data = {"status": health.status, "last_check": datetime.now().isoformat(),
+                "latency": round(health.latency, 3), "availability": health.availability}
+        if health.username:
+            data["username"] = health.username
+        if health.error:
+            data["error"] = health.error
+        try:
+            write_json_atomic(self.status_file, data)
+        except Exception as e:
+            logging.error(f"❌ Ошибка записи {self.status_file}: {e}")
+
+    async def run_round(self, due: list):
+        """Проверяет due одновременно и сохраняет результаты одной транзакцией"""
+        statuses = {health.bot_id: health.status for health in due}
+        await asyncio.gather(*[self.probe(health) for health in due])
+        self.stats["rounds"] += 1
+
+        for health in due:
+            if health.status != statuses[health.bot_id]:
+                logging.info(f"🔄 {health.name}: {statuses[health.bot_id]} -> {health.status}")
+            if health.name == "main":
+                self._write_main_status(health)
+
+        try:
+            await asyncio.to_thread(self.store.save_health, [health.as_row() for health in due])
+            if self._last_prune is None or time.monotonic() - self._last_prune > 3600:
+                self._last_prune = time.monotonic()
+                await asyncio.to_thread(self.store.prune_health_history, time.time() - HISTORY_RETENTION)
+        except Exception as e:
+            self.stats["store_errors"] += 1
+            logging.error(f"❌ Ошибка сохранения результатов проверки: {e}")
+
+    async def run_once(self):
+        self.refresh_fleet()
+        await self.run_round(list(self.bots.values()))
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            if now - self._last_fleet_refresh >= self.fleet_refresh_interval:
+                self.refresh_fleet()
+            due = [health for health in self.bots.values() if health.next_check <= now]
+            if due:
+                await self.run_round(due)
+                continue
+            next_check = min((health.next_check for health in self.bots.values()), default=now + 1)
+            next_refresh = self._last_fleet_refresh + self.fleet_refresh_interval
+            await asyncio.sleep(max(0.0, min(next_check, next_refresh) - now))
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["bots"] = len(self.bots)
+        stats["online"] = sum(h.status == STATUS_ONLINE for h in self.bots.values())
+        stats["failing"] = sum(h.failures > 0 for h in self.bots.values())
+        return stats
+
+
+def read_main_token(path: str = TOKEN_FILE):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        logging.error(f"❌ Файл токена не найден: {path}")
+        return None
+
+
+async def main(args):
+    session = AiohttpSession()
+    if args.api_server:
+        session.api = TelegramAPIServer.from_base(args.api_server)
+    # Все getMe идут через одну сессию (один пул соединений)
+    set_shared_session(session)
+
+    store = StateStore()
+    monitor = HealthMonitor(store, main_token=read_main_token(args.token_file), status_file=args.status_file,
+                            healthy_interval=args.healthy_interval, failing_interval=args.failing_interval)
+    try:
+        if args.once:
+            await monitor.run_once()
+            for health in monitor.bots.values():
+                print(f"{health.name}: {health.status} {health.latency:.3f}s {health.error or ''}")
+            return
+
+        task = asyncio.create_task(monitor.run())
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, task.cancel)
+        logging.info("✅ Монитор ботов запущен")
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    finally:
+        logging.info(f"⛔ Монитор ботов остановлен: {monitor.get_stats()}")
+        await session.close()
+        await close_shared_session()
+        store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Проверка основного бота и клонов")
+    parser.add_argument("--token-file", default=TOKEN_FILE)
+    parser.add_argument("--status-file", default=MAIN_BOT_STATUS_FILE)
+    parser.add_argument("--healthy-interval", type=float, default=300)
+    parser.add_argument("--failing-interval", type=float, default=15)
+    parser.add_argument("--api-server", default=None, help="свой Bot API, например fake_bot_api.py")
+    parser.add_argument("--once", action="store_true", help="один раунд проверок и выход")
+    args = parser.parse_args()
+
+    log_format = '%(asctime)s - HEALTH - %(levelname)s - %(message)s'
+    setup_logging(f"{BASE_DIR}/logs/health_monitor.log", fmt=log_format)
+    if args.once:
+        # Разовый запуск - из консоли: предупреждения видны сразу
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter(log_format))
+        logging.getLogger().addHandler(console)
+
+    asyncio.run(main(args))
@@ -6,20 +6,37 @@ import logging
 import subprocess
 import json
 import os
-import random
 from datetime import datetime
 import time
 import re
 import shutil
 import signal
-import requests
-from collections import defaultdict
 from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-import psycopg2
-from psycopg2.extras import DictCursor
+from atomic_file import write_json_atomic
+from bot_api import set_shared_session, username_cache
+from clone_jobs import CloneJobQueue
+from clone_supervisor import CloneSupervisor, process_alive
+from db_pool import DBPool
+from expiry import ExpiryScheduler
+from failover import MAIN_HOLDER, MAIN_RANK, LeaseElector
+from fsm_storage import StateStoreStorage
+from log_pipeline import sampled, setup_logging
+import metrics
+from screen_cache import edit_screen, screen_cache
+from screens import (CREATE_CLONE_HINT, Screen, ScreenRouter, back_button, clone_menu, common_screens,
+                     create_bot_menu, main_menu, menu_button, profile_keyboard)
+from send_queue import send_queue
+from spam_guard import SpamGuard, generate_captcha
+from state_store import StateStore
+from text_cache import TextCache
+from update_poller import UpdatePoller
+from webhook_server import WebhookServer
 
 import sys
 import socket
@@ -78,17 +95,73 @@ def load_config():
                 "database": "karantir_bot",
                 "user": "karantir_user",
                 "password": "karantir_pass",
-                "port": 5432
+                "port": 5432,
+                "pool_min_size": 1,
+                "pool_max_size": 5,
+                "pool_acquire_timeout": 5,
+                "pool_health_check_interval": 30
             },
             "bot": {
                 "token_file": "/var/www/imlerih_bot/txt/token.txt",
                 "logs_dir": "/var/www/imlerih_bot/logs",
                 "clones_dir": "/var/www/imlerih_bot/clones"
             },
+            "cache": {
+                "texts_ttl": 600,
+                "texts_max_size": 256,
+                "texts_refresh_interval": 300,
+                "texts_snapshot_file": "/var/www/imlerih_bot/texts_snapshot.json"
+            },
+            "clones": {
+                "mode": "process",
+                "host_socket": "/var/www/imlerih_bot/bot_host.sock",
+                "supervisor_socket": "/var/www/imlerih_bot/shard_supervisor.sock",
+                "launcher": "/var/www/imlerih_bot/fixed_launcher.py",
+                "max_parallel_launches": 2,
+                "launch_timeout": 30,
+                "supervisor": {
+                    "memory_limit_mb": 256,
+                    "cpu_limit_percent": 80,
+                    "check_interval": 5,
+                    "restart_backoff_max": 300,
+                    "term_timeout": 10,
+                    "unthrottle_after": 60,
+                    "zygote_socket": None
+                }
+            },
+            "webhook": {
+                "enabled": False,
+                "base_url": "https://example.com",
+                "host": "127.0.0.1",
+                "port": 8080,
+                "path_prefix": "/tg"
+            },
             "security": {
                 "captcha_lifetime": 300,
-                "spam_time_window": 10,
-                "spam_message_limit": 5
+                "spam_time_window": 30,
+                "spam_message_limit": 3,
+                "shared_state_flush_interval": 0.5
+            },
+            "failover": {
+                "enabled": True,
+                "lease_ttl": 3,
+                "heartbeat_interval": 1
+            },
+            "fsm": {
+                "state_ttl": 86400,
+                "flush_interval": 1
+            },
+            "logging": {
+                "max_bytes": 10485760,
+                "backup_count": 5,
+                "compress": True,
+                "sample_rate": 5
+            },
+            "metrics": {
+                "enabled": True,
+                "host": "127.0.0.1",
+                "port": 9101,
+                "loop_lag_interval": 0.5
             }
         }
     except json.JSONDecodeError as e:
@@ -106,9 +179,14 @@ except FileNotFoundError:
     print(f"❌ Файл токена не найден: {token_file}!")
     exit()
 
-# Создаём основного бота и диспетчер
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# Создаём основного бота и диспетчер.
+# bot.api_server - адрес своего Bot API (например, заглушки fake_bot_api.py для локальной проверки)
+if BOT_CONFIG.get("api_server"):
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(BOT_CONFIG["api_server"])))
+else:
+    bot = Bot(token=BOT_TOKEN)
+# Все отправки и правки идут через общую очередь с лимитами Telegram и обработкой 429
+bot.session.middleware(send_queue)
 
 # Файлы состояния
 BASE_DIR = "/var/www/imlerih_bot"
@@ -116,154 +194,66 @@ CLONES_DIR = BOT_CONFIG.get("clones_dir", f"{BASE_DIR}/clones")
 LOGS_DIR = BOT_CONFIG.get("logs_dir", f"{BASE_DIR}/logs")
 
 STATE_FILE = f"{BASE_DIR}/clone_state.json"
-BACKUP_TOKENS_FILE = f"{BASE_DIR}/backup_tokens.json"
-OWNER_CLONES_FILE = f"{BASE_DIR}/owner_clones.json"
-CLONE_PROCESSES_FILE = f"{BASE_DIR}/clone_processes.json"
+STATE_DB_FILE = f"{BASE_DIR}/state.db"
+
+# Клоны, резервные токены, владельцы и статусы хранятся в SQLite (WAL).
+# При первом запуске туда однократно переносятся старые JSON-файлы.
+state_store = StateStore(STATE_DB_FILE)
+state_store.migrate_json_files(BASE_DIR)
+
+# Состояния диалогов (FSM) тоже в state.db: переживают перезапуск и failover
+FSM_CONFIG = CONFIG.get("fsm", {})
+fsm_storage = StateStoreStorage(state_store, state_ttl=FSM_CONFIG.get("state_ttl", 86400),
+                                flush_interval=FSM_CONFIG.get("flush_interval", 1))
+dp = Dispatcher(storage=fsm_storage)
+# Время и ошибки каждого обработчика - в /metrics
+metrics.instrument_dispatcher(dp)
 
 # ========= ЗАЩИТА ОТ СПАМА ========
-captcha_storage = {}
-user_activity = defaultdict(list)
-CAPTCHA_LIFETIME = 300
-SPAM_TIME_WINDOW = 30
-SPAM_MESSAGE_LIMIT = 3
-
-def generate_captcha() -> tuple[str, int]:
-    a = random.randint(1, 10)
-    b = random.randint(1, 10)
-    operation = random.choice(['+', '-', '*'])
-    
-    if operation == '+':
-        answer = a + b
-        text = f"{a} + {b}"
-    elif operation == '-':
-        if a < b:
-            a, b = b, a
-        answer = a - b
-        text = f"{a} - {b}"
-    else:
-        a = random.randint(1, 5)
-        b = random.randint(1, 5)
-        answer = a * b
-        text = f"{a} × {b}"
-    
-    return text, answer
+SECURITY_CONFIG = CONFIG.get("security", {})
+CAPTCHA_LIFETIME = SECURITY_CONFIG.get("captcha_lifetime", 300)
+SPAM_TIME_WINDOW = SECURITY_CONFIG.get("spam_time_window", 30)
+SPAM_MESSAGE_LIMIT = SECURITY_CONFIG.get("spam_message_limit", 3)
+
+# Устаревшие капчи и неактивные пользователи удаляются фоновой задачей (запускается в main)
+expiry_scheduler = ExpiryScheduler()
+# Не больше SPAM_MESSAGE_LIMIT сообщений за SPAM_TIME_WINDOW секунд на пользователя - по всем ботам сразу:
+# счётчики и капчи синхронизируются с клонами через state.db
+spam_guard = SpamGuard(
+    state_store, expiry_scheduler,
+    limit=SPAM_MESSAGE_LIMIT,
+    window=SPAM_TIME_WINDOW,
+    captcha_lifetime=CAPTCHA_LIFETIME,
+    flush_interval=SECURITY_CONFIG.get("shared_state_flush_interval", 0.5)
+)
+captcha_storage = spam_guard.captchas
 
 def requires_captcha(user_id: int) -> bool:
-    """Проверяет, требуется ли капча для пользователя"""
-    # Проверяем активную капчу
-    if user_id in captcha_storage:
-        captcha_data = captcha_storage[user_id]
-        # Проверяем не устарела ли капча (больше 5 минут)
-        if time.time() - captcha_data["timestamp"] > CAPTCHA_LIFETIME:
-            captcha_storage.pop(user_id, None)
-            if user_id in user_activity:
-                user_activity.pop(user_id, None)
-            return False
-        return True
-    
-    # Проверяем активность пользователя
-    current_time = time.time()
-    
-    # Инициализируем историю если нет
-    if user_id not in user_activity:
-        user_activity[user_id] = []
-    
-    # Очищаем старые сообщения (старше SPAM_TIME_WINDOW секунд)
-    user_activity[user_id] = [t for t in user_activity[user_id] 
-                             if current_time - t < SPAM_TIME_WINDOW]
-    
-    # ЛОГИРОВАНИЕ для отладки
-    logging.info(f"📊 Активность пользователя {user_id}: {len(user_activity[user_id])} сообщений за {SPAM_TIME_WINDOW} сек")
-    
-    # Проверяем лимит сообщений
-    if len(user_activity[user_id]) >= SPAM_MESSAGE_LIMIT:  # Изменено на >=
-        # Превышен лимит - создаем капчу
-        logging.warning(f"⚠️ Превышен лимит для пользователя {user_id}")
-        question, answer = generate_captcha()
-        captcha_storage[user_id] = {
-            "answer": answer,
-            "timestamp": current_time
-        }
-        return True
-    
-    # Добавляем текущее сообщение В КОНЦЕ функции
-    user_activity[user_id].append(current_time)
-    
-    return False
+    """Проверяет, требуется ли капча для пользователя (лимит и капчи общие с клонами)"""
+    return spam_guard.requires_captcha(user_id)
 
-def main_bot_status_is_true():
-    status_file = "/var/www/imlerih_bot/status.json"
-    
-    status_data = {
-        "clone_status": "true"
-    }
-    
+async def main_bot_status_is_true():
     try:
-        with open(status_file, 'w') as f:
-            json.dump(status_data, f, indent=2)
-        
+        await state_store.aio.set_status("clone_status", "true")
         print(f"✅ Статус основного бота обновлен")
         return True
     except Exception as e:
         print(f"❌ Ошибка при обновлении статуса: {e}")
         return False
 
-def cleanup_old_captchas():
-    current_time = time.time()
-    expired_users = []
-    
-    for user_id, captcha_data in captcha_storage.items():
-        if current_time - captcha_data["timestamp"] > CAPTCHA_LIFETIME:
-            expired_users.append(user_id)
-    
-    for user_id in expired_users:
-        captcha_storage.pop(user_id, None)
-
-def cleanup_old_activity():
-    current_time = time.time()
-    for user_id in list(user_activity.keys()):
-        user_activity[user_id] = [t for t in user_activity[user_id] 
-                                 if current_time - t < 60]
-        if not user_activity[user_id]:
-            user_activity.pop(user_id, None)
-
 # ========== ФУНКЦИЯ ДЛЯ ГЕНЕРАЦИИ ССЫЛКИ НА КЛОНА ==========
 
-def get_bot_username(token: str) -> str:
+async def get_bot_username(token: str) -> str:
+    """Username бота по токену: из постоянного кэша или через getMe по общей сессии"""
     try:
-        url = f"https://api.telegram.org/bot{token}/getMe"
-        response = requests.get(url, timeout=10)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get("ok") and "result" in data:
-                username = data["result"].get("username")
-                if username:
-                    logging.info(f"✅ Получен username бота: @{username}")
-                    return username
-                else:
-                    logging.warning(f"⚠️ У бота нет username")
-                    return None
-            else:
-                logging.error(f"❌ API вернуло ошибку: {data}")
-                return None
-        else:
-            logging.error(f"❌ Ошибка HTTP {response.status_code}: {response.text}")
-            return None
-            
-    except requests.exceptions.Timeout:
-        logging.error("⏰ Таймаут при получении username бота")
-        return None
-    except requests.exceptions.RequestException as e:
-        logging.error(f"❌ Ошибка соединения при получении username: {e}")
-        return None
+        return await username_cache.get_username(token)
     except Exception as e:
         logging.error(f"❌ Неожиданная ошибка при получении username: {e}")
         return None
 
-def generate_clone_link(token: str) -> str:
+async def generate_clone_link(token: str) -> str:
     try:
-        username = get_bot_username(token)
+        username = await get_bot_username(token)
         
         if username:
             bot_link = f"https://t.me/{username}"
@@ -278,48 +268,16 @@ def generate_clone_link(token: str) -> str:
         return None
 
 # ========= КНОПКИ ========
-menu_button = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Меню", callback_data="menu")]])
-main_menu = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text="Профиль", callback_data="profile"), InlineKeyboardButton(text="Клон бота - защита", callback_data="clone")],
-    [InlineKeyboardButton(text="Оформить заказ", callback_data="place_order"), InlineKeyboardButton(text="Менеджер", callback_data="manager")],
-    [InlineKeyboardButton(text="Назад", callback_data="back_to_welcome")]
-])
-back_button = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="◀️ Назад", callback_data="menu")]])
-clone_menu = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text="Создать резервного бота", callback_data="create_clone")],
-    [InlineKeyboardButton(text="◀️ Назад", callback_data="menu")]
-])
-create_bot_menu = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="◀️ Назад", callback_data="clone")]])
-
-def get_db_connection():
-    """Создает подключение к БД на основе конфигурации"""
-    config = load_config()
-    db_config = config["database"]
-    
-    try:
-        connection = psycopg2.connect(
-            host=db_config.get("host", "localhost"),
-            database=db_config.get("database", "karantir_bot"),
-            user=db_config.get("user", "karantir_user"),
-            password=db_config.get("password", "karantir_pass"),
-            port=db_config.get("port", 5432)
-        )
-        return connection
-    except psycopg2.Error as e:
-        logging.error(f"❌ Ошибка подключения к БД: {e}")
-        # Показываем какие параметры используются (без пароля)
-        logging.error(f"📊 Параметры подключения: host={db_config.get('host')}, "
-                     f"db={db_config.get('database')}, user={db_config.get('user')}")
-        raise
+# Клавиатуры меню общие с клонами и собираются один раз - см. screens.py
+
+# Пул подключений к БД и кэш текстов создаются один раз в main() и закрываются при остановке
+db_pool = None
+text_cache = None
 
-def get_message_by_id(message_id: str) -> str:
+async def get_message_by_id(message_id: str) -> str:
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-        cursor.execute("SELECT text_message FROM interaction WHERE id_message = %s", (message_id,))
-        row = cursor.fetchone()
-        conn.close()
-        return row["text_message"] if row else "Текст не найден."
+        text = await text_cache.get(message_id)
+        return text if text is not None else "Текст не найден."
     except Exception as e:
         logging.error(f"❌ Ошибка при запросе к БД: {e}")
         return "Ошибка загрузки текста."
@@ -352,242 +310,199 @@ def init_bot_status():
         "bot_started": datetime.now().isoformat() + "Z"
     }
     
-    with open(status_file, 'w') as f:
-        json.dump(status_data, f, indent=2)
+    # Атомарно: клоны следят за файлом и не должны увидеть его наполовину записанным
+    write_json_atomic(status_file, status_data)
     
     print(f"✅ Файл статуса создан: {status_file}")
 
-def save_owner_clone_info(clone_token: str):
+async def save_owner_clone_info(clone_token: str):
     try:
-        if os.path.exists(OWNER_CLONES_FILE):
-            with open(OWNER_CLONES_FILE, 'r') as f:
-                owner_data = json.load(f)
-        else:
-            owner_data = {}
-        
         owner_token = BOT_TOKEN
-        if owner_token not in owner_data:
-            owner_data[owner_token] = []
-        
-        if clone_token not in owner_data[owner_token]:
-            owner_data[owner_token].append(clone_token)
-            with open(OWNER_CLONES_FILE, 'w') as f:
-                json.dump(owner_data, f, indent=2)
+        if await state_store.aio.add_owner_clone(owner_token, clone_token):
             logging.info(f"✅ Информация о владельце сохранена: {owner_token[:10]}... -> {clone_token[:10]}...")
             return True
     except Exception as e:
         logging.error(f"❌ Ошибка сохранения информации о владельце: {e}")
     return False
 
-def save_backup_token(token: str):
+async def save_backup_token(token: str):
     try:
-        tokens = []
-        if os.path.exists(BACKUP_TOKENS_FILE):
-            with open(BACKUP_TOKENS_FILE, 'r') as f:
-                content = f.read().strip()
-                if content:
-                    tokens = json.loads(content)
-        
-        if token not in tokens:
-            tokens.append(token)
-            with open(BACKUP_TOKENS_FILE, 'w') as f:
-                json.dump(tokens, f, indent=2)
+        if await state_store.aio.add_backup_token(token):
             logging.info(f"✅ Токен сохранен в резервные: {token[:10]}...")
-            save_owner_clone_info(token)
+            await save_owner_clone_info(token)
             return True
     except Exception as e:
         logging.error(f"❌ Ошибка сохранения токена: {e}")
-        try:
-            with open(BACKUP_TOKENS_FILE, 'w') as f:
-                json.dump([token], f, indent=2)
-            logging.info(f"✅ Создан новый файл с токеном: {token[:10]}...")
-            return True
-        except:
-            return False
     return False
 
-def save_clone_process_info(clone_id: str, pid: int, token: str):
+async def save_clone_process_info(clone_id: str, pid: int, token: str, clone_dir: str = None):
     try:
-        if os.path.exists(CLONE_PROCESSES_FILE):
-            with open(CLONE_PROCESSES_FILE, 'r') as f:
-                processes = json.load(f)
-        else:
-            processes = {}
-        
-        processes[clone_id] = {
-            "pid": pid,
-            "token": token[:10] + "...",
-            "start_time": time.time(),
-            "status": "running"
-        }
-        
-        with open(CLONE_PROCESSES_FILE, 'w') as f:
-            json.dump(processes, f, indent=2)
-        
+        await state_store.aio.upsert_clone(
+            clone_id,
+            pid=pid,
+            token_preview=token[:10] + "...",
+            clone_dir=clone_dir,
+            status="running",
+            start_time=time.time()
+        )
         logging.info(f"✅ Сохранена информация о процессе клона {clone_id}: PID={pid}")
         return True
     except Exception as e:
         logging.error(f"❌ Ошибка сохранения информации о процессе: {e}")
         return False
 
-def create_clone_with_launcher(token: str) -> tuple[bool, str]:
-    """Создание клона через исправленный лаунчер"""
+# Очередь создания клонов создаётся в main()
+clone_jobs = None
+# Сервер вебхуков - только в режиме webhook.enabled, иначе обновления получает update_poller
+webhook_server = None
+update_poller = None
+# Аренда роли основного бота (heartbeat для резервных клонов) - создаётся в main()
+failover = None
+# Процессы клонов в режиме clones.mode = "process"
+clone_supervisor = None
+# Логи пишет фоновый поток (log_pipeline) - создаётся при запуске
+log_pipeline = None
+# /metrics и замер задержки event loop - создаются в main(), если metrics.enabled
+metrics_server = None
+loop_lag_probe = None
+
+# Текущие значения считаются только при запросе /metrics
+metrics.gauge("bot_clone_jobs_pending", "Задачи создания клонов в очереди",
+              lambda: clone_jobs.pending if clone_jobs is not None else None)
+metrics.gauge("bot_supervised_clones", "Процессы клонов под надзором по состоянию",
+              lambda: clone_supervisor_states() if clone_supervisor is not None else None, ("state",))
+metrics.gauge("bot_log_queue_depth", "Строки лога, ещё не записанные на диск",
+              lambda: log_pipeline.queue.qsize() if log_pipeline is not None else None)
+metrics.gauge("bot_log_dropped_total", "Строки лога, потерянные при переполнении очереди",
+              lambda: log_pipeline.stats["dropped"] if log_pipeline is not None else None)
+
+
+def clone_supervisor_states() -> dict:
+    states = {}
+    for clone in clone_supervisor.clones.values():
+        states[(clone.state,)] = states.get((clone.state,), 0) + 1
+    return states
+
+
+async def create_clone_with_launcher(token: str, on_progress=None) -> tuple[bool, str]:
+    """Создание клона через исправленный лаунчер (асинхронная задача в очереди)"""
     try:
         logging.info(f"🔄 Создаю клон через исправленный лаунчер: {token[:10]}...")
         
-        # Путь к исправленному скрипту-лаунчеру
-        fixed_launcher = "/var/www/imlerih_bot/fixed_launcher.py"
-        
-        # Определяем какой лаунчер использовать
-        launcher_script = None
-        
-        if os.path.exists(fixed_launcher):
-            launcher_script = fixed_launcher
-            logging.info("✅ Использую исправленный лаунчер")
-        else:
+        if not clone_jobs.host_socket and not os.path.exists(clone_jobs.launcher_path):
             logging.error("❌ Ни один лаунчер не найден!")
             return False, "❌ Скрипт-лаунчер не найден"
         
-        # Проверяем что лаунчер существует
-        if not launcher_script or not os.path.exists(launcher_script):
-            return False, f"❌ Лаунчер не найден"
+        result = await clone_jobs.submit(token, on_progress)
         
-        # Запускаем лаунчер с таймаутом
-        cmd = ["timeout", "30", "python3", launcher_script, token]  # ← ДОБАВЛЕН timeout
-        logging.info(f"🚀 Запускаю лаунчер: {' '.join(cmd)}")
+        if not result.ok:
+            return False, f"❌ Ошибка запуска клона: {result.error}"
         
-        # Запускаем и ждем завершения
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=35  # На 5 секунд больше чем timeout
-        )
+        logging.info(f"✅ Клон {result.clone_id} запущен: PID={result.pid}, dir={result.clone_dir}")
+        if result.clone_dir is None:
+            # Клон подключён к хосту/воркеру - лаунчер не запускался, записываем сами
+            await save_clone_process_info(result.clone_id, result.pid, token)
         
-        # Проверяем результат
-        if result.returncode == 0:
-            # Успешно
-            output = result.stdout
-            
-            # Простой парсинг
-            clone_id = f"clone_{int(time.time())}"
-            pid = "unknown"
-            
-            for line in output.split('\n'):
-                if "🆔 ID:" in line:
-                    clone_id = line.split(":")[1].strip()
-                elif "📊 PID:" in line:
-                    pid = line.split(":")[1].strip()
-            
-            # Сохраняем токен
-            save_backup_token(token)
-            
-            # Генерируем ссылку на бота - теперь через API
-            bot_link = generate_clone_link(token)
+        # Сохраняем токен
+        await save_backup_token(token)
+        
+        # Генерируем ссылку на бота - теперь через API
+        if on_progress is not None:
+            await on_progress("🔗 Получаю ссылку на клона...")
+        bot_link = await generate_clone_link(token)
 
-            main_bot_status_is_true()
+        await main_bot_status_is_true()
 
-            message_text = f"✅ Резервный клон создан и запущен!"
-                
-            open_clone_button = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [InlineKeyboardButton(text="🔗 Открыть клона", url=bot_link)],
-                    [InlineKeyboardButton(text="◀️ Назад", callback_data="menu")]
-                ]                        
-            )
-            return True, (message_text, open_clone_button)
-        else:
-            error_msg = result.stderr if result.stderr else result.stdout
-            logging.error(f"❌ Ошибка запуска клона: {error_msg}")
-            return False, f"❌ Ошибка запуска клона: {error_msg}"
+        message_text = f"✅ Резервный клон создан и запущен!"
+        
+        buttons = []
+        if bot_link:
+            buttons.append([InlineKeyboardButton(text="🔗 Открыть клона", url=bot_link)])
+        buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data="menu")])
+        open_clone_button = InlineKeyboardMarkup(inline_keyboard=buttons)
+        return True, (message_text, open_clone_button)
         
-    except subprocess.TimeoutExpired:
-        logging.error("⏰ Таймаут при запуске клона")
-        return False, "Таймаут при запуске клона (превышено 30 секунд)"
     except Exception as e:
         logging.error(f"❌ Исключение при создании клона: {e}")
         return False, f"❌ Исключение при создании клона: {str(e)}"
 
-def has_created_clones() -> bool:
+async def has_created_clones() -> bool:
     try:
-        if os.path.exists(OWNER_CLONES_FILE):
-            with open(OWNER_CLONES_FILE, 'r') as f:
-                owner_data = json.load(f)
-            owner_token = BOT_TOKEN
-            if owner_token in owner_data:
-                clones = owner_data[owner_token]
-                return len(clones) > 0
-        return False
+        return await state_store.aio.has_owner_clones(BOT_TOKEN)
     except Exception as e:
         logging.error(f"❌ Ошибка проверки созданных клонов: {e}")
         return False
 
-def has_clones() -> bool:
+async def has_clones() -> bool:
     try:
-        if os.path.exists(BACKUP_TOKENS_FILE):
-            with open(BACKUP_TOKENS_FILE, 'r') as f:
-                tokens = json.load(f)
-                return len(tokens) > 0
-        return False
+        return await state_store.aio.has_backup_tokens()
     except Exception as e:
         logging.error(f"❌ Ошибка проверки клонов: {e}")
         return False
 
-def get_clones_list() -> str:
+async def get_clones_list() -> str:
     try:
         output_lines = ["📋 <b>Список клонов:</b>"]
         
-        if os.path.exists(CLONE_PROCESSES_FILE):
-            with open(CLONE_PROCESSES_FILE, 'r') as f:
-                processes = json.load(f)
-            
-            if not processes:
-                output_lines.append("\n📭 Активных клонов нет")
-            else:
-                for clone_id, info in processes.items():
-                    pid = info.get("pid", 0)
-                    token_preview = info.get("token", "unknown")
-                    start_time = info.get("start_time", 0)
-                    
-                    try:
-                        os.kill(pid, 0)
-                        process_status = "🟢 Запущен"
-                        uptime = int(time.time() - start_time)
-                        uptime_str = f"{uptime // 3600}ч {(uptime % 3600) // 60}м"
-                    except OSError:
-                        process_status = "🔴 Остановлен"
-                        uptime_str = "неактивен"
-                    
-                    output_lines.append(f"\n• <b>{clone_id}</b>")
-                    output_lines.append(f"  PID: {pid}, Статус: {process_status}")
-                    output_lines.append(f"  Токен: {token_preview}")
-                    output_lines.append(f"  Время работы: {uptime_str}")
+        processes = await state_store.aio.list_clones()
+        # Последние проверки getMe из health_monitor.py
+        health = await state_store.aio.get_health()
+        
+        if not processes:
+            output_lines.append("\n📭 Активных клонов нет")
         else:
-            output_lines.append("\n📭 Файл процессов не найден")
+            for info in processes:
+                clone_id = info["clone_id"]
+                pid = info.get("pid") or 0
+                token_preview = info.get("token_preview") or "unknown"
+                start_time = info.get("start_time") or 0
+                
+                # PID сверяется со временем старта процесса: занятый чужим процессом PID не считается клоном
+                if process_alive(pid, info.get("pid_start")):
+                    process_status = "🟢 Запущен"
+                    uptime = int(time.time() - start_time)
+                    uptime_str = f"{uptime // 3600}ч {(uptime % 3600) // 60}м"
+                elif info.get("status") == "restarting":
+                    process_status = "🟡 Перезапускается"
+                    uptime_str = "неактивен"
+                else:
+                    process_status = "🔴 Остановлен"
+                    uptime_str = "неактивен"
+                
+                output_lines.append(f"\n• <b>{clone_id}</b>")
+                output_lines.append(f"  PID: {pid}, Статус: {process_status}")
+                output_lines.append(f"  Токен: {token_preview}")
+                output_lines.append(f"  Время работы: {uptime_str}")
+                if info.get("rss"):
+                    output_lines.append(f"  Память: {info['rss'] / 1024 / 1024:.0f} МБ, CPU: {info.get('cpu') or 0:.0f}%, "
+                                        f"перезапусков: {info.get('restarts') or 0}")
+
+                bot_id = token_preview.split(":", 1)[0]
+                check = next((h for b, h in health.items() if bot_id and b.startswith(bot_id)), None)
+                if check is not None:
+                    icon = "🟢" if check["status"] == "online" else "🔴"
+                    availability = f", доступность {check['availability']:.0%}" if check["availability"] is not None else ""
+                    output_lines.append(f"  Telegram: {icon} {check['status']}, "
+                                        f"{(check['latency'] or 0) * 1000:.0f} мс{availability}")
         
         return "\n".join(output_lines)
         
     except Exception as e:
         return f"❌ Ошибка получения списка: {str(e)}"
 
-# создание файла status.json
+# сброс статуса клона при запуске (раньше - файл status.json)
 def create_status_file():
-    status_file = "/var/www/imlerih_bot/status.json"
-    status_data = {
-        "clone_status": "false"
-    }
-    
     try:
-        with open(status_file, 'w') as f:
-            json.dump(status_data, f, indent=4)
-        logging.info(f"✅ Создан файл статуса: {status_file}")
+        state_store.set_status("clone_status", "false")
+        logging.info("✅ Статус клона сброшен")
         return True
     except Exception as e:
         logging.error(f"❌ Ошибка создания файла статуса: {e}")
         return False
 
-# Глобальное состояние
-waiting_for_token_main = set()
+class CloneCreation(StatesGroup):
+    # После кнопки "Создать клона" бот ждёт токен
+    waiting_for_token = State()
 
 # ============ ОБРАБОТЧИКИ ОСНОВНОГО БОТА ============
 
@@ -595,7 +510,7 @@ waiting_for_token_main = set()
 async def start_handler(message: types.Message):
     logging.info(f"🎉 Основной бот: /start от {message.from_user.id}")
     
-    text = get_message_by_id("welcome")
+    text = await get_message_by_id("welcome")
     extra_text = "\n\n🎉 <b>Вы основной бот!</b>\nСоздайте резервного клона на случай сбоев.\n\n"
     
     await message.answer(text + extra_text, reply_markup=menu_button, parse_mode="HTML")
@@ -712,117 +627,93 @@ except Exception as e:
     # Удаляем тестовый файл
     os.remove(script_file)
 
-@dp.callback_query()
-async def callback_handler(callback: types.CallbackQuery):
-    action = callback.data
-    logging.info(f"🔘 Основной бот: нажата кнопка '{action}'")
+# ========= ЭКРАНЫ МЕНЮ ========
+async def captcha_before_menu(callback: types.CallbackQuery, **context) -> bool:
+    """Перед меню - капча в личные сообщения, если пользователь превысил лимит"""
+    user_id = callback.from_user.id
+    if not requires_captcha(user_id):
+        return True
+    question, answer = generate_captcha()
+    captcha_storage[user_id] = {
+        "answer": answer,
+        "timestamp": time.time()
+    }
+    await bot.send_message(
+        user_id,
+        f"🔒 <b>Проверка безопасности</b>\n\n"
+        f"Решите простой пример, чтобы открыть меню:\n"
+        f"<b>{question} = ?</b>\n\n"
+        f"Ответьте числом в чат.",
+        parse_mode="HTML"
+    )
+    await callback.answer("Требуется проверка безопасности")
+    return False
 
+async def captcha_before_create_clone(callback: types.CallbackQuery, **context) -> bool:
+    """Перед созданием клона - капча вместо экрана, если пользователь превысил лимит"""
     user_id = callback.from_user.id
-    
-    if action == "menu":
-        if requires_captcha(user_id):
-            question, answer = generate_captcha()
-            captcha_storage[user_id] = {
-                "answer": answer,
-                "timestamp": time.time()
-            }
-            
-            await bot.send_message(
-                user_id,
-                f"🔒 <b>Проверка безопасности</b>\n\n"
-                f"Решите простой пример, чтобы открыть меню:\n"
-                f"<b>{question} = ?</b>\n\n"
-                f"Ответьте числом в чат.",
-                parse_mode="HTML"
-            )
-            await callback.answer("Требуется проверка безопасности")
-            return
-        
-        await callback.message.edit_text("Меню", reply_markup=main_menu)
-        await callback.answer()
-        
-    elif action == "back_to_welcome":
-        text = get_message_by_id("welcome")
-        extra_text = "\n\n🎉 <b>Вы основной бот!</b>\nСоздайте резервного клона на случай сбоев.\n\n"
-        await callback.message.edit_text(text + extra_text, reply_markup=menu_button, parse_mode="HTML")
-        await callback.answer()
-        
-    elif action == "profile":
-        # Читаем статус из status.json
-        status_emoji = "⚪️"  # значение по умолчанию
-        
-        try:
-            status_file = "/var/www/imlerih_bot/status.json"
-            if os.path.exists(status_file):
-                with open(status_file, 'r') as f:
-                    status_data = json.load(f)
-                    if status_data.get("clone_status") == "false":
-                        status_emoji = "⚪️"
-                    else:
-                        status_emoji = "✅"
-        except Exception as e:
-            logging.error(f"❌ Ошибка чтения status.json: {e}")
-            status_emoji = "⚪️"  # при ошибке показываем ⚪️
-        
-        text = get_message_by_id("profile")
-        full_text = f"{text}\n\nСтатус клона: {status_emoji}"
-        
-        # Создаем клавиатуру с кнопкой "Клон" над кнопкой "Назад"
-        profile_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Клон", callback_data="clone")],
-            [InlineKeyboardButton(text="◀️ Назад", callback_data="menu")]
-        ])
-        
-        await callback.message.edit_text(full_text, reply_markup=profile_keyboard)
-        await callback.answer()
-        
-    elif action == "clone":
-        text = get_message_by_id("clone")
-        extra_text = "\n\n🎉 <b>Вы основной бот!</b>\nСоздайте резервного клона для надёжности."
-        await callback.message.edit_text(text + extra_text, reply_markup=clone_menu, parse_mode="HTML")
-        await callback.answer()
-        
-    elif action == "create_clone":
-        user_id = callback.from_user.id
-        if requires_captcha(user_id):
-            question, answer = generate_captcha()
-            captcha_storage[user_id] = {
-                "answer": answer,
-                "timestamp": time.time()
-            }
-            
-            await callback.message.edit_text(
-                f"🔒 <b>Проверка безопасности</b>\n\n"
-                f"Прежде чем создать клона, решите пример:\n"
-                f"<b>{question} = ?</b>\n\n"
-                f"Ответьте числом в чат.",
-                parse_mode="HTML",
-                reply_markup=create_bot_menu
-            )
-            await callback.answer("Требуется проверка безопасности")
-            return
-        
-        text = get_message_by_id("guide_create_clone")
-        full_text = text + "\n\n📝 <b>Создание резервного клона</b>\n\nОтправьте мне токен нового бота.\n\nПример токена:\n<code>1234567890:ABCdefGHIjklmNoPQRsTUVwxyZ-1234567890</code>"
-        await callback.message.edit_text(full_text, reply_markup=create_bot_menu, parse_mode="HTML")
-        waiting_for_token_main.add(callback.from_user.id)
-        await callback.answer()
-        
-    elif action == "place_order":
-        text = get_message_by_id("place_order")
-        await callback.message.edit_text(text, reply_markup=back_button)
-        await callback.answer()
-        
-    elif action == "manager":
-        text = get_message_by_id("manager")
-        await callback.message.edit_text(text, reply_markup=back_button)
-        await callback.answer()
+    if not requires_captcha(user_id):
+        return True
+    question, answer = generate_captcha()
+    captcha_storage[user_id] = {
+        "answer": answer,
+        "timestamp": time.time()
+    }
+    await edit_screen(
+        callback,
+        f"🔒 <b>Проверка безопасности</b>\n\n"
+        f"Прежде чем создать клона, решите пример:\n"
+        f"<b>{question} = ?</b>\n\n"
+        f"Ответьте числом в чат.",
+        parse_mode="HTML",
+        reply_markup=create_bot_menu
+    )
+    await callback.answer("Требуется проверка безопасности")
+    return False
+
+async def render_profile(callback: types.CallbackQuery, **context):
+    # Читаем статус клона из хранилища состояния
+    status_emoji = "⚪️"  # значение по умолчанию
+    try:
+        clone_status = await state_store.aio.get_status("clone_status")
+        if clone_status is not None and clone_status != "false":
+            status_emoji = "✅"
+    except Exception as e:
+        logging.error(f"❌ Ошибка чтения статуса клона: {e}")
+
+    text = await get_message_by_id("profile")
+    return f"{text}\n\nСтатус клона: {status_emoji}", profile_keyboard
+
+main_screens = ScreenRouter(get_message_by_id, common_screens())
+main_screens.add("menu", Screen(text="Меню", keyboard=main_menu, guards=[captcha_before_menu]))
+main_screens.add("back_to_welcome", Screen(
+    text_key="welcome",
+    extra="\n\n🎉 <b>Вы основной бот!</b>\nСоздайте резервного клона на случай сбоев.\n\n",
+    keyboard=menu_button, parse_mode="HTML"
+))
+main_screens.add("profile", Screen(render=render_profile))
+main_screens.add("clone", Screen(
+    text_key="clone",
+    extra="\n\n🎉 <b>Вы основной бот!</b>\nСоздайте резервного клона для надёжности.",
+    keyboard=clone_menu, parse_mode="HTML"
+))
+main_screens.add("create_clone", Screen(
+    text_key="guide_create_clone", extra=CREATE_CLONE_HINT, keyboard=create_bot_menu, parse_mode="HTML",
+    guards=[captcha_before_create_clone],
+    on_show=lambda callback, state: state.set_state(CloneCreation.waiting_for_token)
+))
+
+@dp.callback_query()
+async def callback_handler(callback: types.CallbackQuery, state: FSMContext):
+    logging.info(f"🔘 Основной бот: нажата кнопка '{callback.data}'", extra=sampled("button"))
+    await main_screens.dispatch(callback, state=state)
 
 @dp.message()
 @dp.message()
-async def message_handler(message: types.Message):
+async def message_handler(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     text = message.text.strip()
+    waiting_for_token = await state.get_state() == CloneCreation.waiting_for_token.state
     
     # Пропускаем команды
     if text.startswith('/'):
@@ -838,13 +729,11 @@ async def message_handler(message: types.Message):
                 user_answer = int(text)
                 if user_answer == expected_answer:
                     # Капча пройдена успешно
-                    captcha_storage.pop(user_id, None)
-                    if user_id in user_activity:
-                        user_activity.pop(user_id, None)
+                    spam_guard.solve(user_id)
                     
                     await message.answer("✅ Капча пройдена успешно! Теперь вы можете продолжить.")
                     
-                    if user_id in waiting_for_token_main:
+                    if waiting_for_token:
                         await message.answer("Теперь отправьте токен бота.")
                     else:
                         await message.answer("Меню", reply_markup=main_menu)
@@ -900,41 +789,117 @@ async def message_handler(message: types.Message):
             return
     
     # Если пользователь ожидает токен
-    if user_id in waiting_for_token_main:
+    if waiting_for_token:
         token = text
-        waiting_for_token_main.discard(user_id)
-        # ... обработка токена
+        if not is_valid_token(token):
+            await message.answer("❌ Это не похоже на токен бота. Проверьте и отправьте ещё раз.", reply_markup=create_bot_menu)
+            return
+        await state.clear()
+        
+        # Прогресс показываем правкой одного сообщения, сам запуск идёт в очереди и не блокирует бота
+        progress_message = await message.answer("⏳ Принял токен, создаю клона...")
+        last_progress = {"text": progress_message.text}
+        
+        async def show_progress(stage_text):
+            if stage_text != last_progress["text"]:
+                last_progress["text"] = stage_text
+                await progress_message.edit_text(stage_text)
+        
+        success, result = await create_clone_with_launcher(token, on_progress=show_progress)
+        if success:
+            result_text, keyboard = result
+            await progress_message.edit_text(result_text, reply_markup=keyboard)
+        else:
+            await progress_message.edit_text(result, reply_markup=back_button)
+        return
     
     # Для всех других сообщений
     await message.answer(f"Я получил: {text}\nНажмите 'Меню' для выбора действий.")
 
 init_bot_status()
 
-async def cleanup_old_data():
-    """Очистка старых данных при запуске"""
-    current_time = time.time()
-    
-    # Очищаем старые капчи
-    expired_users = []
-    for user_id, captcha_data in captcha_storage.items():
-        if current_time - captcha_data["timestamp"] > CAPTCHA_LIFETIME:
-            expired_users.append(user_id)
-    
-    for user_id in expired_users:
-        captcha_storage.pop(user_id, None)
-    
-    # Очищаем старую активность
-    for user_id in list(user_activity.keys()):
-        user_activity[user_id] = [t for t in user_activity[user_id] 
-                                 if current_time - t < 60]
-        if not user_activity[user_id]:
-            user_activity.pop(user_id, None)
+# =========== ЗАПУСК: ВЕБХУК ИЛИ POLLING ===========
+
+async def wait_for_stop_signal(task: asyncio.Task = None):
+    """Ждёт SIGTERM/SIGINT (или завершения task, если она упала раньше)"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+    waiter = asyncio.create_task(stop_event.wait())
+    await asyncio.wait([waiter] + ([task] if task is not None else []), return_when=asyncio.FIRST_COMPLETED)
+    waiter.cancel()
 
-# =========== POLLING ЗАПУСК ===========
+async def run_webhook(webhook_config: dict) -> bool:
+    """Принимает обновления через вебхук до сигнала остановки; False - включить вебхук не удалось"""
+    global webhook_server
+    webhook_server = WebhookServer(
+        base_url=webhook_config["base_url"],
+        host=webhook_config.get("host", "127.0.0.1"),
+        port=webhook_config.get("port", 8080),
+        path_prefix=webhook_config.get("path_prefix", "/tg")
+    )
+    await webhook_server.start()
+    if not await webhook_server.register(bot, lambda update: dp.feed_update(bot, update),
+                                         allowed_updates=dp.resolve_used_update_types()):
+        await webhook_server.stop()
+        webhook_server = None
+        return False
+
+    logging.info(f"🔄 Запуск бота в режиме вебхука: {webhook_server.url_for(BOT_TOKEN)[:-32]}...")
+    await wait_for_stop_signal()
+    return True
+
+async def run_polling():
+    """getUpdates с сохранённого offset: накопившееся за простой не теряется"""
+    global update_poller
+    # Вебхук снимаем без drop_pending_updates - очередь Telegram разберёт update_poller
+    await bot.delete_webhook(drop_pending_updates=False)
+    logging.info("🗑️ Вебхук удален (если был)")
+
+    logging.info("🔄 Запуск бота в polling-режиме...")
+    update_poller = UpdatePoller(
+        bot, lambda update: dp.feed_update(bot, update),
+        store=state_store,
+        name="main",
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    polling_task = asyncio.create_task(update_poller.run())
+    await wait_for_stop_signal(polling_task)
+    if not polling_task.done():
+        polling_task.cancel()
+    try:
+        await polling_task
+    except asyncio.CancelledError:
+        pass
 
 async def main():
+    global db_pool, text_cache, clone_jobs, failover, clone_supervisor, metrics_server, loop_lag_probe
     try:
-        cleanup_old_captchas()
+        # Метрики - первыми: по ним видно и то, как долго идёт запуск
+        metrics_config = CONFIG.get("metrics", {})
+        if metrics_config.get("enabled", True):
+            loop_lag_probe = metrics.LoopLagProbe(metrics_config.get("loop_lag_interval", 0.5))
+            loop_lag_probe.start()
+            try:
+                metrics_server = metrics.MetricsServer(metrics_config.get("host", "127.0.0.1"),
+                                                       metrics_config.get("port", 9101))
+                await metrics_server.start()
+            except OSError as e:
+                # Занятый порт не должен мешать работе бота
+                logging.error(f"❌ Не удалось запустить сервер метрик: {e}")
+                metrics_server = None
+
+        expiry_scheduler.start()
+        spam_guard.start()
+
+        # Пока основной бот продлевает аренду, резервные клоны не берут его роль
+        failover_config = CONFIG.get("failover", {})
+        if failover_config.get("enabled", True):
+            failover = LeaseElector(state_store, ttl=failover_config.get("lease_ttl", 3),
+                                    interval=failover_config.get("heartbeat_interval", 1))
+            failover.add_candidate(MAIN_HOLDER, MAIN_RANK)
+            failover.start()
         os.makedirs(CLONES_DIR, exist_ok=True)
         os.makedirs(LOGS_DIR, exist_ok=True)
         
@@ -942,30 +907,122 @@ async def main():
         
         create_status_file()
 
-        await bot.delete_webhook(drop_pending_updates=True)
-        logging.info("🗑️ Вебхук удален (если был)")
-        
-        logging.info("🔄 Запуск бота в polling-режиме...")
+        # Режимы клонов: process - отдельный процесс на клона через лаунчер,
+        # host - один bot_host.py, sharded - воркеры shard_supervisor.py
+        clones_config = CONFIG.get("clones", {})
+        clones_mode = clones_config.get("mode", "process")
+        host_socket = None
+        if clones_mode == "host":
+            host_socket = clones_config.get("host_socket", f"{BASE_DIR}/bot_host.sock")
+        elif clones_mode == "sharded":
+            host_socket = clones_config.get("supervisor_socket", f"{BASE_DIR}/shard_supervisor.sock")
+        else:
+            # Процессы клонов принадлежат основному боту: упавшие перезапускаются, ресурсы под контролем
+            supervisor_config = clones_config.get("supervisor", {})
+            clone_supervisor = CloneSupervisor(
+                state_store,
+                memory_limit_mb=supervisor_config.get("memory_limit_mb", 256),
+                cpu_limit_percent=supervisor_config.get("cpu_limit_percent", 80),
+                check_interval=supervisor_config.get("check_interval", 5),
+                backoff_max=supervisor_config.get("restart_backoff_max", 300),
+                term_timeout=supervisor_config.get("term_timeout", 10),
+                unthrottle_after=supervisor_config.get("unthrottle_after", 60),
+                zygote_socket=supervisor_config.get("zygote_socket")
+            )
+            await clone_supervisor.start()
+        clone_jobs = CloneJobQueue(
+            launcher_path=clones_config.get("launcher", f"{BASE_DIR}/fixed_launcher.py"),
+            max_parallel=clones_config.get("max_parallel_launches", 2),
+            timeout=clones_config.get("launch_timeout", 30),
+            host_socket=host_socket,
+            supervisor=clone_supervisor
+        )
+        clone_jobs.start()
+
+        # Вспомогательные вызовы Bot API (getMe клонов и т.п.) идут через keep-alive сессию основного бота
+        set_shared_session(bot.session)
+
+        # Тексты отдаются из снимка сразу, а БД подключается и перечитывается в фоне
+        db_pool = DBPool(CONFIG["database"])
+        cache_config = CONFIG.get("cache", {})
+        text_cache = TextCache(
+            db_pool,
+            ttl=cache_config.get("texts_ttl", 600),
+            max_size=cache_config.get("texts_max_size", 256),
+            snapshot_path=cache_config.get("texts_snapshot_file", f"{BASE_DIR}/texts_snapshot.json")
+        )
+        text_cache.load_snapshot()
+        text_cache.start(
+            refresh_interval=cache_config.get("texts_refresh_interval", 300),
+            write_snapshot=True,
+            check_trigger=True
+        )
+
         logging.info(f"🔑 Токен: {BOT_TOKEN[:10]}...")
         logging.info("🔒 Защита от спама активирована")
         logging.info("💡 Отправьте /start в боте для проверки")
-        
-        await dp.start_polling(bot)
+
+        # Вебхук - если включён в конфиге; при ошибке setWebhook остаёмся на polling
+        webhook_config = CONFIG.get("webhook", {})
+        if webhook_config.get("enabled") and await run_webhook(webhook_config):
+            return
+
+        await run_polling()
         
     except Exception as e:
         logging.error(f"❌ Критическая ошибка при запуске: {e}")
         raise
     finally:
         logging.info("⛔ Остановка бота...")
+        if update_poller is not None:
+            logging.info(f"📊 Статистика получения обновлений: {update_poller.get_stats()}")
+        logging.info(f"📊 Очередь отправки: {send_queue.get_stats()}")
+        logging.info(f"📊 Кэш экранов: {screen_cache.get_stats()}")
+        if webhook_server is not None:
+            logging.info(f"📊 Статистика вебхуков: {webhook_server.get_stats()}")
+            await webhook_server.stop()
+        if clone_jobs is not None:
+            await clone_jobs.stop()
+        if clone_supervisor is not None:
+            # Клоны продолжают работать: после перезапуска бот подхватит их снова
+            logging.info(f"📊 Процессы клонов: {clone_supervisor.get_stats()}")
+            await clone_supervisor.stop()
+        if failover is not None:
+            # Аренда отдаётся сразу: резервный клон подхватит роль, не дожидаясь её истечения
+            logging.info(f"📊 Failover: {failover.get_stats()}")
+            await failover.stop()
+        logging.info(f"📊 Фоновая очистка: {expiry_scheduler.get_stats()}")
+        await expiry_scheduler.stop()
+        logging.info(f"📊 Защита от спама: {spam_guard.get_stats()}")
+        await spam_guard.stop()
+        logging.info(f"📊 Состояния FSM: {fsm_storage.get_stats()}")
+        await fsm_storage.close()
+        if text_cache is not None:
+            logging.info(f"📊 Статистика кэша текстов: {text_cache.get_stats()}")
+            await text_cache.stop()
+        if db_pool is not None:
+            logging.info(f"📊 Статистика пула БД: {db_pool.get_stats()}")
+            await db_pool.close()
+        logging.info(f"📊 Кэш username: {username_cache.stats}")
+        await username_cache.close()
+        send_queue.close()
         await bot.session.close()
+        if loop_lag_probe is not None:
+            await loop_lag_probe.stop()
+        if metrics_server is not None:
+            await metrics_server.stop()
+        if log_pipeline is not None:
+            logging.info(f"📊 Логи: {log_pipeline.get_stats()}")
 
 if __name__ == "__main__":
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler("/var/www/imlerih_bot/logs/bot.log")
-        ]
+    # Обработчики только кладут строки в очередь, на диск их пишет фоновый поток
+    log_config = CONFIG.get("logging", {})
+    log_pipeline = setup_logging(
+        f"{LOGS_DIR}/bot.log",
+        max_bytes=log_config.get("max_bytes", 10 * 1024 * 1024),
+        backup_count=log_config.get("backup_count", 5),
+        compress=log_config.get("compress", True),
+        sample_rate=log_config.get("sample_rate", 5)
     )
     
     asyncio.run(main())
\ No newline at end of file
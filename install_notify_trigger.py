@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/install_notify_trigger.py - разовая установка триггера уведомлений interaction
+#
+# Триггер сообщает ботам (LISTEN interaction_changed) об изменении текстов.
+# CREATE TRIGGER требует прав владельца таблицы и берёт на interaction
+# блокировку ACCESS EXCLUSIVE, поэтому бот его не ставит, а только проверяет
+# при старте. Запускается один раз (и после пересоздания таблицы) от владельца:
+#
+#   python3 install_notify_trigger.py --user postgres
+#
+# Без --user/--password используется подключение из секции database config.json.
+
+import argparse
+import getpass
+import json
+import sys
+
+import psycopg2
+
+from db_pool import connect_kwargs
+from text_cache import NOTIFY_TRIGGER, NOTIFY_TRIGGER_SQL
+
+CONFIG_FILE = "/var/www/imlerih_bot/config.json"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Установка триггера уведомлений таблицы interaction")
+    parser.add_argument("--config", default=CONFIG_FILE)
+    parser.add_argument("--user", default=None, help="владелец таблицы interaction")
+    parser.add_argument("--password", default=None, help="без значения при --user - спросить")
+    args = parser.parse_args()
+
+    try:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            db_config = json.load(f).get("database", {})
+    except FileNotFoundError:
+        db_config = {}
+    if args.user:
+        db_config["user"] = args.user
+        db_config["password"] = args.password if args.password is not None else getpass.getpass()
+
+    try:
+        conn = psycopg2.connect(**connect_kwargs(db_config))
+    except psycopg2.Error as e:
+        print(f"❌ Не удалось подключиться к БД: {e}")
+        return 1
+    try:
+        with conn, conn.cursor() as cursor:
+            cursor.execute(NOTIFY_TRIGGER_SQL)
+    except psycopg2.Error as e:
+        print(f"❌ Не удалось установить триггер {NOTIFY_TRIGGER}: {e}")
+        return 1
+    finally:
+        conn.close()
+    print(f"✅ Триггер {NOTIFY_TRIGGER} установлен на interaction")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/log_pipeline.py - запись логов в фоновом потоке
+#
+# logging.FileHandler пишет и сбрасывает файл прямо в вызывающем коде, то есть
+# в event loop: медленный диск задерживает обработку обновлений. Здесь
+# обработчик только кладёт запись в очередь (без блокировки: при переполнении
+# запись отбрасывается и учитывается в stats), а поток-писатель забирает
+# записи пачками, пишет их одним write и ротирует файл по размеру (старые
+# части сжимаются в .gz).
+#
+# Частые строки (нажатия кнопок и т.п.) можно помечать extra=sampled("ключ"):
+# по каждому ключу пишется не больше sample_rate строк в секунду, число
+# пропущенных добавляется к следующей записанной строке.
+
+import atexit
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+
+DEFAULT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_STOP = object()
+
+
+def sampled(key: str) -> dict:
+    """extra для строки, которую можно прореживать: logger.info(..., extra=sampled("button"))"""
+    return {"sample": key}
+
+
+class SampleFilter(logging.Filter):
+    """Не больше rate записей в секунду (до burst подряд) на каждый ключ sample"""
+
+    def __init__(self, rate: float = 5.0, burst: int = 10):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample", None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, skipped = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, skipped + 1)
+                self.suppressed += 1
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if skipped:
+            record.msg = f"{record.msg} (+{skipped} таких же пропущено)"
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Кладёт запись в очередь, не блокируя вызывающий код"""
+
+    def __init__(self, pipeline):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Аргументы подставляются сразу (объекты могут измениться), но без copy() и
+        # полного форматирования, как в QueueHandler: время и уровень оформит поток-писатель
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.pipeline.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Лучше потерять строку лога, чем остановить event loop
+            self.pipeline.stats["dropped"] += 1
+
+
+class LogPipeline:
+    """Очередь записей + поток, пишущий их пачками в ротируемый файл"""
+
+    def __init__(self, path: str, fmt: str = DEFAULT_FORMAT, max_bytes: int = 10 * 1024 * 1024,
+                 backup_count: int = 5, compress: bool = True, batch_size: int = 512,
+                 flush_interval: float = 0.5, queue_size: int = 10000,
+                 sample_rate: float = 5.0, sample_burst: int = 10):
+        self.path = path
+        self.formatter = logging.Formatter(fmt)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(queue_size)
+        self.sampler = SampleFilter(sample_rate, sample_burst)
+
+        self.handler = _QueueHandler(self)
+        self.handler.addFilter(self.sampler)
+
+        self._stream = None
+        self._size = 0
+        self._thread = None
+        self.stats = {"records": 0, "dropped": 0, "batches": 0, "rotations": 0, "write_errors": 0}
+
+    # ========== ПОТОК-ПИСАТЕЛЬ ==========
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._stream = open(self.path, 'a', encoding='utf-8')
+        self._size = self._stream.tell()
+
+    def _backup_name(self, index: int) -> str:
+        return f"{self.path}.{index}.gz" if self.compress else f"{self.path}.{index}"
+
+    def _rotate(self):
+        """bot.log -> bot.log.1(.gz), bot.log.1 -> bot.log.2 ... старше backup_count удаляются"""
+        self._stream.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(self._backup_name(index)):
+                    os.replace(self._backup_name(index), self._backup_name(index + 1))
+            if self.compress:
+                with open(self.path, 'rb') as src, gzip.open(self._backup_name(1), 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.unlink(self.path)
+            else:
+                os.replace(self.path, self._backup_name(1))
+        else:
+            os.unlink(self.path)
+        self.stats["rotations"] += 1
+        self._open()
+
+    def _write(self, records: list):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception:
+                self.stats["write_errors"] += 1
+        if not lines:
+            return
+        data = "\n".join(lines) + "\n"
+        try:
+            self._stream.write(data)
+            self._stream.flush()
+            self._size += len(data.encode('utf-8'))
+            if self.max_bytes and self._size >= self.max_bytes:
+                self._rotate()
+        except Exception:
+            self.stats["write_errors"] += 1
+        self.stats["records"] += len(lines)
+        self.stats["batches"] += 1
+
+    def _run(self):
+        self._open()
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in batch
+            self._write([record for record in batch if record is not _STOP])
+            if stop:
+                self._stream.close()
+                return
+
+    # ========== ЖИЗНЕННЫЙ ЦИКЛ ==========
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """Дописывает очередь и останавливает поток"""
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["queued"] = self.queue.qsize()
+        stats["sampled_out"] = self.sampler.suppressed
+        return stats
+
+
+def setup_logging(path: str, fmt: str = DEFAULT_FORMAT, level=logging.INFO, **options) -> LogPipeline:
+    """Корневой логгер пишет через LogPipeline; options - параметры LogPipeline"""
+    pipeline = LogPipeline(path, fmt, **options)
+    logging.basicConfig(level=level, handlers=[pipeline.handler], force=True)
+    pipeline.start()
+    atexit.register(pipeline.stop)
+    return pipeline
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/metrics.py - метрики процесса в формате Prometheus
+#
+# Счётчики и гистограммы обновляются прямо в коде (несколько сложений и поиск
+# корзины - без блокировок и ввода-вывода). Глубины очередей и прочие
+# текущие значения - функции, которые вызываются только при запросе
+# /metrics, поэтому без сборщика метрики почти ничего не стоят.
+#
+# Основной бот и bot_host.py поднимают MetricsServer на 127.0.0.1:
+#   curl -s 127.0.0.1:9101/metrics
+
+import asyncio
+import bisect
+import logging
+import time
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+# Секунды: от быстрых операций в памяти до long polling
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *labels, value: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in list(self._values.items()):
+            lines.append(f"{self.name}{_labels_text(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счётчики по корзинам (без накопления), сумма, количество]
+        self._values = {}
+
+    def observe(self, value: float, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels_text(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labels, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels_text(self.labels, labels)} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Gauge:
+    """Значение считает func() при каждом запросе /metrics: число или {(метки,): значение}"""
+
+    def __init__(self, name: str, help: str, func, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labels = tuple(labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.func()
+        except Exception as e:
+            logging.error(f"❌ Ошибка метрики {self.name}: {e}")
+            return []
+        if value is None:
+            return []
+        values = value if isinstance(value, dict) else {(): value}
+        for labels, v in values.items():
+            lines.append(f"{self.name}{_labels_text(self.labels, labels)} {_number(v)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        # Метрика с тем же именем регистрируется один раз
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, func, labels: tuple = ()) -> Gauge:
+        """Повторная регистрация заменяет func: показывается последний созданный объект"""
+        gauge = Gauge(name, help, func, labels)
+        self._metrics[name] = gauge
+        return gauge
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+counter = registry.counter
+histogram = registry.histogram
+gauge = registry.gauge
+
+
+# ========== ОБЩИЕ МЕТРИКИ ==========
+
+HANDLER_SECONDS = histogram("bot_handler_seconds", "Время обработчика aiogram", ("handler",))
+HANDLER_ERRORS = counter("bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+LOOP_LAG = histogram("bot_event_loop_lag_seconds", "Задержка event loop (опоздание таймера)")
+_last_lag = {"value": 0.0}
+gauge("bot_event_loop_lag_last_seconds", "Последний замер задержки event loop", lambda: _last_lag["value"])
+
+
+def observe_loop_lag(lag: float):
+    _last_lag["value"] = lag
+    LOOP_LAG.observe(lag)
+
+
+class LoopLagProbe:
+    """Раз в interval секунд замеряет, насколько позже срабатывает asyncio.sleep"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            observe_loop_lag(max(0.0, time.monotonic() - started - self.interval))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware aiogram: время и ошибки каждого обработчика по имени функции"""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+
+def instrument_dispatcher(dp):
+    """Подключает HandlerMetricsMiddleware к сообщениям и нажатиям кнопок"""
+    middleware = HandlerMetricsMiddleware()
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
+
+
+class MetricsServer:
+    """GET /metrics на локальном адресе"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9101, registry: Registry = registry):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.app = web.Application()
+        self.app.router.add_get("/metrics", self._handle)
+        self._runner = None
+        self.scrapes = 0
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.scrapes += 1
+        return web.Response(body=self.registry.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.host, self.port).start()
+        except OSError:
+            await self.stop()
+            raise
+        logging.info(f"📈 Метрики: http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
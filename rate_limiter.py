@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/rate_limiter.py - ограничение частоты сообщений пользователей
+
+import time
+from array import array
+from collections import OrderedDict
+
+
+class SlidingWindowLimiter:
+    """Скользящее окно "не больше limit сообщений за window секунд".
+
+    Для каждого пользователя хранится кольцевой буфер из limit последних
+    принятых отметок времени. Буферы всех пользователей лежат подряд в одном
+    array('d'), пользователю принадлежит слот - смещение в этом массиве.
+    Проверка - O(1) и без создания объектов: если самая старая отметка в
+    кольце моложе window, значит limit сообщений уже уложились в окно.
+
+    Слоты неактивных пользователей освобождаются понемногу при обычных
+    проверках (не больше expire_batch за раз), так что полного обхода нет.
+    """
+
+    __slots__ = ("limit", "window", "expire_batch", "_times", "_heads", "_last_seen",
+                 "_slots", "_free", "_capacity", "_next_expire", "stats")
+
+    GROW_BY = 1024
+
+    def __init__(self, limit: int, window: float, expire_batch: int = 32):
+        self.limit = max(1, int(limit))
+        self.window = float(window)
+        self.expire_batch = expire_batch
+
+        self._times = array('d')
+        self._heads = array('I')
+        self._last_seen = array('d')
+        # user_id -> слот; порядок - от давно неактивных к недавним
+        self._slots = OrderedDict()
+        self._free = []
+        self._capacity = 0
+        self._next_expire = 0.0
+
+        self.stats = {"checks": 0, "limited": 0, "expired": 0}
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._slots
+
+    def _grow(self):
+        old = self._capacity
+        self._capacity += self.GROW_BY
+        self._times.extend([float("-inf")] * (self.GROW_BY * self.limit))
+        self._heads.extend([0] * self.GROW_BY)
+        self._last_seen.extend([0.0] * self.GROW_BY)
+        self._free.extend(range(self._capacity - 1, old - 1, -1))
+
+    def _slot_for(self, user_id) -> int:
+        slot = self._slots.get(user_id)
+        if slot is None:
+            if not self._free:
+                self._grow()
+            slot = self._free.pop()
+            base = slot * self.limit
+            for i in range(base, base + self.limit):
+                self._times[i] = float("-inf")
+            self._heads[slot] = 0
+            self._slots[user_id] = slot
+        else:
+            self._slots.move_to_end(user_id)
+        return slot
+
+    def check(self, user_id, now: float = None) -> bool:
+        """Учитывает сообщение; True, если лимит превышен (сообщение не засчитывается)"""
+        if now is None:
+            now = time.time()
+        self.stats["checks"] += 1
+
+        slot = self._slot_for(user_id)
+        self._last_seen[slot] = now
+        base = slot * self.limit
+        head = self._heads[slot]
+
+        if now - self._times[base + head] < self.window:
+            self.stats["limited"] += 1
+            limited = True
+        else:
+            self._times[base + head] = now
+            self._heads[slot] = (head + 1) % self.limit
+            limited = False
+
+        if now >= self._next_expire:
+            self.expire_idle(now)
+        return limited
+
+    def count(self, user_id, now: float = None) -> int:
+        """Сколько сообщений пользователя попадает в текущее окно"""
+        slot = self._slots.get(user_id)
+        if slot is None:
+            return 0
+        if now is None:
+            now = time.time()
+        base = slot * self.limit
+        return sum(1 for i in range(base, base + self.limit) if now - self._times[i] < self.window)
+
+    def reset(self, user_id):
+        """Забывает историю пользователя (например, после пройденной капчи)"""
+        slot = self._slots.pop(user_id, None)
+        if slot is not None:
+            self._free.append(slot)
+
+    def expire_idle(self, now: float = None, max_items: int = None) -> int:
+        """Освобождает слоты пользователей, молчавших дольше окна (начиная с самых давних)"""
+        if now is None:
+            now = time.time()
+        if max_items is None:
+            max_items = self.expire_batch
+        expired = 0
+        while self._slots and expired < max_items:
+            user_id, slot = next(iter(self._slots.items()))
+            if now - self._last_seen[slot] < self.window:
+                break
+            del self._slots[user_id]
+            self._free.append(slot)
+            expired += 1
+        self.stats["expired"] += expired
+        # Следующая порция - не раньше чем через секунду, если эта не упёрлась в лимит
+        self._next_expire = now if expired == max_items else now + 1.0
+        return expired
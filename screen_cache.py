@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/screen_cache.py - пропуск правок, которые ничего не меняют
+#
+# Для каждого сообщения с меню помним отпечаток последнего отрисованного
+# экрана (текст, parse_mode, клавиатура). Если кнопка снова ведёт на тот же
+# экран (двойное нажатие, "Назад" на уже открытое меню), edit_text не
+# отправляется: Telegram всё равно ответил бы "message is not modified".
+
+import hashlib
+from collections import OrderedDict
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+
+class ScreenCache:
+    """LRU (bot_id, chat_id, message_id) -> отпечаток последнего экрана"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._screens = OrderedDict()
+        self.stats = {"skipped": 0, "edited": 0, "not_modified": 0}
+
+    @staticmethod
+    def fingerprint(text: str, reply_markup=None, parse_mode=None) -> bytes:
+        markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else ""
+        return hashlib.blake2b(f"{parse_mode}\x00{text}\x00{markup}".encode(), digest_size=16).digest()
+
+    def is_current(self, key, fingerprint: bytes) -> bool:
+        if self._screens.get(key) == fingerprint:
+            self._screens.move_to_end(key)
+            return True
+        return False
+
+    def remember(self, key, fingerprint: bytes):
+        self._screens[key] = fingerprint
+        self._screens.move_to_end(key)
+        if len(self._screens) > self.max_size:
+            self._screens.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["size"] = len(self._screens)
+        return stats
+
+
+screen_cache = ScreenCache()
+
+
+async def edit_screen(callback: types.CallbackQuery, text: str, reply_markup=None, parse_mode=None) -> bool:
+    """callback.message.edit_text, если экран отличается от уже показанного; True - правка отправлена"""
+    message = callback.message
+    key = (callback.bot.id, message.chat.id, message.message_id)
+    fingerprint = ScreenCache.fingerprint(text, reply_markup, parse_mode)
+    if screen_cache.is_current(key, fingerprint):
+        screen_cache.stats["skipped"] += 1
+        return False
+
+    try:
+        await message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+    except TelegramBadRequest as e:
+        # Экран уже такой (например, после перезапуска кэш пуст) - это не ошибка
+        if "message is not modified" not in str(e):
+            raise
+        screen_cache.stats["not_modified"] += 1
+    else:
+        screen_cache.stats["edited"] += 1
+    screen_cache.remember(key, fingerprint)
+    return True
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/screens.py - экраны меню, общие для основного бота и клонов
+#
+# Кнопка (callback_data) -> Screen: ключ текста в БД, заранее собранная
+# клавиатура и проверки (капча, доступность функции). Клавиатуры - неизменяемые
+# объекты, создаются один раз при импорте; выбор экрана - поиск в словаре
+# вместо цепочки if/elif.
+
+import inspect
+
+from aiogram import types
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+import metrics
+from screen_cache import edit_screen
+
+# ========= КЛАВИАТУРЫ ========
+menu_button = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Меню", callback_data="menu")]])
+
+main_menu = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Профиль", callback_data="profile"),
+     InlineKeyboardButton(text="Клон бота - защита", callback_data="clone")],
+    [InlineKeyboardButton(text="Оформить заказ", callback_data="place_order"),
+     InlineKeyboardButton(text="Менеджер", callback_data="manager")],
+    [InlineKeyboardButton(text="Назад", callback_data="back_to_welcome")]
+])
+
+# Меню клона, пока работает основной бот: Профиль и Клон бота неактивны
+main_menu_disabled = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="⛔ Профиль (основной бот работает)", callback_data="profile_disabled"),
+     InlineKeyboardButton(text="⛔ Клон бота (основной бот работает)", callback_data="clone_disabled")],
+    [InlineKeyboardButton(text="Оформить заказ", callback_data="place_order"),
+     InlineKeyboardButton(text="Менеджер", callback_data="manager")],
+    [InlineKeyboardButton(text="Назад", callback_data="back_to_welcome")]
+])
+
+back_button = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="◀️ Назад", callback_data="menu")]])
+
+clone_menu = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Создать резервного бота", callback_data="create_clone")],
+    [InlineKeyboardButton(text="◀️ Назад", callback_data="menu")]
+])
+
+create_bot_menu = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="◀️ Назад", callback_data="clone")]])
+
+profile_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Клон", callback_data="clone")],
+    [InlineKeyboardButton(text="◀️ Назад", callback_data="menu")]
+])
+
+CREATE_CLONE_HINT = ("\n\n📝 <b>Создание резервного клона</b>\n\nОтправьте мне токен нового бота.\n\n"
+                     "Пример токена:\n<code>1234567890:ABCdefGHIjklmNoPQRsTUVwxyZ-1234567890</code>")
+
+
+class Screen:
+    """Что показать по нажатию кнопки.
+
+    Текст - либо text, либо текст из БД по text_key, плюс extra. render(callback, **context)
+    возвращает (text, keyboard) для экранов, зависящих от состояния. guards - корутины
+    guard(callback, **context) -> bool: False значит, что проверка сама ответила пользователю
+    и экран не показывается. on_show(callback, **context) вызывается после показа
+    (может вернуть корутину, например state.set_state(...)).
+    """
+
+    __slots__ = ("text_key", "text", "extra", "keyboard", "parse_mode", "guards", "render", "on_show")
+
+    def __init__(self, text_key: str = None, text: str = None, extra: str = "", keyboard=None,
+                 parse_mode: str = None, guards=(), render=None, on_show=None):
+        self.text_key = text_key
+        self.text = text
+        self.extra = extra
+        self.keyboard = keyboard
+        self.parse_mode = parse_mode
+        self.guards = tuple(guards)
+        self.render = render
+        self.on_show = on_show
+
+
+SCREEN_SECONDS = metrics.histogram("bot_screen_seconds", "Показ экрана по кнопке (с проверками)", ("action",))
+
+
+class ScreenRouter:
+    """callback_data -> Screen; get_text(key) - корутина, отдающая текст по ключу"""
+
+    def __init__(self, get_text, screens: dict = None):
+        self.get_text = get_text
+        self._screens = dict(screens or {})
+
+    def add(self, action: str, screen: Screen):
+        self._screens[action] = screen
+
+    def __contains__(self, action: str) -> bool:
+        return action in self._screens
+
+    async def dispatch(self, callback: types.CallbackQuery, **context) -> bool:
+        """Показывает экран кнопки; False - такой кнопки нет (нажатие просто подтверждается)"""
+        screen = self._screens.get(callback.data)
+        if screen is None:
+            await callback.answer()
+            return False
+        # Метка - только известные кнопки, поэтому число рядов метрики ограничено
+        with SCREEN_SECONDS.time(callback.data):
+            return await self._show(screen, callback, **context)
+
+    async def _show(self, screen: Screen, callback: types.CallbackQuery, **context) -> bool:
+        for guard in screen.guards:
+            if not await guard(callback, **context):
+                return True
+
+        if screen.render is not None:
+            text, keyboard = await screen.render(callback, **context)
+        else:
+            text = screen.text if screen.text is not None else await self.get_text(screen.text_key)
+            text += screen.extra
+            keyboard = screen.keyboard
+
+        await edit_screen(callback, text, reply_markup=keyboard, parse_mode=screen.parse_mode)
+        if screen.on_show is not None:
+            result = screen.on_show(callback, **context)
+            if inspect.isawaitable(result):
+                await result
+        await callback.answer()
+        return True
+
+
+def common_screens() -> dict:
+    """Экраны, одинаковые у основного бота и клонов"""
+    return {
+        "place_order": Screen(text_key="place_order", keyboard=back_button),
+        "manager": Screen(text_key="manager", keyboard=back_button),
+    }
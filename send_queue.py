@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/send_queue.py - очередь исходящих запросов к Bot API
+#
+# Middleware сессии aiogram: все sendMessage / edit* / answerCallbackQuery
+# всех ботов процесса проходят через очередь с приоритетами. Для каждого бота
+# соблюдается общий лимит (около 30 сообщений в секунду) и лимит на чат
+# (около 1 в секунду в личке, 20 в минуту в группах). Ответ 429 ставит бота
+# на паузу на retry_after секунд, и запрос повторяется сам, а не падает в
+# обработчике. Повторные правки одного сообщения, ещё не отправленные (в том
+# числе ждущие конца паузы после 429), склеиваются в одну - уходит только последняя.
+#
+# Подключение: bot.session.middleware(send_queue)
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+
+# Чем меньше, тем раньше: ответы на нажатия кнопок ждут меньше всего
+PRIORITY_ANSWER = 0
+PRIORITY_EDIT = 1
+PRIORITY_SEND = 2
+
+QUEUED_PREFIXES = ("Send", "Edit", "Answer", "Copy", "Forward", "DeleteMessage")
+# Правки, которые можно склеить: важна только последняя версия сообщения
+COALESCED_METHODS = ("EditMessageText", "EditMessageReplyMarkup", "EditMessageCaption")
+
+MAX_RETRIES = 3
+
+BOT_API_SECONDS = metrics.histogram("bot_api_request_seconds", "Запрос к Bot API без ожидания в очереди", ("method",))
+BOT_API_ERRORS = metrics.counter("bot_api_errors_total", "Ошибки запросов к Bot API", ("method",))
+SEND_WAIT_SECONDS = metrics.histogram("bot_send_queue_wait_seconds", "Ожидание запроса в очереди отправки")
+
+
+async def _timed_request(make_request, bot, method, name: str):
+    started = time.perf_counter()
+    try:
+        return await make_request(bot, method)
+    except Exception:
+        BOT_API_ERRORS.inc(name)
+        raise
+    finally:
+        BOT_API_SECONDS.observe(time.perf_counter() - started, name)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен один токен"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    @property
+    def full(self) -> bool:
+        return self.tokens >= self.capacity
+
+
+class _Entry:
+    __slots__ = ("method", "priority", "seq", "chat_id", "key", "granted", "task", "waiters", "sending",
+                 "enqueued", "attempts")
+
+    def __init__(self, method, priority: int, seq: int, chat_id, key):
+        self.method = method
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.key = key
+        self.granted = asyncio.get_running_loop().create_future()
+        # Отправка идёт отдельной задачей: её ждут все вызовы, чьи правки склеены с этой
+        self.task = None
+        self.waiters = 1
+        # Запрос уже ушёл в Telegram - новую правку к нему не приклеить
+        self.sending = False
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+
+class _BotQueue:
+    """Очередь одного бота: FIFO на каждый чат, чаты выбираются по приоритету головы"""
+
+    def __init__(self, owner, bot_id: int):
+        self.owner = owner
+        self.bot_id = bot_id
+        self.global_bucket = TokenBucket(owner.global_rate, owner.global_rate)
+        self.chat_buckets = {}
+        self.chats = {}
+        self._ready = []
+        self._sleeping = []
+        self.depth = 0
+        self.paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                # Полные корзины ничего не ограничивают - их можно забыть
+                self.chat_buckets = {c: b for c, b in self.chat_buckets.items() if not b.full}
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.owner.group_rate, self.owner.chat_burst)
+            else:
+                bucket = TokenBucket(self.owner.private_rate, self.owner.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _schedule_chat(self, chat_key, now: float):
+        queue = self.chats[chat_key]
+        head = queue[0]
+        delay = self._chat_bucket(head.chat_id).delay(now) if head.chat_id is not None else 0.0
+        if delay > 0:
+            heapq.heappush(self._sleeping, (now + delay, head.seq, chat_key))
+        else:
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_key))
+
+    def put(self, entry: _Entry, front: bool = False):
+        # Запросы без чата (answerCallbackQuery) не ждут друг друга
+        chat_key = entry.chat_id if entry.chat_id is not None else ("entry", entry.seq)
+        self.depth += 1
+        queue = self.chats.get(chat_key)
+        if queue is not None:
+            if front:
+                queue.appendleft(entry)
+            else:
+                queue.append(entry)
+            return
+        self.chats[chat_key] = deque([entry])
+        self._schedule_chat(chat_key, time.monotonic())
+        self._wakeup.set()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def _wait(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._sleeping and self._sleeping[0][0] <= now:
+                _, _, chat_key = heapq.heappop(self._sleeping)
+                head = self.chats[chat_key][0]
+                heapq.heappush(self._ready, (head.priority, head.seq, chat_key))
+
+            if self.paused_until > now:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            if not self._ready:
+                timeout = self._sleeping[0][0] - now if self._sleeping else None
+                await self._wait(timeout)
+                continue
+            delay = self.global_bucket.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, chat_key = heapq.heappop(self._ready)
+            queue = self.chats[chat_key]
+            entry = queue.popleft()
+            self.depth -= 1
+            if not entry.granted.done():
+                self.global_bucket.take()
+                if entry.chat_id is not None:
+                    self._chat_bucket(entry.chat_id).take()
+                entry.granted.set_result(None)
+            if queue:
+                self._schedule_chat(chat_key, now)
+            else:
+                del self.chats[chat_key]
+
+    def close(self):
+        self._task.cancel()
+
+
+class SendQueue(BaseRequestMiddleware):
+    """Общий для всех ботов процесса планировщик исходящих запросов"""
+
+    def __init__(self, global_rate: float = 30, private_rate: float = 1.0, group_rate: float = 20 / 60,
+                 chat_burst: float = 3, latency_window: int = 1000):
+        self.global_rate = global_rate
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+
+        self._queues = {}
+        self._pending_edits = {}
+        self._seq = itertools.count()
+        self._wait_times = deque(maxlen=latency_window)
+        self._latencies = deque(maxlen=latency_window)
+        self.stats = {"sent": 0, "errors": 0, "retry_after": 0, "coalesced": 0, "bypassed": 0}
+
+    def _queue_for(self, bot) -> _BotQueue:
+        queue = self._queues.get(bot.id)
+        if queue is None:
+            queue = self._queues[bot.id] = _BotQueue(self, bot.id)
+        return queue
+
+    @staticmethod
+    def _priority(name: str) -> int:
+        if name.startswith("Answer"):
+            return PRIORITY_ANSWER
+        if name.startswith("Edit"):
+            return PRIORITY_EDIT
+        return PRIORITY_SEND
+
+    def _release_key(self, entry: _Entry):
+        if entry.key is not None and self._pending_edits.get(entry.key) is entry:
+            del self._pending_edits[entry.key]
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        if not name.startswith(QUEUED_PREFIXES):
+            self.stats["bypassed"] += 1
+            return await _timed_request(make_request, bot, method, name)
+
+        chat_id = getattr(method, "chat_id", None)
+        key = None
+        if name in COALESCED_METHODS and chat_id is not None and getattr(method, "message_id", None):
+            key = (bot.id, name, chat_id, method.message_id)
+            pending = self._pending_edits.get(key)
+            if pending is not None and not pending.sending:
+                # Предыдущая правка ещё не отправлена: отправим вместо неё эту и вернём общий результат
+                pending.method = method
+                pending.waiters += 1
+                self.stats["coalesced"] += 1
+                return await self._wait(pending)
+
+        queue = self._queue_for(bot)
+        entry = _Entry(method, self._priority(name), next(self._seq), chat_id, key)
+        if key is not None:
+            self._pending_edits[key] = entry
+        entry.task = asyncio.create_task(self._send(queue, entry, make_request, bot))
+        return await self._wait(entry)
+
+    @staticmethod
+    async def _wait(entry: _Entry):
+        try:
+            return await asyncio.shield(entry.task)
+        except asyncio.CancelledError:
+            # Отменён один из ждущих: правка уходит, пока её ждёт хоть кто-то
+            entry.waiters -= 1
+            if entry.waiters == 0:
+                entry.task.cancel()
+            raise
+
+    async def _send(self, queue: _BotQueue, entry: _Entry, make_request, bot):
+        try:
+            return await self._send_with_retries(queue, entry, make_request, bot)
+        finally:
+            # Ключ свободен только после отправки: правки, пришедшие во время паузы после 429, склеиваются
+            self._release_key(entry)
+
+    async def _send_with_retries(self, queue: _BotQueue, entry: _Entry, make_request, bot):
+        while True:
+            queue.put(entry, front=entry.attempts > 0)
+            await entry.granted
+            entry.sending = True
+            waited = time.monotonic() - entry.enqueued
+            self._wait_times.append(waited)
+            SEND_WAIT_SECONDS.observe(waited)
+            try:
+                response = await _timed_request(make_request, bot, entry.method, type(entry.method).__name__)
+            except TelegramRetryAfter as e:
+                # 429: весь бот ждёт retry_after, запрос встаёт в начало очереди своего чата
+                self.stats["retry_after"] += 1
+                queue.pause(e.retry_after)
+                entry.attempts += 1
+                if entry.attempts > MAX_RETRIES:
+                    self.stats["errors"] += 1
+                    raise
+                logging.warning(f"⚠️ Бот {bot.id}: 429, пауза {e.retry_after} сек (попытка {entry.attempts})")
+                entry.granted = asyncio.get_running_loop().create_future()
+                entry.sending = False
+                continue
+            except Exception:
+                self.stats["errors"] += 1
+                raise
+            self.stats["sent"] += 1
+            self._latencies.append(time.monotonic() - entry.enqueued)
+            return response
+
+    @staticmethod
+    def _percentile(values, fraction: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["queue_depth"] = sum(q.depth for q in self._queues.values())
+        stats["bots"] = len(self._queues)
+        stats["paused_bots"] = sum(q.paused_until > time.monotonic() for q in self._queues.values())
+        stats["wait_p50"] = round(self._percentile(self._wait_times, 0.5), 4)
+        stats["wait_p95"] = round(self._percentile(self._wait_times, 0.95), 4)
+        stats["latency_p50"] = round(self._percentile(self._latencies, 0.5), 4)
+        stats["latency_p95"] = round(self._percentile(self._latencies, 0.95), 4)
+        return stats
+
+    def close(self):
+        for queue in self._queues.values():
+            queue.close()
+        self._queues = {}
+
+
+send_queue = SendQueue()
+metrics.gauge("bot_send_queue_depth", "Запросы в очереди отправки",
+              lambda: sum(queue.depth for queue in send_queue._queues.values()))
+metrics.gauge("bot_send_queue_paused_bots", "Боты на паузе после 429",
+              lambda: sum(queue.paused_until > time.monotonic() for queue in send_queue._queues.values()))
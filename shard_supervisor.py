@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/shard_supervisor.py - распределение клонов по процессам-воркерам
+#
+# Супервизор запускает K воркеров (bot_host.py --no-state, по умолчанию K = число
+# ядер) и раскладывает клоны по ним консистентным хешированием. Если воркер
+# упал, его клоны временно переезжают к остальным, а после перезапуска
+# возвращаются; при добавлении воркера переезжает только ~1/K клонов.
+#
+# Управление - тот же протокол, что у bot_host (attach/detach/list/stats),
+# поэтому основной бот в режиме clones.mode = "sharded" просто шлёт токен сюда.
+#
+# Запуск: python3 shard_supervisor.py [--workers K]
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import signal
+import sys
+
+import bot_host
+from atomic_file import write_json_atomic
+from log_pipeline import setup_logging
+
+BASE_DIR = "/var/www/imlerih_bot"
+SUPERVISOR_SOCKET = f"{BASE_DIR}/shard_supervisor.sock"
+SHARDED_CLONES_FILE = f"{BASE_DIR}/sharded_clones.json"
+WORKERS_DIR = f"{BASE_DIR}/workers"
+
+# Виртуальных узлов на воркер: чем больше, тем ровнее распределение
+VIRTUAL_NODES = 64
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class ConsistentHashRing:
+    """Кольцо консистентного хеширования clone_id -> имя воркера"""
+
+    def __init__(self, vnodes: int = VIRTUAL_NODES):
+        self.vnodes = vnodes
+        self._keys = []
+        self._nodes = []
+
+    def add(self, node: str):
+        for i in range(self.vnodes):
+            key = _hash(f"{node}#{i}")
+            index = bisect.bisect(self._keys, key)
+            self._keys.insert(index, key)
+            self._nodes.insert(index, node)
+
+    def remove(self, node: str):
+        pairs = [(k, n) for k, n in zip(self._keys, self._nodes) if n != node]
+        self._keys = [k for k, _ in pairs]
+        self._nodes = [n for _, n in pairs]
+
+    def get(self, key: str):
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._nodes[index]
+
+    def __contains__(self, node: str) -> bool:
+        return node in self._nodes
+
+
+class Worker:
+    """Процесс bot_host.py и его управляющий сокет"""
+
+    def __init__(self, name: str, metrics_port: int = None):
+        self.name = name
+        self.socket_path = f"{WORKERS_DIR}/{name}.sock"
+        self.metrics_port = metrics_port
+        self.process = None
+        self.clones = set()
+        self.restarts = 0
+        self.load = {}
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def spawn(self, ready_timeout: float = 30):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        args = ["--socket", self.socket_path, "--name", self.name, "--no-state"]
+        if self.metrics_port:
+            args += ["--metrics-port", str(self.metrics_port)]
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(BASE_DIR, "bot_host.py"), *args,
+            cwd=BASE_DIR
+        )
+        self.clones = set()
+        # Воркер готов, когда начал отвечать на управляющем сокете
+        deadline = asyncio.get_running_loop().time() + ready_timeout
+        while asyncio.get_running_loop().time() < deadline:
+            if not self.alive:
+                raise RuntimeError(f"воркер {self.name} завершился при старте с кодом {self.process.returncode}")
+            try:
+                await self.command({"cmd": "list"}, timeout=1)
+                logging.info(f"✅ Воркер {self.name} запущен: PID={self.process.pid}")
+                return
+            except (OSError, asyncio.TimeoutError):
+                await asyncio.sleep(0.2)
+        raise RuntimeError(f"воркер {self.name} не ответил за {ready_timeout} сек")
+
+    async def command(self, command: dict, timeout: float = 15) -> dict:
+        return await bot_host.send_command(command, socket_path=self.socket_path, timeout=timeout)
+
+    async def terminate(self):
+        if self.alive:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+
+
+class ShardSupervisor:
+    def __init__(self, workers: int = None, state_file: str = SHARDED_CLONES_FILE,
+                 monitor_interval: float = 5, metrics_port: int = None):
+        self.worker_count = workers or os.cpu_count() or 1
+        self.state_file = state_file
+        self.monitor_interval = monitor_interval
+
+        # Метрики воркера i - на metrics_port + i
+        self.workers = {
+            f"worker_{i}": Worker(f"worker_{i}", metrics_port + i if metrics_port else None)
+            for i in range(self.worker_count)
+        }
+        self.ring = ConsistentHashRing()
+        # clone_id -> token: полный список клонов, которые должны работать
+        self.clones = {}
+        self._lock = asyncio.Lock()
+        self._monitor_task = None
+        self._server = None
+        self.stats = {"moves": 0, "worker_restarts": 0, "attach_errors": 0}
+
+    # ========== СОСТОЯНИЕ ==========
+
+    def _load_state(self):
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    self.clones = json.load(f)
+            except Exception as e:
+                logging.error(f"❌ Ошибка чтения списка клонов супервизора: {e}")
+
+    def _save_state(self):
+        try:
+            write_json_atomic(self.state_file, self.clones)
+            os.chmod(self.state_file, 0o600)
+        except Exception as e:
+            logging.error(f"❌ Ошибка сохранения списка клонов супервизора: {e}")
+
+    # ========== РАСПРЕДЕЛЕНИЕ ==========
+
+    def owner_of(self, clone_id: str):
+        for worker in self.workers.values():
+            if clone_id in worker.clones:
+                return worker
+        return None
+
+    async def _place(self, clone_id: str) -> dict:
+        """Подключает клона к воркеру, которому он принадлежит по кольцу"""
+        target = self.workers.get(self.ring.get(clone_id))
+        if target is None:
+            return {"ok": False, "error": "нет живых воркеров"}
+
+        current = self.owner_of(clone_id)
+        if current is target:
+            return {"ok": True, "clone_id": clone_id, "worker": target.name, "pid": target.process.pid}
+
+        # Сначала отключаем от старого воркера, иначе два getUpdates на один токен конфликтуют
+        if current is not None:
+            current.clones.discard(clone_id)
+            if current.alive:
+                try:
+                    await current.command({"cmd": "detach", "clone_id": clone_id})
+                except (OSError, asyncio.TimeoutError) as e:
+                    logging.warning(f"⚠️ Не удалось отключить {clone_id} от {current.name}: {e}")
+            self.stats["moves"] += 1
+
+        try:
+            response = await target.command({"cmd": "attach", "clone_id": clone_id, "token": self.clones[clone_id]})
+        except (OSError, asyncio.TimeoutError) as e:
+            response = {"ok": False, "error": str(e)}
+        if response.get("ok"):
+            target.clones.add(clone_id)
+            response["worker"] = target.name
+        else:
+            self.stats["attach_errors"] += 1
+            logging.error(f"❌ Не удалось подключить {clone_id} к {target.name}: {response.get('error')}")
+        return response
+
+    async def rebalance(self):
+        """Приводит фактическое размещение клонов в соответствие с кольцом"""
+        async with self._lock:
+            for clone_id in list(self.clones):
+                await self._place(clone_id)
+
+    async def add_clone(self, clone_id: str, token: str) -> dict:
+        async with self._lock:
+            self.clones[clone_id] = token
+            self._save_state()
+            return await self._place(clone_id)
+
+    async def remove_clone(self, clone_id: str) -> dict:
+        async with self._lock:
+            self.clones.pop(clone_id, None)
+            self._save_state()
+            worker = self.owner_of(clone_id)
+            if worker is None:
+                return {"ok": False, "clone_id": clone_id, "error": "not attached"}
+            worker.clones.discard(clone_id)
+            try:
+                return await worker.command({"cmd": "detach", "clone_id": clone_id})
+            except (OSError, asyncio.TimeoutError) as e:
+                # Клона уже нет в self.clones: перезапущенный воркер его не подключит
+                logging.warning(f"⚠️ Не удалось отключить {clone_id} от {worker.name}: {e}")
+                return {"ok": False, "clone_id": clone_id, "error": f"воркер {worker.name} недоступен: {e}"}
+
+    # ========== НАБЛЮДЕНИЕ ЗА ВОРКЕРАМИ ==========
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.monitor_interval)
+            changed = False
+
+            for worker in self.workers.values():
+                if worker.alive:
+                    try:
+                        response = await worker.command({"cmd": "stats"}, timeout=5)
+                        worker.load = response.get("stats", {})
+                    except (OSError, asyncio.TimeoutError) as e:
+                        logging.warning(f"⚠️ Воркер {worker.name} не ответил на stats: {e}")
+                    continue
+
+                if worker.name in self.ring:
+                    # Воркер умер - его клоны переезжают к остальным
+                    code = worker.process.returncode if worker.process else None
+                    logging.error(f"❌ Воркер {worker.name} завершился (код {code}), перераспределяю "
+                                  f"{len(worker.clones)} клонов")
+                    self.ring.remove(worker.name)
+                    worker.clones = set()
+                    changed = True
+
+                try:
+                    await worker.spawn()
+                    worker.restarts += 1
+                    self.stats["worker_restarts"] += 1
+                    self.ring.add(worker.name)
+                    changed = True
+                except Exception as e:
+                    logging.error(f"❌ Не удалось перезапустить воркер {worker.name}: {e}")
+
+            if changed:
+                await self.rebalance()
+
+            logging.info(f"📊 Нагрузка воркеров: {self.get_load()}")
+
+    def get_load(self) -> dict:
+        return {
+            name: {
+                "pid": worker.process.pid if worker.alive else None,
+                "clones": len(worker.clones),
+                "updates_per_sec": round(worker.load.get("updates_per_sec", 0.0), 2),
+                "loop_lag": round(worker.load.get("loop_lag", 0.0), 4),
+                "rss_mb": round(bot_host.read_rss(worker.process.pid) / 1024 / 1024, 1) if worker.alive else 0,
+                "restarts": worker.restarts,
+            }
+            for name, worker in self.workers.items()
+        }
+
+    # ========== УПРАВЛЕНИЕ ==========
+
+    async def handle_command(self, command: dict) -> dict:
+        cmd = command.get("cmd")
+        if cmd == "attach":
+            return await self.add_clone(command["clone_id"], command["token"])
+        if cmd == "detach":
+            return await self.remove_clone(command["clone_id"])
+        if cmd == "list":
+            return {"ok": True, "clones": {name: sorted(w.clones) for name, w in self.workers.items()}}
+        if cmd == "stats":
+            return {"ok": True, "stats": dict(self.stats), "workers": self.get_load()}
+        return {"ok": False, "error": f"unknown command: {cmd}"}
+
+    async def start(self, socket_path: str = SUPERVISOR_SOCKET):
+        os.makedirs(WORKERS_DIR, exist_ok=True)
+        self._load_state()
+
+        for worker in self.workers.values():
+            await worker.spawn()
+            self.ring.add(worker.name)
+
+        await self.rebalance()
+        logging.info(f"✅ Супервизор запущен: воркеров {len(self.workers)}, клонов {len(self.clones)}")
+
+        self._monitor_task = asyncio.create_task(self._monitor())
+        self._server = await bot_host.start_control_server(socket_path, self.handle_command)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+        await asyncio.gather(*[worker.terminate() for worker in self.workers.values()])
+        logging.info("⛔ Супервизор остановлен")
+
+
+async def main(args):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    supervisor = ShardSupervisor(workers=args.workers, metrics_port=args.metrics_port)
+    await supervisor.start(args.socket)
+    try:
+        await stop_event.wait()
+    finally:
+        await supervisor.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Супервизор воркеров с клонами")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--socket", default=SUPERVISOR_SOCKET)
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="первый порт /metrics воркеров (воркер i - порт + i)")
+    args = parser.parse_args()
+
+    setup_logging(f"{BASE_DIR}/logs/shard_supervisor.log",
+                  fmt='%(asctime)s - SUPERVISOR - %(levelname)s - %(message)s')
+
+    asyncio.run(main(args))
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/spam_guard.py - защита от спама, общая для основного бота и клонов
+#
+# Лимит сообщений и капчи считаются по всему парку ботов: иначе пользователь,
+# упёршийся в лимит, просто переходит к клону. Проверка идёт по локальному
+# состоянию процесса (без обращения к базе), а раз в flush_interval секунд
+# процесс одной транзакцией сбрасывает в state.db свои счётчики и события
+# капчи и забирает чужие. Расхождение между ботами - не больше одного интервала.
+
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+
+import metrics
+from expiry import ExpiringDict, ExpiryScheduler
+from rate_limiter import SlidingWindowLimiter
+from state_store import StateStore
+
+# Как часто удалять из базы счётчики и события старше окна
+PRUNE_INTERVAL = 60
+
+CAPTCHAS_ISSUED = metrics.counter("bot_captchas_issued_total", "Выданные капчи (превышен лимит сообщений)")
+SYNC_SECONDS = metrics.histogram("bot_spam_sync_seconds", "Синхронизация защиты от спама с state.db")
+
+
+def generate_captcha() -> tuple[str, int]:
+    a = random.randint(1, 10)
+    b = random.randint(1, 10)
+    operation = random.choice(['+', '-', '*'])
+
+    if operation == '+':
+        answer = a + b
+        text = f"{a} + {b}"
+    elif operation == '-':
+        if a < b:
+            a, b = b, a
+        answer = a - b
+        text = f"{a} - {b}"
+    else:
+        a = random.randint(1, 5)
+        b = random.randint(1, 5)
+        answer = a * b
+        text = f"{a} × {b}"
+
+    return text, answer
+
+
+class SharedCaptchas(ExpiringDict):
+    """Капчи процесса: локальные изменения уходят в общий журнал, чужие применяются при синхронизации"""
+
+    def __init__(self, wheel, ttl: float):
+        super().__init__(wheel, ttl)
+        self.pending = []
+
+    def __setitem__(self, user_id, value):
+        super().__setitem__(user_id, value)
+        self.pending.append((user_id, value["answer"], value["timestamp"]))
+
+    def pop(self, user_id, *default):
+        if user_id in self:
+            self.pending.append((user_id, None, time.time()))
+        return super().pop(user_id, *default)
+
+    def apply_remote(self, user_id, answer, created_at: float):
+        if answer is None:
+            super().pop(user_id, None)
+        elif time.time() - created_at < self.ttl:
+            # Срок - от создания в исходном процессе, а не от синхронизации: капча везде живёт одинаково
+            self.set_until(user_id, {"answer": answer, "timestamp": created_at}, created_at + self.ttl)
+
+
+class SpamGuard:
+    """Лимит "не больше limit сообщений за window секунд" и капчи по всем ботам"""
+
+    def __init__(self, store: StateStore, scheduler: ExpiryScheduler, limit: int = 3, window: float = 30,
+                 captcha_lifetime: float = 300, flush_interval: float = 0.5):
+        self.store = store
+        self.limit = limit
+        self.window = window
+        self.captcha_lifetime = captcha_lifetime
+        self.flush_interval = flush_interval
+        # Метка процесса в общей базе: свои счётчики уже учтены в локальном лимитере
+        self.source = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+        self.limiter = SlidingWindowLimiter(limit, window)
+        self.captchas = scheduler.add_table("captcha", SharedCaptchas(scheduler.wheel, captcha_lifetime))
+        scheduler.add_sweeper(
+            "user_activity",
+            lambda now: self.limiter.expire_idle(now, max_items=len(self.limiter)),
+            self.limiter.__len__
+        )
+
+        # Ещё не записанное в базу: {user_id: {bucket: count}} и пользователи со сброшенным лимитом
+        self._pending_hits = {}
+        self._pending_resets = set()
+        # Сообщения, принятые другими процессами: {user_id: {bucket: count}}
+        self._remote_hits = {}
+        self._captcha_cursor = 0
+        self._last_prune = 0.0
+        self._task = None
+        self.stats = {"limited": 0, "limited_by_fleet": 0, "syncs": 0, "sync_errors": 0,
+                      "remote_captchas": 0, "sync_time": 0.0}
+        metrics.gauge("bot_captchas_active", "Нерешённые капчи", self.captchas.__len__)
+
+    # ========== ПРОВЕРКИ ==========
+
+    def _remote_count(self, user_id, now: float) -> int:
+        buckets = self._remote_hits.get(user_id)
+        if not buckets:
+            return 0
+        since = now - self.window
+        return sum(count for bucket, count in buckets.items() if bucket > since)
+
+    def hit(self, user_id, now: float = None) -> bool:
+        """Учитывает сообщение; True, если лимит превышен (сообщение не засчитывается)"""
+        if now is None:
+            now = time.time()
+        remote = self._remote_count(user_id, now)
+        if remote and remote + self.limiter.count(user_id, now) >= self.limit:
+            self.stats["limited"] += 1
+            self.stats["limited_by_fleet"] += 1
+            return True
+        if self.limiter.check(user_id, now):
+            self.stats["limited"] += 1
+            return True
+        buckets = self._pending_hits.setdefault(user_id, {})
+        bucket = int(now)
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+        return False
+
+    def reset(self, user_id):
+        """Обнуляет счётчик пользователя во всех процессах"""
+        self.limiter.reset(user_id)
+        self._pending_hits.pop(user_id, None)
+        self._remote_hits.pop(user_id, None)
+        self._pending_resets.add(user_id)
+
+    def solve(self, user_id):
+        """Капча решена: снимаем её и обнуляем счётчик во всех процессах"""
+        self.captchas.pop(user_id, None)
+        self.reset(user_id)
+
+    def requires_captcha(self, user_id) -> bool:
+        """Проверяет, требуется ли капча для пользователя (и создаёт её при превышении лимита)"""
+        captcha = self.captchas.get(user_id)
+        if captcha is not None:
+            if time.time() - captcha["timestamp"] > self.captcha_lifetime:
+                self.solve(user_id)
+                return False
+            return True
+
+        current_time = time.time()
+        if self.hit(user_id, current_time):
+            logging.warning(f"⚠️ Превышен лимит для пользователя {user_id}")
+            CAPTCHAS_ISSUED.inc()
+            _, answer = generate_captcha()
+            self.captchas[user_id] = {"answer": answer, "timestamp": current_time}
+            return True
+        return False
+
+    # ========== СИНХРОНИЗАЦИЯ ==========
+
+    async def sync(self):
+        hits, self._pending_hits = self._pending_hits, {}
+        resets, self._pending_resets = self._pending_resets, set()
+        events, self.captchas.pending = self.captchas.pending, []
+        now = time.time()
+
+        started = time.monotonic()
+        try:
+            remote_hits, remote_events = await asyncio.to_thread(
+                self.store.sync_spam_state, self.source, hits, resets, events,
+                int(now - self.window), self._captcha_cursor
+            )
+        except Exception as e:
+            # Не потеряем накопленное: вернём его в очередь на следующую попытку
+            self.stats["sync_errors"] += 1
+            logging.error(f"❌ Ошибка синхронизации защиты от спама: {e}")
+            for user_id, buckets in hits.items():
+                if user_id in self._pending_resets:
+                    continue
+                pending = self._pending_hits.setdefault(user_id, {})
+                for bucket, count in buckets.items():
+                    pending[bucket] = pending.get(bucket, 0) + count
+            self._pending_resets |= resets
+            self.captchas.pending[:0] = events
+            return
+        self.stats["syncs"] += 1
+        self.stats["sync_time"] = time.monotonic() - started
+        SYNC_SECONDS.observe(self.stats["sync_time"])
+
+        remote = {}
+        for user_id, bucket, count in remote_hits:
+            remote.setdefault(user_id, {})[bucket] = count
+        # Сбросы, сделанные после отправки, ещё не дошли до базы
+        for user_id in self._pending_resets:
+            remote.pop(user_id, None)
+        self._remote_hits = remote
+
+        for event_id, user_id, answer, created_at, source in remote_events:
+            self._captcha_cursor = event_id
+            if source == self.source:
+                continue
+            self.stats["remote_captchas"] += 1
+            self.captchas.apply_remote(user_id, answer, created_at)
+            if answer is None:
+                self.limiter.reset(user_id)
+
+        if now - self._last_prune >= PRUNE_INTERVAL:
+            self._last_prune = now
+            try:
+                await asyncio.to_thread(self.store.prune_spam_state, int(now - self.window),
+                                        now - self.captcha_lifetime)
+            except Exception as e:
+                logging.error(f"❌ Ошибка очистки общей защиты от спама: {e}")
+
+    async def _run(self):
+        while True:
+            await self.sync()
+            await asyncio.sleep(self.flush_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Последние счётчики и капчи - в базу, чтобы их увидели остальные боты
+        await self.sync()
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["users"] = len(self.limiter)
+        stats["captchas"] = len(self.captchas)
+        stats["fleet_users"] = len(self._remote_hits)
+        return stats
@@ -0,0 +1,585 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/state_store.py - хранилище состояния на SQLite
+#
+# Заменяет JSON-файлы clone_processes.json, backup_tokens.json, owner_clones.json
+# и status.json, а также хранит общее для всех ботов состояние защиты от спама.
+# База в режиме WAL: основной бот и лаунчер пишут в неё
+# одновременно без потери записей, каждая запись - атомарный upsert одной строки.
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+BASE_DIR = "/var/www/imlerih_bot"
+STATE_DB_FILE = f"{BASE_DIR}/state.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clones (
+    clone_id      TEXT PRIMARY KEY,
+    pid           INTEGER,
+    token_preview TEXT,
+    clone_dir     TEXT,
+    menu          TEXT,
+    status        TEXT NOT NULL DEFAULT 'running',
+    start_time    REAL,
+    updated_at    REAL NOT NULL,
+    pid_start     INTEGER,
+    restarts      INTEGER NOT NULL DEFAULT 0,
+    rss           INTEGER,
+    cpu           REAL,
+    token         TEXT
+);
+CREATE INDEX IF NOT EXISTS clones_status_idx ON clones (status);
+
+CREATE TABLE IF NOT EXISTS backup_tokens (
+    token      TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS owner_clones (
+    owner_token TEXT NOT NULL,
+    clone_token TEXT NOT NULL,
+    created_at  REAL NOT NULL,
+    PRIMARY KEY (owner_token, clone_token)
+);
+
+CREATE TABLE IF NOT EXISTS status (
+    key        TEXT PRIMARY KEY,
+    value      TEXT,
+    updated_at REAL NOT NULL
+);
+
+-- Сообщения пользователей по секундам: source - процесс, который их принял
+CREATE TABLE IF NOT EXISTS spam_hits (
+    user_id INTEGER NOT NULL,
+    bucket  INTEGER NOT NULL,
+    source  TEXT NOT NULL,
+    count   INTEGER NOT NULL,
+    PRIMARY KEY (user_id, bucket, source)
+);
+CREATE INDEX IF NOT EXISTS spam_hits_bucket_idx ON spam_hits (bucket);
+
+-- Журнал капч: answer = NULL - капча решена. Процессы читают журнал по id
+CREATE TABLE IF NOT EXISTS captcha_events (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id    INTEGER NOT NULL,
+    answer     INTEGER,
+    created_at REAL NOT NULL,
+    source     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS captcha_events_created_idx ON captcha_events (created_at);
+
+-- Первый необработанный update_id каждого бота (для getUpdates после перезапуска)
+CREATE TABLE IF NOT EXISTS update_offsets (
+    bot_id     TEXT PRIMARY KEY,
+    "offset"   INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+-- Последняя проверка getMe каждого бота (health_monitor.py)
+CREATE TABLE IF NOT EXISTS bot_health (
+    bot_id               TEXT PRIMARY KEY,
+    name                 TEXT,
+    status               TEXT NOT NULL,
+    username             TEXT,
+    latency              REAL,
+    availability         REAL,
+    consecutive_failures INTEGER NOT NULL DEFAULT 0,
+    error                TEXT,
+    checked_at           REAL NOT NULL,
+    last_ok_at           REAL
+);
+
+-- История проверок: ok = 1/0, latency в секундах
+CREATE TABLE IF NOT EXISTS bot_health_history (
+    bot_id     TEXT NOT NULL,
+    checked_at REAL NOT NULL,
+    ok         INTEGER NOT NULL,
+    latency    REAL
+);
+CREATE INDEX IF NOT EXISTS bot_health_history_idx ON bot_health_history (bot_id, checked_at);
+
+-- Аренда роли основного бота: держатель продлевает её каждые несколько секунд (heartbeat)
+CREATE TABLE IF NOT EXISTS leases (
+    name        TEXT PRIMARY KEY,
+    holder      TEXT NOT NULL,
+    rank        INTEGER NOT NULL,
+    acquired_at REAL NOT NULL,
+    renewed_at  REAL NOT NULL,
+    expires_at  REAL NOT NULL
+);
+
+-- Состояния FSM aiogram (fsm_storage.StateStoreStorage); пустые состояния не хранятся
+CREATE TABLE IF NOT EXISTS fsm_state (
+    key        TEXT PRIMARY KEY,
+    state      TEXT,
+    data       TEXT NOT NULL DEFAULT '{}',
+    expires_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fsm_state_expires_idx ON fsm_state (expires_at);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Колонки clones, которых нет в базах, созданных до их появления
+CLONES_COLUMNS = {
+    "pid_start": "INTEGER",
+    "restarts": "INTEGER NOT NULL DEFAULT 0",
+    "rss": "INTEGER",
+    "cpu": "REAL",
+    "token": "TEXT",
+}
+
+
+class AsyncStateStore:
+    """Те же методы StateStore, но корутины: запрос выполняется в потоке.
+
+    Для вызовов из обработчиков: блокировку соединения держат и фоновые
+    потоки (синхронизация защиты от спама, запись FSM, аренда), а state.db -
+    другие процессы, поэтому даже короткий запрос может ждать до busy_timeout.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getattr__(self, name: str):
+        method = getattr(self._store, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+
+class StateStore:
+    """Встроенная база состояния (SQLite, WAL).
+
+    Методы синхронные: из потоков и при запуске вызываются напрямую, из
+    корутин - через store.aio (await store.aio.get_status(...)). Соединение
+    общее для потоков процесса, запись сериализуется блокировкой.
+    """
+
+    def __init__(self, path: str = STATE_DB_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=10000")
+        self.conn.executescript(SCHEMA)
+        self._add_missing_columns("clones", CLONES_COLUMNS)
+        self.aio = AsyncStateStore(self)
+
+    def _add_missing_columns(self, table: str, columns: dict):
+        """Добавляет в таблицу из старой базы колонки, появившиеся позже"""
+        existing = {row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+        for name, definition in columns.items():
+            if name not in existing:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def _write(self, query: str, params=()):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self.conn.execute(query, params)
+                self.conn.execute("COMMIT")
+                return cursor.rowcount
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _read(self, query: str, params: tuple = ()):
+        with self._lock:
+            return self.conn.execute(query, params).fetchall()
+
+    # ========== КЛОНЫ ==========
+
+    def upsert_clone(self, clone_id: str, pid: int = None, token_preview: str = None, clone_dir: str = None,
+                     menu: str = None, status: str = "running", start_time: float = None,
+                     pid_start: int = None, restarts: int = None, token: str = None):
+        """pid_start - время старта процесса из /proc/<pid>/stat: вместе с pid опознаёт процесс клона"""
+        self._write(
+            """
+            INSERT INTO clones (clone_id, pid, token_preview, clone_dir, menu, status, start_time, updated_at,
+                                pid_start, restarts, token)
+            VALUES (:clone_id, :pid, :token_preview, :clone_dir, :menu, :status, COALESCE(:start_time, :now), :now,
+                    :pid_start, COALESCE(:restarts, 0), :token)
+            ON CONFLICT (clone_id) DO UPDATE SET
+                pid = COALESCE(excluded.pid, clones.pid),
+                pid_start = CASE WHEN :pid IS NULL THEN clones.pid_start ELSE excluded.pid_start END,
+                restarts = COALESCE(:restarts, clones.restarts),
+                token_preview = COALESCE(excluded.token_preview, clones.token_preview),
+                token = COALESCE(excluded.token, clones.token),
+                clone_dir = COALESCE(excluded.clone_dir, clones.clone_dir),
+                menu = COALESCE(excluded.menu, clones.menu),
+                status = excluded.status,
+                start_time = COALESCE(:start_time, clones.start_time),
+                updated_at = excluded.updated_at
+            """,
+            {"clone_id": clone_id, "pid": pid, "token_preview": token_preview, "clone_dir": clone_dir,
+             "menu": menu, "status": status, "start_time": start_time, "now": time.time(),
+             "pid_start": pid_start, "restarts": restarts, "token": token}
+        )
+
+    def set_clone_status(self, clone_id: str, status: str):
+        self._write("UPDATE clones SET status = ?, updated_at = ? WHERE clone_id = ?", (status, time.time(), clone_id))
+
+    def update_clone_resources(self, rows: list):
+        """rows - [(clone_id, rss, cpu, restarts)] одной транзакцией"""
+        if not rows:
+            return
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "UPDATE clones SET rss = ?, cpu = ?, restarts = ?, updated_at = ? WHERE clone_id = ?",
+                    [(rss, cpu, restarts, now, clone_id) for clone_id, rss, cpu, restarts in rows]
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def get_clone(self, clone_id: str):
+        rows = self._read("SELECT * FROM clones WHERE clone_id = ?", (clone_id,))
+        return dict(rows[0]) if rows else None
+
+    def get_clone_token(self, clone_id: str):
+        """Токен клона; у клонов, созданных до clone_runtime, он ещё лежит в <clone_dir>/txt/token.txt"""
+        clone = self.get_clone(clone_id)
+        if clone is None:
+            return None
+        if clone.get("token"):
+            return clone["token"]
+        try:
+            with open(os.path.join(clone["clone_dir"] or "", "txt", "token.txt"), 'r', encoding='utf-8') as f:
+                token = f.read().strip()
+        except OSError:
+            return None
+        if token:
+            self._write("UPDATE clones SET token = ? WHERE clone_id = ?", (token, clone_id))
+        return token or None
+
+    def list_clones(self, status: str = None) -> list:
+        if status is None:
+            rows = self._read("SELECT * FROM clones ORDER BY start_time")
+        else:
+            rows = self._read("SELECT * FROM clones WHERE status = ? ORDER BY start_time", (status,))
+        return [dict(row) for row in rows]
+
+    # ========== ТОКЕНЫ И ВЛАДЕЛЬЦЫ ==========
+
+    def add_backup_token(self, token: str) -> bool:
+        """True, если токен новый"""
+        return self._write("INSERT OR IGNORE INTO backup_tokens (token, created_at) VALUES (?, ?)",
+                           (token, time.time())) > 0
+
+    def has_backup_tokens(self) -> bool:
+        return bool(self._read("SELECT 1 FROM backup_tokens LIMIT 1"))
+
+    def list_backup_tokens(self) -> list:
+        return [row["token"] for row in self._read("SELECT token FROM backup_tokens ORDER BY created_at, rowid")]
+
+    def add_owner_clone(self, owner_token: str, clone_token: str) -> bool:
+        """True, если связь владелец -> клон новая"""
+        return self._write(
+            "INSERT OR IGNORE INTO owner_clones (owner_token, clone_token, created_at) VALUES (?, ?, ?)",
+            (owner_token, clone_token, time.time())
+        ) > 0
+
+    def has_owner_clones(self, owner_token: str) -> bool:
+        return bool(self._read("SELECT 1 FROM owner_clones WHERE owner_token = ? LIMIT 1", (owner_token,)))
+
+    # ========== СТАТУСЫ ==========
+
+    def set_status(self, key: str, value: str):
+        self._write(
+            """
+            INSERT INTO status (key, value, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            """,
+            (key, value, time.time())
+        )
+
+    def get_status(self, key: str, default: str = None) -> str:
+        rows = self._read("SELECT value FROM status WHERE key = ?", (key,))
+        return rows[0]["value"] if rows else default
+
+    # ========== OFFSET GETUPDATES ==========
+
+    def get_update_offset(self, bot_id: str):
+        rows = self._read('SELECT "offset" FROM update_offsets WHERE bot_id = ?', (bot_id,))
+        return rows[0][0] if rows else None
+
+    def set_update_offset(self, bot_id: str, offset: int):
+        self._write(
+            """
+            INSERT INTO update_offsets (bot_id, "offset", updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (bot_id) DO UPDATE SET "offset" = excluded."offset", updated_at = excluded.updated_at
+            """,
+            (bot_id, offset, time.time())
+        )
+
+    # ========== ЗАЩИТА ОТ СПАМА ==========
+
+    def sync_spam_state(self, source: str, hits: dict, resets, captcha_events: list,
+                        since_bucket: int, captcha_cursor: int):
+        """Записывает накопленное процессом source одной транзакцией и читает чужое.
+
+        hits - {user_id: {bucket: count}}, resets - пользователи, чьи счётчики
+        обнуляются во всех процессах, captcha_events - [(user_id, answer, created_at)].
+        Возвращает (чужие счётчики с бакета since_bucket, новые события капчи после captcha_cursor).
+        """
+        if hits or resets or captcha_events:
+            with self._lock:
+                self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self.conn.executemany("DELETE FROM spam_hits WHERE user_id = ?", [(u,) for u in resets])
+                    self.conn.executemany(
+                        """
+                        INSERT INTO spam_hits (user_id, bucket, source, count) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (user_id, bucket, source) DO UPDATE SET count = spam_hits.count + excluded.count
+                        """,
+                        [(user_id, bucket, source, count)
+                         for user_id, buckets in hits.items() for bucket, count in buckets.items()]
+                    )
+                    self.conn.executemany(
+                        "INSERT INTO captcha_events (user_id, answer, created_at, source) VALUES (?, ?, ?, ?)",
+                        [(user_id, answer, created_at, source) for user_id, answer, created_at in captcha_events]
+                    )
+                    self.conn.execute("COMMIT")
+                except BaseException:
+                    self.conn.execute("ROLLBACK")
+                    raise
+
+        remote_hits = self._read(
+            "SELECT user_id, bucket, SUM(count) AS count FROM spam_hits "
+            "WHERE bucket >= ? AND source != ? GROUP BY user_id, bucket",
+            (since_bucket, source)
+        )
+        events = self._read(
+            "SELECT id, user_id, answer, created_at, source FROM captcha_events WHERE id > ? ORDER BY id",
+            (captcha_cursor,)
+        )
+        return [tuple(row) for row in remote_hits], [tuple(row) for row in events]
+
+    def prune_spam_state(self, before_bucket: int, before_time: float):
+        """Удаляет счётчики старше окна и события капчи старше её срока жизни"""
+        self._write("DELETE FROM spam_hits WHERE bucket < ?", (before_bucket,))
+        self._write("DELETE FROM captcha_events WHERE created_at < ?", (before_time,))
+
+    # ========== ЗДОРОВЬЕ БОТОВ ==========
+
+    def save_health(self, results: list):
+        """Записывает результаты одного раунда проверок одной транзакцией.
+
+        results - словари с полями таблицы bot_health (bot_id, name, status, username,
+        latency, availability, consecutive_failures, error, checked_at, last_ok_at).
+        """
+        if not results:
+            return
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    """
+                    INSERT INTO bot_health (bot_id, name, status, username, latency, availability,
+                                            consecutive_failures, error, checked_at, last_ok_at)
+                    VALUES (:bot_id, :name, :status, :username, :latency, :availability,
+                            :consecutive_failures, :error, :checked_at, :last_ok_at)
+                    ON CONFLICT (bot_id) DO UPDATE SET
+                        name = excluded.name,
+                        status = excluded.status,
+                        username = COALESCE(excluded.username, bot_health.username),
+                        latency = excluded.latency,
+                        availability = excluded.availability,
+                        consecutive_failures = excluded.consecutive_failures,
+                        error = excluded.error,
+                        checked_at = excluded.checked_at,
+                        last_ok_at = COALESCE(excluded.last_ok_at, bot_health.last_ok_at)
+                    """,
+                    results
+                )
+                self.conn.executemany(
+                    "INSERT INTO bot_health_history (bot_id, checked_at, ok, latency) VALUES (?, ?, ?, ?)",
+                    [(r["bot_id"], r["checked_at"], int(r["status"] == "online"), r["latency"]) for r in results]
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def get_health(self) -> dict:
+        """bot_id -> последняя проверка"""
+        return {row["bot_id"]: dict(row) for row in self._read("SELECT * FROM bot_health")}
+
+    def get_health_history(self, bot_id: str, since: float) -> list:
+        return [tuple(row) for row in self._read(
+            "SELECT checked_at, ok, latency FROM bot_health_history WHERE bot_id = ? AND checked_at >= ? "
+            "ORDER BY checked_at", (bot_id, since)
+        )]
+
+    def prune_health_history(self, before: float):
+        self._write("DELETE FROM bot_health_history WHERE checked_at < ?", (before,))
+
+    # ========== АРЕНДА (FAILOVER) ==========
+
+    def get_lease(self, name: str):
+        rows = self._read("SELECT * FROM leases WHERE name = ?", (name,))
+        return dict(rows[0]) if rows else None
+
+    def acquire_lease(self, name: str, holder: str, rank: int, ttl: float, grace: float = 0.0):
+        """Берёт или продлевает аренду одной транзакцией.
+
+        Аренду можно взять, если она свободна, истекла больше grace секунд назад,
+        уже принадлежит holder или её держатель с худшим рангом (меньше - главнее).
+        Возвращает (взята ли, аренда до этого вызова).
+        """
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT * FROM leases WHERE name = ?", (name,)).fetchone()
+                previous = dict(row) if row is not None else None
+                if previous is not None and previous["holder"] != holder \
+                        and previous["expires_at"] + grace > now and rank >= previous["rank"]:
+                    self.conn.execute("COMMIT")
+                    return False, previous
+                acquired_at = previous["acquired_at"] if previous and previous["holder"] == holder else now
+                self.conn.execute(
+                    """
+                    INSERT INTO leases (name, holder, rank, acquired_at, renewed_at, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET
+                        holder = excluded.holder, rank = excluded.rank, acquired_at = excluded.acquired_at,
+                        renewed_at = excluded.renewed_at, expires_at = excluded.expires_at
+                    """,
+                    (name, holder, rank, acquired_at, now, now + ttl)
+                )
+                self.conn.execute("COMMIT")
+                return True, previous
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def release_lease(self, name: str, holder: str):
+        """Отдаёт аренду сразу (expires_at = сейчас), не дожидаясь истечения"""
+        now = time.time()
+        self._write("UPDATE leases SET expires_at = ?, renewed_at = ? WHERE name = ? AND holder = ? AND expires_at > ?",
+                    (now, now, name, holder, now))
+
+    # ========== СОСТОЯНИЯ FSM ==========
+
+    def load_fsm(self, key: str):
+        """(state, data, expires_at) или None, если состояния нет или оно истекло"""
+        rows = self._read("SELECT state, data, expires_at FROM fsm_state WHERE key = ? AND expires_at > ?",
+                          (key, time.time()))
+        if not rows:
+            return None
+        return rows[0]["state"], json.loads(rows[0]["data"]), rows[0]["expires_at"]
+
+    def save_fsm(self, rows: list):
+        """rows - [(key, state, data, expires_at)] одной транзакцией; пустое состояние удаляется"""
+        if not rows:
+            return
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "DELETE FROM fsm_state WHERE key = ?",
+                    [(key,) for key, state, data, _ in rows if state is None and not data]
+                )
+                self.conn.executemany(
+                    """
+                    INSERT INTO fsm_state (key, state, data, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET
+                        state = excluded.state, data = excluded.data,
+                        expires_at = excluded.expires_at, updated_at = excluded.updated_at
+                    """,
+                    [(key, state, json.dumps(data, ensure_ascii=False), expires_at, now)
+                     for key, state, data, expires_at in rows if state is not None or data]
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def prune_fsm(self, before: float = None):
+        self._write("DELETE FROM fsm_state WHERE expires_at < ?", (before if before is not None else time.time(),))
+
+    # ========== МИГРАЦИЯ СО СТАРЫХ JSON-ФАЙЛОВ ==========
+
+    def migrate_json_files(self, base_dir: str = BASE_DIR) -> bool:
+        """Однократно переносит данные из старых JSON-файлов. Сами файлы не удаляются."""
+        if self._read("SELECT 1 FROM meta WHERE key = 'json_migrated'"):
+            return False
+
+        def load(name):
+            path = os.path.join(base_dir, name)
+            if not os.path.exists(path):
+                return None
+            try:
+                with open(path, 'r') as f:
+                    content = f.read().strip()
+                return json.loads(content) if content else None
+            except Exception as e:
+                logging.error(f"❌ Миграция: не удалось прочитать {path}: {e}")
+                return None
+
+        processes = load("clone_processes.json") or {}
+        tokens = load("backup_tokens.json") or []
+        owners = load("owner_clones.json") or {}
+        status = load("status.json") or {}
+        now = time.time()
+
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Повторная проверка внутри транзакции: миграцию мог уже выполнить другой процесс
+                if self.conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                    self.conn.execute("ROLLBACK")
+                    return False
+                for clone_id, info in processes.items():
+                    self.conn.execute(
+                        "INSERT OR IGNORE INTO clones (clone_id, pid, token_preview, clone_dir, menu, status, "
+                        "start_time, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (clone_id, info.get("pid"), info.get("token_preview", info.get("token")),
+                         info.get("clone_dir"), info.get("menu"), info.get("status", "running"),
+                         info.get("start_time"), now)
+                    )
+                # Порядок backup_tokens.json сохраняется: от него зависят ранги резервных клонов
+                for i, token in enumerate(tokens):
+                    self.conn.execute("INSERT OR IGNORE INTO backup_tokens (token, created_at) VALUES (?, ?)",
+                                      (token, now + i * 1e-6))
+                for owner_token, clone_tokens in owners.items():
+                    for clone_token in clone_tokens:
+                        self.conn.execute(
+                            "INSERT OR IGNORE INTO owner_clones (owner_token, clone_token, created_at) "
+                            "VALUES (?, ?, ?)", (owner_token, clone_token, now)
+                        )
+                if "clone_status" in status:
+                    self.conn.execute("INSERT OR IGNORE INTO status (key, value, updated_at) VALUES (?, ?, ?)",
+                                      ("clone_status", status["clone_status"], now))
+                self.conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (str(now),))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        logging.info(f"✅ Миграция JSON -> {self.path}: клонов {len(processes)}, токенов {len(tokens)}, "
+                     f"владельцев {len(owners)}")
+        return True
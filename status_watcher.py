@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/status_watcher.py - статус основного бота в памяти
+#
+# main_bot_status.json пишут два источника: сам основной бот ("running") и
+# health_monitor.py ("online", как раньше check_main_bot.sh). Файл читается один раз, дальше фоновая задача
+# раз в interval секунд сравнивает только stat() (mtime, размер, inode) и
+# перечитывает файл, когда он изменился. Меню клонов берёт готовый статус
+# из памяти и не трогает диск.
+
+import asyncio
+import json
+import logging
+import os
+
+# Оба значения означают "основной бот работает"
+RUNNING_STATUSES = ("running", "online")
+STATUS_RUNNING = "running"
+STATUS_UNKNOWN = "unknown"
+
+
+def normalize_status(status) -> str:
+    """Приводит статус из файла к одному словарю: online и running - это running"""
+    if not status:
+        return STATUS_UNKNOWN
+    status = str(status).strip().lower()
+    return STATUS_RUNNING if status in RUNNING_STATUSES else status
+
+
+class StatusWatcher:
+    """Разобранный main_bot_status.json, обновляемый при изменении файла"""
+
+    def __init__(self, path: str, interval: float = 0.25):
+        self.path = path
+        self.interval = interval
+        self.data = {}
+        self.status = STATUS_UNKNOWN
+        self._signature = None
+        self._loaded = False
+        self._task = None
+        self._listeners = []
+        self.stats = {"checks": 0, "reloads": 0, "changes": 0, "errors": 0}
+
+    @property
+    def running(self) -> bool:
+        # Без фоновой задачи (до start()) проверяем файл сами, иначе статус только из памяти
+        if self._task is None:
+            self.refresh()
+        return self.status == STATUS_RUNNING
+
+    def on_change(self, callback):
+        """callback(old_status, new_status) вызывается при смене статуса"""
+        self._listeners.append(callback)
+
+    def refresh(self) -> bool:
+        """Перечитывает файл, если он изменился; True - статус сменился"""
+        self.stats["checks"] += 1
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._loaded = True
+            if self._signature is None and self.status == STATUS_UNKNOWN:
+                return False
+            self._signature = None
+            return self._apply({})
+
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if signature == self._signature:
+            return False
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            # Файл могли переписывать прямо сейчас (echo > file) - повторим на следующей проверке
+            self.stats["errors"] += 1
+            if not self._loaded:
+                logging.warning(f"⚠️ Не удалось прочитать {self.path}: {e}")
+                self._loaded = True
+            return False
+
+        self._signature = signature
+        self._loaded = True
+        self.stats["reloads"] += 1
+        return self._apply(data if isinstance(data, dict) else {})
+
+    def _apply(self, data: dict) -> bool:
+        old = self.status
+        self.data = data
+        self.status = normalize_status(data.get("status"))
+        if self.status == old:
+            return False
+        self.stats["changes"] += 1
+        logging.info(f"🔄 Статус основного бота: {old} -> {self.status}")
+        for callback in self._listeners:
+            try:
+                callback(old, self.status)
+            except Exception as e:
+                logging.error(f"❌ Ошибка обработчика смены статуса: {e}")
+        return True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.refresh()
+
+    def start(self):
+        if self._task is None:
+            self.refresh()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["status"] = self.status
+        return stats
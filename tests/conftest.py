@@ -0,0 +1,18 @@
+# Тесты запускаются из корня репозитория: python3 -m pytest -q
+# Модули бота лежат в корне, а не в пакете, - добавляем его в sys.path.
+
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def free_port() -> int:
+    """Свободный TCP-порт на 127.0.0.1 (для серверов, адрес которых нужен заранее)"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
@@ -0,0 +1,40 @@
+# BotHost против fake_bot_api: одновременные attach/detach одного клона
+
+import asyncio
+
+import pytest
+
+from fake_bot_api import FakeBotAPI
+from state_store import StateStore
+
+# bot_host тянет clone_handlers -> db_pool -> psycopg2
+pytest.importorskip("psycopg2")
+import bot_host  # noqa: E402
+
+TOKEN = "123456:ABCdefGHIjklMNOpqrSTUvwxYZ0123456789"
+
+
+def test_concurrent_attach_starts_one_poller(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot_host, "StateStore", lambda: StateStore(str(tmp_path / "state.db")))
+
+    async def main():
+        api = FakeBotAPI()
+        base_url = await api.start()
+        host = bot_host.BotHost(state_file=None, api_server=base_url)
+        try:
+            first, second = await asyncio.gather(host.attach("clone_1", TOKEN, persist=False),
+                                                 host.attach("clone_1", TOKEN, persist=False))
+            assert first["ok"] and first["mode"] == "polling"
+            assert second == {"ok": True, "clone_id": "clone_1", "already_attached": True}
+            assert len(host._polling_tasks) == 1 and host.stats["attached"] == 1
+            assert sum(c["method"] == "getme" for c in api.calls[TOKEN]) == 1
+
+            detached, again = await asyncio.gather(host.detach("clone_1", persist=False),
+                                                   host.detach("clone_1", persist=False))
+            assert detached["ok"] and not again["ok"]
+            assert not host.bots and not host._polling_tasks
+        finally:
+            await host.session.close()
+            host.store.close()
+            await api.stop()
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+# HealthMonitor против fake_bot_api: статусы, интервалы, запись результатов и чистка истории
+
+import asyncio
+import json
+import time
+
+import pytest
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import ClientSession
+
+import bot_api
+from fake_bot_api import FakeBotAPI
+from health_monitor import (HISTORY_RETENTION, STATUS_BLOCKED, STATUS_OFFLINE, STATUS_ONLINE,
+                            HealthMonitor)
+from state_store import StateStore
+
+MAIN_TOKEN = "100001:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+CLONE_TOKEN = "100002:BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB"
+REVOKED_TOKEN = "100003:CCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCC"
+BROKEN_TOKEN = "100004:DDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDD"
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+    for token in (CLONE_TOKEN, REVOKED_TOKEN, BROKEN_TOKEN):
+        store.add_backup_token(token)
+    yield store
+    store.close()
+
+
+def run(scenario):
+    """Все getMe монитора идут в заглушку через общую сессию bot_api"""
+    async def main():
+        api = FakeBotAPI()
+        base_url = await api.start()
+        session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+        bot_api.set_shared_session(session)
+        try:
+            async with ClientSession() as client:
+                await client.post(f"{base_url}/_revoke/{REVOKED_TOKEN}")
+                await client.post(f"{base_url}/_fail/{BROKEN_TOKEN}/getMe")
+            await scenario(api)
+        finally:
+            await session.close()
+            await bot_api.close_shared_session()
+            await api.stop()
+    asyncio.run(main())
+
+
+def make_monitor(store, tmp_path) -> HealthMonitor:
+    return HealthMonitor(store, main_token=MAIN_TOKEN, status_file=str(tmp_path / "main_bot_status.json"),
+                         healthy_interval=8, failing_interval=1, jitter=0)
+
+
+def test_round_stores_statuses_and_main_status_file(store, tmp_path):
+    monitor = make_monitor(store, tmp_path)
+
+    async def scenario(api):
+        await monitor.run_once()
+
+    run(scenario)
+
+    health = store.get_health()
+    assert health["100001"]["status"] == STATUS_ONLINE
+    assert health["100001"]["username"] == "fake_100001_bot"
+    assert health["100002"]["status"] == STATUS_ONLINE
+    assert health["100003"]["status"] == STATUS_BLOCKED
+    assert health["100004"]["status"] == STATUS_OFFLINE
+    assert health["100003"]["consecutive_failures"] == 1 and health["100003"]["error"]
+    for bot_id in health:
+        assert len(store.get_health_history(bot_id, 0)) == 1
+
+    with open(tmp_path / "main_bot_status.json", encoding="utf-8") as f:
+        status = json.load(f)
+    assert status["status"] == STATUS_ONLINE and status["username"] == "fake_100001_bot"
+    assert monitor.get_stats()["online"] == 2 and monitor.get_stats()["failing"] == 2
+
+
+def test_failing_interval_doubles_up_to_healthy_interval(store, tmp_path):
+    monitor = make_monitor(store, tmp_path)
+    intervals = []
+
+    async def scenario(api):
+        monitor.refresh_fleet()
+        revoked = monitor.bots["100003"]
+        for _ in range(5):
+            await monitor.run_round([revoked])
+            intervals.append(monitor._interval(revoked))
+        assert monitor._interval(monitor.bots["100001"]) == monitor.healthy_interval
+
+    run(scenario)
+    assert intervals == [1, 2, 4, 8, 8]
+    assert len(store.get_health_history("100003", 0)) == 5
+    assert store.get_health()["100003"]["consecutive_failures"] == 5
+
+
+def test_history_older_than_retention_is_pruned(store, tmp_path):
+    now = time.time()
+    old = {"bot_id": "100002", "name": "clone_100002", "status": STATUS_ONLINE, "username": None, "latency": 0.1,
+           "availability": 1.0, "consecutive_failures": 0, "error": None, "last_ok_at": None}
+    store.save_health([{**old, "checked_at": now - HISTORY_RETENTION - 3600}])
+    store.save_health([{**old, "checked_at": now - HISTORY_RETENTION + 3600}])
+    monitor = make_monitor(store, tmp_path)
+
+    async def scenario(api):
+        await monitor.run_once()
+
+    run(scenario)
+    history = store.get_health_history("100002", 0)
+    # Запись старше недели удалена, более свежая и новая проверка остались
+    assert len(history) == 2
+    assert all(checked_at >= now - HISTORY_RETENTION for checked_at, _, _ in history)
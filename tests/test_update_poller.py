@@ -0,0 +1,204 @@
+# UpdatePoller против fake_bot_api: offset после перезапуска, порядок внутри чата,
+# короткий ответ на кнопки из бэклога
+
+import asyncio
+import random
+import threading
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import ClientSession
+
+from fake_bot_api import FakeBotAPI
+from state_store import StateStore
+from update_poller import STALE_CALLBACK_TEXT, UpdatePoller
+
+TOKEN = "123456:ABCdefGHIjklMNOpqrSTUvwxYZ0123456789"
+BOT_ID = "123456"
+
+
+async def wait_for(predicate, timeout: float = 5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "условие не выполнилось вовремя"
+        await asyncio.sleep(0.02)
+
+
+async def push(base_url: str, *messages, updates=()):
+    """messages - пары (chat_id, text); updates - готовые обновления"""
+    async with ClientSession() as session:
+        for chat_id, text in messages:
+            await session.post(f"{base_url}/_push/{TOKEN}", json={"chat_id": chat_id, "text": text})
+        for update in updates:
+            await session.post(f"{base_url}/_push/{TOKEN}", json={"update": update})
+
+
+def run(scenario):
+    async def main():
+        api = FakeBotAPI()
+        base_url = await api.start()
+        bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+        try:
+            await scenario(api, base_url, bot)
+        finally:
+            await bot.session.close()
+            await api.stop()
+    asyncio.run(main())
+
+
+async def run_until(poller: UpdatePoller, predicate):
+    task = asyncio.create_task(poller.run())
+    try:
+        await wait_for(predicate)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def test_offset_is_resumed_after_restart(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+
+    async def scenario(api, base_url, bot):
+        first, second, last_id = [], [], {}
+
+        async def handle_first(update):
+            first.append(update.message.text)
+            last_id["value"] = update.update_id
+
+        async def handle_second(update):
+            second.append(update.message.text)
+
+        await push(base_url, *[(1, f"a{i}") for i in range(5)])
+        await run_until(UpdatePoller(bot, handle_first, store=store, name="first"), lambda: len(first) == 5)
+        # Остановка подтверждает всё обработанное
+        assert store.get_update_offset(BOT_ID) == last_id["value"] + 1
+
+        await push(base_url, *[(1, f"b{i}") for i in range(3)])
+        await run_until(UpdatePoller(bot, handle_second, store=store, name="second"), lambda: len(second) == 3)
+        assert first == [f"a{i}" for i in range(5)]
+        # Второй запуск не видит уже обработанного и не теряет пришедшего за простой
+        assert second == [f"b{i}" for i in range(3)]
+
+    try:
+        run(scenario)
+    finally:
+        store.close()
+
+
+def test_update_in_progress_is_redelivered_after_crash(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+
+    async def scenario(api, base_url, bot):
+        done, blocked, redelivered = [], asyncio.Event(), []
+
+        async def handle_crashing(update):
+            if update.message.text == "slow":
+                await blocked.wait()
+            done.append(update.message.text)
+
+        async def handle_restarted(update):
+            redelivered.append(update.message.text)
+
+        await push(base_url, (1, "one"), (2, "slow"), (3, "three"))
+        crashed = asyncio.create_task(UpdatePoller(bot, handle_crashing, store=store, name="crashed",
+                                                   save_interval=0).run())
+        await wait_for(lambda: sorted(done) == ["one", "three"])
+        # Процесс "упал" посреди "slow": offset не подтверждён, Telegram отдаст обновление снова
+        saved = store.get_update_offset(BOT_ID)
+        slow_id = next(u["update_id"] for u in api.pending[TOKEN] if u["message"]["text"] == "slow")
+        assert saved is None or saved <= slow_id
+
+        await run_until(UpdatePoller(bot, handle_restarted, store=store, name="restarted"),
+                        lambda: "slow" in redelivered)
+        blocked.set()
+        crashed.cancel()
+        await asyncio.gather(crashed, return_exceptions=True)
+
+    try:
+        run(scenario)
+    finally:
+        store.close()
+
+
+def test_chat_order_is_kept_while_chats_run_concurrently():
+    async def scenario(api, base_url, bot):
+        seen, active = {}, {"now": 0, "max": 0}
+
+        async def handle(update):
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+            await asyncio.sleep(random.random() * 0.01)
+            seen.setdefault(update.message.chat.id, []).append(int(update.message.text))
+            active["now"] -= 1
+
+        await push(base_url, *[(i % 5 + 1, str(i)) for i in range(150)])
+        poller = UpdatePoller(bot, handle, name="order", batch_size=40)
+        # catching_up снимается после join - иначе статистика бэклога может ещё не записаться
+        await run_until(poller, lambda: sum(map(len, seen.values())) == 150 and not poller.catching_up)
+
+        assert all(numbers == sorted(numbers) for numbers in seen.values())
+        assert active["max"] > 1
+        stats = poller.get_stats()
+        assert stats["backlog_updates"] == 150 and stats["catchup_rate"] > 0
+
+    run(scenario)
+
+
+def test_stale_callback_is_answered_without_handler():
+    callback = {"callback_query": {"id": "q1", "from": {"id": 1, "is_bot": False, "first_name": "A"},
+                                   "chat_instance": "x", "data": "menu"}}
+
+    async def scenario(api, base_url, bot):
+        handled = []
+
+        async def handle(update):
+            handled.append(update.callback_query.id)
+
+        await push(base_url, updates=[callback])
+        poller = UpdatePoller(bot, handle, name="stale")
+        task = asyncio.create_task(poller.run())
+        try:
+            await wait_for(lambda: not poller.catching_up)
+            answers = [c for c in api.sent.get(TOKEN, []) if c["method"] == "answercallbackquery"]
+            assert answers == [{"method": "answercallbackquery", "callback_query_id": "q1",
+                                "text": STALE_CALLBACK_TEXT}]
+            assert handled == [] and poller.stats["stale_callbacks"] == 1
+
+            # После бэклога кнопка обрабатывается как обычно
+            fresh = {"callback_query": {**callback["callback_query"], "id": "q2"}}
+            await push(base_url, updates=[fresh])
+            await wait_for(lambda: handled == ["q2"])
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    run(scenario)
+
+
+def test_offset_is_written_outside_the_event_loop(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+    threads = []
+    set_update_offset = store.set_update_offset
+
+    def recording(*args):
+        threads.append(threading.current_thread())
+        return set_update_offset(*args)
+
+    store.set_update_offset = recording
+
+    async def scenario(api, base_url, bot):
+        handled = []
+
+        async def handle(update):
+            handled.append(update)
+
+        await push(base_url, (1, "x"))
+        await run_until(UpdatePoller(bot, handle, store=store, name="thread", save_interval=0),
+                        lambda: handled)
+
+    try:
+        run(scenario)
+    finally:
+        store.close()
+    assert threads and all(thread is not threading.main_thread() for thread in threads)
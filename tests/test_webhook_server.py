@@ -0,0 +1,236 @@
+# Вебхуки против fake_bot_api: секретный путь и заголовок, откат на polling, снятие вебхука
+
+import asyncio
+import hashlib
+import hmac
+
+import pytest
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import ClientSession
+
+from fake_bot_api import FakeBotAPI
+from update_poller import UpdatePoller
+from webhook_server import SECRET_HEADER, WebhookServer
+
+TOKEN = "123456:ABCdefGHIjklMNOpqrSTUvwxYZ0123456789"
+SECRET = "test-webhook-secret"
+
+
+def make_bot(base_url: str, token: str = TOKEN) -> Bot:
+    return Bot(token=token, session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+
+
+async def wait_for(predicate, timeout: float = 5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "условие не выполнилось вовремя"
+        await asyncio.sleep(0.02)
+
+
+def run(scenario, free_port):
+    """Поднимает заглушку Bot API и сервер вебхуков, выполняет scenario(api, base_url, server, bot)"""
+    async def main():
+        api = FakeBotAPI()
+        base_url = await api.start()
+        server = WebhookServer(f"http://127.0.0.1:{free_port}", port=free_port, secret=SECRET)
+        await server.start()
+        bot = make_bot(base_url)
+        try:
+            await scenario(api, base_url, server, bot)
+        finally:
+            await server.stop()
+            await bot.session.close()
+            await api.stop()
+    asyncio.run(main())
+
+
+def test_url_and_secret_are_derived_from_hmac(free_port):
+    server = WebhookServer(f"http://127.0.0.1:{free_port}", port=free_port, secret=SECRET)
+    digest = hmac.new(SECRET.encode(), TOKEN.encode(), hashlib.sha256).hexdigest()
+    assert server.url_for(TOKEN) == f"http://127.0.0.1:{free_port}/tg/{digest[:32]}"
+    assert server._derive(TOKEN) == (digest[:32], digest[32:])
+    # Без ключа путь не угадать: другой ключ - другой путь
+    other = WebhookServer("http://example.com", secret="other-secret")
+    assert other.url_for(TOKEN).rsplit("/", 1)[1] != digest[:32]
+
+
+def test_update_is_delivered_to_registered_bot(free_port):
+    async def scenario(api, base_url, server, bot):
+        received = []
+
+        async def on_update(update):
+            received.append(update)
+
+        assert await server.register(bot, on_update)
+        webhook = api.webhooks[TOKEN]
+        assert webhook["url"] == server.url_for(TOKEN)
+        assert webhook["secret_token"] == server._derive(TOKEN)[1]
+
+        async with ClientSession() as session:
+            async with session.post(f"{base_url}/_push/{TOKEN}", json={"chat_id": 7, "text": "/start"}) as resp:
+                body = await resp.json()
+        assert body["delivered"] == "webhook" and body["status"] == 200
+        await wait_for(lambda: received)
+        assert received[0].message.text == "/start"
+        assert server.get_stats()["updates"] == 1
+
+    run(scenario, free_port)
+
+
+def test_updates_are_ordered_per_chat_and_acknowledged_after_processing(free_port):
+    async def scenario(api, base_url, server, bot):
+        release = asyncio.Event()
+        started, finished = [], []
+
+        async def on_update(update):
+            started.append(update.message.text)
+            if update.message.text == "first":
+                await release.wait()
+            finished.append(update.message.text)
+
+        assert await server.register(bot, on_update)
+        async with ClientSession() as session:
+            async def push(chat_id, text):
+                async with session.post(f"{base_url}/_push/{TOKEN}", json={"chat_id": chat_id, "text": text}) as resp:
+                    return (await resp.json())["status"]
+
+            first = asyncio.create_task(push(7, "first"))
+            await wait_for(lambda: started == ["first"])
+            second = asyncio.create_task(push(7, "second"))
+            await wait_for(lambda: server.get_stats()["updates"] == 2)
+            # Другой чат не ждёт занятый
+            assert await push(8, "other") == 200
+            # Второе обновление чата 7 ждёт первое, а Telegram не получил 200 ни на одно из них
+            assert started == ["first", "other"] and not first.done() and not second.done()
+            assert server.get_stats()["in_flight"] == 2
+
+            release.set()
+            assert await first == 200 and await second == 200
+        assert finished == ["other", "first", "second"]
+        assert not api.pending.get(TOKEN)
+
+    run(scenario, free_port)
+
+
+def test_wrong_secret_and_unknown_path_are_rejected(free_port):
+    async def scenario(api, base_url, server, bot):
+        received = []
+
+        async def on_update(update):
+            received.append(update)
+
+        assert await server.register(bot, on_update)
+        url = server.url_for(TOKEN)
+        update = {"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"},
+                                              "text": "hi"}}
+        async with ClientSession() as session:
+            async with session.post(url, json=update, headers={SECRET_HEADER: "wrong"}) as resp:
+                assert resp.status == 401
+            async with session.post(url, json=update) as resp:
+                assert resp.status == 401
+            async with session.post(f"http://127.0.0.1:{free_port}/tg/{'0' * 32}", json=update,
+                                    headers={SECRET_HEADER: server._derive(TOKEN)[1]}) as resp:
+                assert resp.status == 404
+            # Правильный секрет, но бот не зарегистрирован на этом сервере
+            async with session.post(server.url_for("654321:ZYX"), json=update,
+                                    headers={SECRET_HEADER: server._derive("654321:ZYX")[1]}) as resp:
+                assert resp.status == 404
+        await asyncio.sleep(0.05)
+        assert received == []
+        assert server.get_stats()["rejected"] == 4
+
+    run(scenario, free_port)
+
+
+def test_set_webhook_failure_falls_back_to_polling(free_port):
+    async def scenario(api, base_url, server, bot):
+        received = []
+
+        async def on_update(update):
+            received.append(update)
+
+        async with ClientSession() as session:
+            await session.post(f"{base_url}/_fail/{TOKEN}/setWebhook")
+            assert not await server.register(bot, on_update)
+            assert len(server) == 0 and TOKEN not in api.webhooks
+            await session.post(f"{base_url}/_push/{TOKEN}", json={"chat_id": 3, "text": "after fallback"})
+
+        poller = UpdatePoller(bot, on_update, name="fallback")
+        task = asyncio.create_task(poller.run())
+        try:
+            await wait_for(lambda: received)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        assert received[0].message.text == "after fallback"
+
+    run(scenario, free_port)
+
+
+def test_unregister_deletes_webhook_and_undelivered_updates_reach_polling(free_port):
+    async def scenario(api, base_url, server, bot):
+        received = []
+
+        async def failing(update):
+            raise AssertionError("вебхук уже снят")
+
+        async def on_update(update):
+            received.append(update)
+
+        assert await server.register(bot, failing)
+        # Сервер вебхуков недоступен: обновление остаётся у Telegram
+        await server.stop()
+        async with ClientSession() as session:
+            async with session.post(f"{base_url}/_push/{TOKEN}", json={"chat_id": 5, "text": "missed"}) as resp:
+                assert (await resp.json())["delivered"] == "webhook"
+
+        await server.unregister(bot)
+        assert TOKEN not in api.webhooks
+        delete_calls = [c for c in api.calls[TOKEN] if c["method"] == "deletewebhook"]
+        assert len(delete_calls) == 1
+        assert str(delete_calls[0].get("drop_pending_updates")).lower() == "false"
+
+        poller = UpdatePoller(bot, on_update, name="after-webhook")
+        task = asyncio.create_task(poller.run())
+        try:
+            await wait_for(lambda: received)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        assert [u.message.text for u in received] == ["missed"]
+
+    run(scenario, free_port)
+
+
+def test_bot_host_detach_deletes_webhook(free_port, tmp_path, monkeypatch):
+    # bot_host тянет clone_handlers -> db_pool -> psycopg2
+    pytest.importorskip("psycopg2")
+    import bot_host
+    from state_store import StateStore
+
+    monkeypatch.setattr(bot_host, "StateStore", lambda: StateStore(str(tmp_path / "state.db")))
+
+    async def main():
+        api = FakeBotAPI()
+        base_url = await api.start()
+        server = WebhookServer(f"http://127.0.0.1:{free_port}", port=free_port, secret=SECRET)
+        await server.start()
+        host = bot_host.BotHost(state_file=None, webhook=server, api_server=base_url)
+        try:
+            attached = await host.attach("clone_1", TOKEN, persist=False)
+            assert attached["ok"] and attached["mode"] == "webhook"
+            assert TOKEN in api.webhooks
+
+            detached = await host.detach("clone_1", persist=False)
+            assert detached["ok"]
+            assert TOKEN not in api.webhooks
+            assert any(c["method"] == "deletewebhook" for c in api.calls[TOKEN])
+            assert len(server) == 0
+        finally:
+            await server.stop()
+            await host.session.close()
+            host.store.close()
+            await api.stop()
+    asyncio.run(main())
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/text_cache.py - кэш текстов из таблицы interaction
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from atomic_file import write_json_atomic
+from db_pool import connect_kwargs
+
+NOTIFY_CHANNEL = "interaction_changed"
+NOTIFY_TRIGGER = "interaction_changed_notify"
+
+# Версия формата файла-снимка текстов
+SNAPSHOT_FORMAT = 1
+
+# Триггер, который сообщает всем слушателям об изменении строки interaction.
+# В payload передаётся id_message изменённой строки. Устанавливается один раз
+# владельцем таблицы: python3 install_notify_trigger.py
+NOTIFY_TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION notify_interaction_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('{NOTIFY_CHANNEL}', OLD.id_message::text);
+    ELSE
+        PERFORM pg_notify('{NOTIFY_CHANNEL}', NEW.id_message::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS {NOTIFY_TRIGGER} ON interaction;
+CREATE TRIGGER {NOTIFY_TRIGGER}
+    AFTER INSERT OR UPDATE OR DELETE ON interaction
+    FOR EACH ROW EXECUTE FUNCTION notify_interaction_changed();
+"""
+
+
+class TextCache:
+    """Кэш текстов interaction с TTL, ограничением размера (LRU) и
+    инвалидацией по LISTEN/NOTIFY.
+
+    Пока соединение LISTEN живо, изменения в БД сбрасывают записи сразу,
+    а TTL остаётся страховкой на случай пропущенных уведомлений.
+    Устаревшие записи не удаляются, а помечаются: если БД недоступна,
+    отдаётся последнее известное значение.
+
+    При старте кэш заполняется из снимка на диске, а все тексты
+    перечитываются одним запросом в фоне и снимок обновляется.
+    """
+
+    def __init__(self, db_pool, ttl: float = 600, max_size: int = 256,
+                 snapshot_path: str = None, retry_after: float = 30):
+        self.db_pool = db_pool
+        self.ttl = ttl
+        self.max_size = max_size
+        self.snapshot_path = snapshot_path
+        # После ошибки БД столько секунд не ходим в неё за устаревшими записями
+        self.retry_after = retry_after
+        self._db_down_until = 0.0
+        self._snapshot_version = 0
+
+        # message_id -> (text или None, время загрузки)
+        self._entries = OrderedDict()
+        # Запросы к БД, которые уже выполняются, чтобы не дублировать их при одновременных кликах
+        self._inflight = {}
+        self._listen_task = None
+        self._refresh_task = None
+
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "notifications": 0,
+            "bulk_loads": 0,
+        }
+
+    async def get(self, message_id: str):
+        """Возвращает текст (None, если строки нет в БД)"""
+        entry = self._entries.get(message_id)
+        now = time.monotonic()
+
+        if entry is not None and now - entry[1] < self.ttl:
+            self.stats["hits"] += 1
+            self._entries.move_to_end(message_id)
+            return entry[0]
+
+        if entry is not None and now < self._db_down_until:
+            # БД недавно не отвечала - не ждём таймаут подключения на каждом клике
+            self.stats["stale"] += 1
+            return entry[0]
+
+        self.stats["misses"] += 1
+        try:
+            return await self._load(message_id)
+        except Exception:
+            self._db_down_until = time.monotonic() + self.retry_after
+            if entry is None:
+                raise
+            # БД недоступна - отдаём устаревшее значение, это лучше ошибки
+            self.stats["stale"] += 1
+            logging.warning(f"⚠️ БД недоступна, отдаю устаревший текст '{message_id}'")
+            return entry[0]
+
+    async def _load(self, message_id: str):
+        future = self._inflight.get(message_id)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[message_id] = future
+        try:
+            row = await self.db_pool.fetchone(
+                "SELECT text_message FROM interaction WHERE id_message = %s", (message_id,)
+            )
+            text = row[0] if row else None
+            self.put(message_id, text)
+            future.set_result(text)
+            return text
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передаётся вызывающему, ожидающие получат его через future
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(message_id, None)
+
+    def put(self, message_id: str, text, loaded_at: float = None):
+        self._entries[message_id] = (text, time.monotonic() if loaded_at is None else loaded_at)
+        self._entries.move_to_end(message_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, message_id: str = None):
+        """Помечает устаревшей одну запись или весь кэш"""
+        self.stats["invalidations"] += 1
+        if message_id is None:
+            for key, (text, _) in self._entries.items():
+                self._entries[key] = (text, float("-inf"))
+        elif message_id in self._entries:
+            self._entries[message_id] = (self._entries[message_id][0], float("-inf"))
+        # Раз пришло уведомление, БД снова доступна
+        self._db_down_until = 0.0
+
+    # ========== ЗАГРУЗКА ВСЕХ ТЕКСТОВ И СНИМОК НА ДИСКЕ ==========
+
+    async def load_all(self) -> dict:
+        """Загружает все строки interaction одним запросом"""
+        rows = await self.db_pool.fetchall("SELECT id_message, text_message FROM interaction")
+        texts = {row[0]: row[1] for row in rows}
+        now = time.monotonic()
+        for message_id, text in texts.items():
+            self.put(message_id, text, loaded_at=now)
+        self.stats["bulk_loads"] += 1
+        self._db_down_until = 0.0
+        logging.info(f"📥 Загружено текстов из БД: {len(texts)}")
+        return texts
+
+    def load_snapshot(self) -> int:
+        """Заполняет кэш из снимка на диске, возвращает число загруженных текстов"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return 0
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if snapshot.get("format") != SNAPSHOT_FORMAT:
+                logging.warning(f"⚠️ Неизвестный формат снимка текстов: {snapshot.get('format')}")
+                return 0
+            self._snapshot_version = snapshot.get("version", 0)
+            now = time.monotonic()
+            for message_id, text in snapshot.get("texts", {}).items():
+                self.put(message_id, text, loaded_at=now)
+            logging.info(f"📦 Загружен снимок текстов v{self._snapshot_version}: {len(snapshot.get('texts', {}))} шт.")
+            return len(snapshot.get("texts", {}))
+        except Exception as e:
+            logging.error(f"❌ Ошибка чтения снимка текстов: {e}")
+            return 0
+
+    def save_snapshot(self, texts: dict) -> bool:
+        """Атомарно записывает снимок, если тексты изменились"""
+        if not self.snapshot_path:
+            return False
+        try:
+            try:
+                with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                    current = json.load(f)
+                if current.get("texts") == texts:
+                    return False
+                self._snapshot_version = max(self._snapshot_version, current.get("version", 0))
+            except (FileNotFoundError, ValueError):
+                pass
+
+            snapshot = {
+                "format": SNAPSHOT_FORMAT,
+                "version": self._snapshot_version + 1,
+                "saved_at": datetime.now().isoformat() + "Z",
+                "texts": texts
+            }
+            write_json_atomic(self.snapshot_path, snapshot)
+            self._snapshot_version = snapshot["version"]
+            logging.info(f"💾 Снимок текстов сохранён: v{self._snapshot_version}")
+            return True
+        except Exception as e:
+            logging.error(f"❌ Ошибка сохранения снимка текстов: {e}")
+            return False
+
+    async def refresh_all(self, write_snapshot: bool = True) -> bool:
+        try:
+            texts = await self.load_all()
+        except Exception as e:
+            self._db_down_until = time.monotonic() + self.retry_after
+            logging.warning(f"⚠️ Не удалось обновить тексты из БД: {e}")
+            return False
+        if write_snapshot:
+            await asyncio.to_thread(self.save_snapshot, texts)
+        return True
+
+    def start(self, refresh_interval: float = 300, write_snapshot: bool = True, check_trigger: bool = False):
+        """Запускает фоновое обновление текстов и подписку на изменения"""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(
+                self._refresh_loop(refresh_interval, write_snapshot, check_trigger)
+            )
+        self.start_listener()
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        await self.stop_listener()
+
+    async def _refresh_loop(self, refresh_interval: float, write_snapshot: bool, check_trigger: bool):
+        trigger_checked = not check_trigger
+        while True:
+            if not trigger_checked:
+                # Проверяем, пока БД не ответит; об отсутствии триггера сообщаем один раз
+                trigger_checked = await self.has_notify_trigger() is not None
+            await self.refresh_all(write_snapshot)
+            await asyncio.sleep(refresh_interval)
+
+    # ========== LISTEN/NOTIFY ==========
+
+    async def has_notify_trigger(self):
+        """Есть ли триггер уведомлений на interaction; None - БД не ответила"""
+        try:
+            row = await self.db_pool.fetchone(
+                "SELECT 1 FROM pg_trigger WHERE tgname = %s AND tgrelid = 'interaction'::regclass",
+                (NOTIFY_TRIGGER,)
+            )
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось проверить триггер уведомлений interaction: {e}")
+            return None
+        if row is None:
+            logging.warning("⚠️ Триггера уведомлений interaction нет: тексты обновляются только по TTL. "
+                            "Установите его от владельца таблицы: python3 install_notify_trigger.py")
+            return False
+        logging.info("✅ Триггер уведомлений interaction на месте")
+        return True
+
+    def start_listener(self):
+        if self._listen_task is None:
+            self._listen_task = asyncio.create_task(self._listen_loop())
+
+    async def stop_listener(self):
+        if self._listen_task is not None:
+            self._listen_task.cancel()
+            try:
+                await self._listen_task
+            except asyncio.CancelledError:
+                pass
+            self._listen_task = None
+
+    async def _listen_loop(self):
+        loop = asyncio.get_running_loop()
+        retry_delay = 1
+
+        while True:
+            conn = None
+            try:
+                conn = await asyncio.to_thread(psycopg2.connect, **connect_kwargs(self.db_pool.db_config))
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+
+                # Пока соединения не было, уведомления могли потеряться
+                self.invalidate()
+                retry_delay = 1
+                logging.info(f"👂 Подписка на изменения interaction ({NOTIFY_CHANNEL}) активна")
+
+                readable = asyncio.Event()
+                fileno = conn.fileno()
+                loop.add_reader(fileno, readable.set)
+                try:
+                    while True:
+                        await readable.wait()
+                        readable.clear()
+                        conn.poll()
+                        while conn.notifies:
+                            notify = conn.notifies.pop(0)
+                            self.stats["notifications"] += 1
+                            self.invalidate(notify.payload or None)
+                finally:
+                    loop.remove_reader(fileno)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"⚠️ Подписка на изменения interaction потеряна: {e}, повтор через {retry_delay} сек")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 60)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["size"] = len(self._entries)
+        return stats
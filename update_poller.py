@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/update_poller.py - получение обновлений через getUpdates с сохранением offset
+#
+# После перезапуска бот продолжает с последнего обработанного update_id (он
+# хранится в state.db по id бота), а не выбрасывает всё, что пользователи
+# прислали за время простоя. Накопившийся бэклог выбирается пачками по
+# batch_size без ожидания и обрабатывается параллельно: обновления разных
+# чатов - одновременно, одного чата - строго по порядку (UpdateDispatcher,
+# его же использует webhook_server). Нажатия кнопок из бэклога не рисуют
+# меню заново, а получают короткий ответ.
+
+import asyncio
+import logging
+import time
+import weakref
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramConflictError, TelegramUnauthorizedError
+from aiogram.types import Update
+
+import metrics
+
+POLLING_TIMEOUT = 30
+STALE_CALLBACK_TEXT = "⏳ Бот был недоступен. Нажмите кнопку ещё раз."
+
+UPDATE_SECONDS = metrics.histogram("bot_update_seconds", "Обработка одного обновления (без ожидания своего чата)")
+UPDATE_ERRORS = metrics.counter("bot_update_errors_total", "Обновления, обработка которых упала")
+# Все обработчики обновлений процесса: циклы getUpdates и боты на вебхуках (в bot_host - по одному на клона)
+_dispatchers = weakref.WeakSet()
+metrics.gauge("bot_updates_in_flight", "Обновления в обработке",
+              lambda: sum(dispatcher.in_flight for dispatcher in list(_dispatchers)))
+
+
+class UpdateDispatcher:
+    """Обработка обновлений одного бота: разные чаты - параллельно, один чат - по порядку,
+    в работе не больше max_in_flight; handle(update) - корутина обработки"""
+
+    def __init__(self, handle, name: str = "bot", max_in_flight: int = 1000):
+        self.handle = handle
+        self.name = name
+        self.max_in_flight = max_in_flight
+        _dispatchers.add(self)
+
+        self._tasks = set()
+        self._in_flight_ids = set()
+        # Последняя задача каждого чата: следующая задача чата ждёт её завершения
+        self._chains = {}
+        self.stats = {"updates": 0, "update_errors": 0, "stale_callbacks": 0}
+
+    async def wait_for_slot(self):
+        """Не набираем задач больше max_in_flight: сначала пусть часть завершится"""
+        while len(self._tasks) >= self.max_in_flight:
+            await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+
+    async def join(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    # ========== ОБРАБОТКА ==========
+
+    @staticmethod
+    def _chat_key(update: Update):
+        event = update.event
+        chat = getattr(event, "chat", None)
+        if chat is None and getattr(event, "message", None) is not None:
+            chat = event.message.chat
+        if chat is not None:
+            return chat.id
+        user = getattr(event, "from_user", None)
+        return ("user", user.id) if user is not None else None
+
+    def dispatch(self, update: Update, stale: bool = False) -> asyncio.Task:
+        """stale - обновление из бэклога: нажатия кнопок получают короткий ответ без обработки"""
+        key = self._chat_key(update)
+        previous = self._chains.get(key) if key is not None else None
+        self._in_flight_ids.add(update.update_id)
+        task = asyncio.create_task(self._process(update, previous, stale))
+        self._tasks.add(task)
+        if key is not None:
+            self._chains[key] = task
+
+        def done(task, key=key, update_id=update.update_id):
+            self._tasks.discard(task)
+            self._in_flight_ids.discard(update_id)
+            if key is not None and self._chains.get(key) is task:
+                del self._chains[key]
+        task.add_done_callback(done)
+        return task
+
+    async def _process(self, update: Update, previous, stale: bool):
+        if previous is not None:
+            await asyncio.wait([previous])
+        self.stats["updates"] += 1
+        started = time.perf_counter()
+        try:
+            if stale and update.callback_query is not None:
+                # Кнопку нажали, пока бот не работал: меню могло устареть, отвечаем без отрисовки
+                self.stats["stale_callbacks"] += 1
+                try:
+                    await update.callback_query.answer(STALE_CALLBACK_TEXT)
+                except TelegramAPIError:
+                    pass
+                return
+            await self.handle(update)
+        except Exception as e:
+            self.stats["update_errors"] += 1
+            UPDATE_ERRORS.inc()
+            logging.error(f"❌ [{self.name}] Ошибка обработки обновления {update.update_id}: {e}", exc_info=True)
+        finally:
+            UPDATE_SECONDS.observe(time.perf_counter() - started)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+
+class UpdatePoller(UpdateDispatcher):
+    """Цикл getUpdates одного бота; handle(update) - корутина обработки"""
+
+    def __init__(self, bot: Bot, handle, store=None, name: str = "bot", allowed_updates=None,
+                 batch_size: int = 100, max_in_flight: int = 1000, save_interval: float = 1.0):
+        super().__init__(handle, name, max_in_flight)
+        self.bot = bot
+        # store - StateStore; без него offset не сохраняется
+        self.store = store
+        self.allowed_updates = allowed_updates
+        self.batch_size = batch_size
+        self.save_interval = save_interval
+
+        self._offset = None
+        self._saved_offset = None
+        self._last_save = 0.0
+
+        self.catching_up = True
+        self.stats.update({"batches": 0, "polling_errors": 0, "backlog_updates": 0,
+                           "catchup_seconds": 0.0, "catchup_rate": 0.0})
+
+    # ========== OFFSET ==========
+    # state.db - общая для процессов и потоков база: запись может ждать блокировку
+    # до busy_timeout, поэтому чтение и запись offset идут в потоке
+
+    async def _load_offset(self):
+        if self.store is None:
+            return None
+        try:
+            return await asyncio.to_thread(self.store.get_update_offset, str(self.bot.id))
+        except Exception as e:
+            logging.error(f"❌ [{self.name}] Ошибка чтения offset: {e}")
+            return None
+
+    async def _save_offset(self, force: bool = False):
+        """Сохраняет offset, ниже которого всё уже обработано (задачи в работе не подтверждаются)"""
+        if self.store is None or self._offset is None:
+            return
+        offset = min(self._in_flight_ids) if self._in_flight_ids else self._offset
+        if offset == self._saved_offset:
+            return
+        if not force and time.monotonic() - self._last_save < self.save_interval:
+            return
+        # Следующая плановая запись - не раньше чем через save_interval, даже если эта не удалась
+        self._last_save = time.monotonic()
+        try:
+            await asyncio.to_thread(self.store.set_update_offset, str(self.bot.id), offset)
+            self._saved_offset = offset
+        except Exception as e:
+            logging.error(f"❌ [{self.name}] Ошибка сохранения offset: {e}")
+
+    # ========== ЦИКЛ ==========
+
+    async def run(self):
+        """Работает до отмены; TelegramUnauthorizedError (токен отозван) пробрасывается наружу"""
+        saved = await self._load_offset()
+        if saved is not None:
+            self._offset = saved
+            logging.info(f"🔄 [{self.name}] Продолжаю с update_id {saved}")
+
+        retry_delay = 1
+        catchup_started = time.monotonic()
+        try:
+            while True:
+                await self.wait_for_slot()
+
+                try:
+                    # Пока разбираем бэклог - без long polling, следующая пачка сразу
+                    updates = await self.bot.get_updates(
+                        offset=self._offset, limit=self.batch_size,
+                        timeout=0 if self.catching_up else POLLING_TIMEOUT,
+                        allowed_updates=self.allowed_updates
+                    )
+                    retry_delay = 1
+                except TelegramUnauthorizedError:
+                    raise
+                except (TelegramAPIError, asyncio.TimeoutError, OSError) as e:
+                    self.stats["polling_errors"] += 1
+                    if isinstance(e, TelegramConflictError):
+                        logging.warning(f"⚠️ [{self.name}] Токен уже опрашивается другим процессом")
+                    else:
+                        logging.warning(f"⚠️ [{self.name}] Ошибка getUpdates: {e}, повтор через {retry_delay} сек")
+                    await asyncio.sleep(retry_delay)
+                    retry_delay = min(retry_delay * 2, 60)
+                    continue
+
+                self.stats["batches"] += 1
+                for update in updates:
+                    self._offset = update.update_id + 1
+                    self.dispatch(update, stale=self.catching_up)
+                if self.catching_up:
+                    self.stats["backlog_updates"] += len(updates)
+                    if len(updates) < self.batch_size:
+                        await self._finish_catchup(catchup_started)
+                await self._save_offset()
+        finally:
+            await self.join()
+            await self._save_offset(force=True)
+
+    async def _finish_catchup(self, started: float):
+        # Бэклог выбран; ждём его обработки, чтобы замерить реальную скорость разбора
+        await self.join()
+        self.catching_up = False
+        elapsed = time.monotonic() - started
+        backlog = self.stats["backlog_updates"]
+        self.stats["catchup_seconds"] = elapsed
+        self.stats["catchup_rate"] = backlog / elapsed if elapsed > 0 else 0.0
+        if backlog:
+            logging.info(f"📊 [{self.name}] Бэклог разобран: {backlog} обновлений за {elapsed:.2f} сек "
+                         f"({self.stats['catchup_rate']:.1f}/сек), кнопок без отрисовки: "
+                         f"{self.stats['stale_callbacks']}")
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["in_flight"] = self.in_flight
+        stats["catching_up"] = self.catching_up
+        stats["offset"] = self._offset
+        return stats
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# /var/www/imlerih_bot/webhook_server.py - приём обновлений через вебхуки
+#
+# Один aiohttp-сервер на процесс принимает обновления всех его ботов: у каждого
+# бота свой секретный путь <path_prefix>/<hmac(token)>, а Telegram дополнительно
+# присылает секрет в заголовке X-Telegram-Bot-Api-Secret-Token. Вместо N
+# постоянных соединений getUpdates - входящие запросы только когда есть что
+# доставить. Если setWebhook не удался, вызывающий остаётся на polling.
+# Обновления обрабатываются как у UpdatePoller (UpdateDispatcher): разные
+# чаты - параллельно, один чат - по порядку, не больше max_in_flight на бота.
+# Telegram получает 200 только после обработки: если процесс упадёт раньше,
+# обновление будет доставлено повторно.
+
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Update
+from aiohttp import web
+
+from update_poller import UpdateDispatcher
+
+BASE_DIR = "/var/www/imlerih_bot"
+WEBHOOK_SECRET_FILE = f"{BASE_DIR}/txt/webhook_secret.txt"
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def load_or_create_secret(path: str = WEBHOOK_SECRET_FILE) -> str:
+    """Ключ, из которого выводятся пути и секреты вебхуков (одинаковый после перезапуска)"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            secret = f.read().strip()
+        if secret:
+            return secret
+    except FileNotFoundError:
+        pass
+    secret = secrets.token_hex(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(secret)
+    return secret
+
+
+class WebhookServer:
+    """HTTP-сервер вебхуков для всех ботов процесса"""
+
+    def __init__(self, base_url: str, host: str = "127.0.0.1", port: int = 8080, path_prefix: str = "/tg",
+                 secret: str = None, max_in_flight: int = 1000):
+        # base_url - внешний адрес, по которому Telegram достучится до сервера (через nginx и т.п.)
+        self.base_url = base_url.rstrip("/")
+        self.host = host
+        self.port = port
+        self.path_prefix = "/" + path_prefix.strip("/")
+        self.secret = (secret or load_or_create_secret()).encode()
+        self.max_in_flight = max_in_flight
+
+        # путь -> (bot, UpdateDispatcher, secret_token)
+        self._routes = {}
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_post(f"{self.path_prefix}/{{path}}", self._handle)
+        self.stats = {"requests": 0, "updates": 0, "rejected": 0, "bad_requests": 0, "update_errors": 0}
+
+    def _derive(self, token: str) -> tuple[str, str]:
+        digest = hmac.new(self.secret, token.encode(), hashlib.sha256).hexdigest()
+        return digest[:32], digest[32:]
+
+    def url_for(self, token: str) -> str:
+        path, _ = self._derive(token)
+        return f"{self.base_url}{self.path_prefix}/{path}"
+
+    # ========== РЕГИСТРАЦИЯ БОТОВ ==========
+
+    async def register(self, bot: Bot, on_update, allowed_updates=None) -> bool:
+        """Включает вебхук для бота; on_update(update) - корутина обработки.
+
+        False, если Telegram отклонил setWebhook - тогда бот должен работать через polling.
+        """
+        path, secret_token = self._derive(bot.token)
+        dispatcher = UpdateDispatcher(on_update, name=f"webhook {bot.id}", max_in_flight=self.max_in_flight)
+        self._routes[path] = (bot, dispatcher, secret_token)
+        try:
+            # drop_pending_updates=False: накопившееся, пока бот был недоступен, будет доставлено
+            await bot.set_webhook(self.url_for(bot.token), secret_token=secret_token,
+                                  allowed_updates=allowed_updates, drop_pending_updates=False)
+            return True
+        except (TelegramAPIError, asyncio.TimeoutError, OSError) as e:
+            self._routes.pop(path, None)
+            logging.warning(f"⚠️ Не удалось включить вебхук для бота {bot.id}: {e}")
+            return False
+
+    async def unregister(self, bot: Bot, delete_webhook: bool = True):
+        """Перестаёт принимать обновления бота; delete_webhook - вернуть его на getUpdates"""
+        path, _ = self._derive(bot.token)
+        route = self._routes.pop(path, None)
+        if route is not None:
+            # Ошибки обработки остаются в статистике сервера и после снятия бота
+            self.stats["update_errors"] += route[1].stats["update_errors"]
+        if delete_webhook:
+            try:
+                await bot.delete_webhook(drop_pending_updates=False)
+            except (TelegramAPIError, asyncio.TimeoutError, OSError) as e:
+                logging.warning(f"⚠️ Не удалось удалить вебхук бота {bot.id}: {e}")
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    # ========== ПРИЁМ ОБНОВЛЕНИЙ ==========
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.stats["requests"] += 1
+        route = self._routes.get(request.match_info["path"])
+        if route is None:
+            self.stats["rejected"] += 1
+            return web.Response(status=404)
+        bot, dispatcher, secret_token = route
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token):
+            self.stats["rejected"] += 1
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except Exception as e:
+            self.stats["bad_requests"] += 1
+            logging.warning(f"⚠️ Некорректное обновление для бота {bot.id}: {e}")
+            return web.Response(status=400)
+
+        # Пока у бота max_in_flight обновлений в работе, Telegram ждёт ответа (и не шлёт новые)
+        await dispatcher.wait_for_slot()
+        self.stats["updates"] += 1
+        task = dispatcher.dispatch(update)
+        # Ответ - после обработки; обработка не прерывается, даже если Telegram закрыл соединение
+        await asyncio.wait([task])
+        return web.Response()
+
+    # ========== ЗАПУСК ==========
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"👂 Вебхуки: {self.host}:{self.port}{self.path_prefix}/... -> {self.base_url}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        await asyncio.gather(*(dispatcher.join() for _, dispatcher, _ in list(self._routes.values())))
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        dispatchers = [dispatcher for _, dispatcher, _ in self._routes.values()]
+        stats["bots"] = len(dispatchers)
+        stats["update_errors"] += sum(d.stats["update_errors"] for d in dispatchers)
+        stats["in_flight"] = sum(d.in_flight for d in dispatchers)
+        return stats